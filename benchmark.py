@@ -0,0 +1,234 @@
+'''Benchmarks for the ES scenario generator on synthetic TMA data.
+The synthetic data follows the EPWA_config.json/EPWA_flights.json schema, but can be
+scaled far beyond the shipped data. Results are written as JSON, so that runs of
+different versions can be compared with -compare.'''
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+from generator import import_data, build_arrival_index, generate_arrivals_string, \
+                      generate_departures_string, generate_scenario
+from squawk import SquawkAllocator
+from tma_cache import load_tma_data
+
+SYNTHETIC_TMA = 'SYN'
+SYNTHETIC_CENTER = (52.0, 21.0)
+
+
+def format_coordinate(value):
+    '''Coordinates in the JSON files are strings with 7 decimal places.'''
+
+    return f'{value:.7f}'
+
+def build_synthetic_config(airports, entry_fixes, exit_fixes, rng):
+    '''Builds a TMA config with one arrival and one departure runway per airport
+    (e.g. AA33 and AA29 for EPAA). Every entry fix has a STAR to every arrival runway
+    and every exit fix a SID from every departure runway.'''
+
+    center_lat, center_lon = SYNTHETIC_CENTER
+    config = {
+        'pseudopilot_data': 'ALL',
+        'airport_alt': '350.0',
+        'initial_pseudopilot': f'{SYNTHETIC_TMA}_APP',
+        'runway_data': {},
+        'holding_data': [],
+        'controller_data': [{'name': f'{SYNTHETIC_TMA}_APP', 'frequency': '128.805'}],
+        'arrival_spawns': {},
+        'arrivals_star_waypoints': {},
+        'arrivals_fix_headings': {},
+        'arrivals_hourly_rate': {},
+        'arrivals_wave_intervals': {},
+        'arrivals_wave_minimum': {},
+        'arrivals_wave_maximum': {},
+        'departures_first_spawn': {},
+        'departures_spawn_offset': {},
+        'departures_sid_waypoints': {},
+        'requested_altitude_departures': {},
+        'requested_altitude_arrivals': {},
+    }
+
+    for number, fix in enumerate(entry_fixes):
+        bearing = 360 * number / len(entry_fixes)
+        config['arrival_spawns'][fix] = [format_coordinate(center_lat + rng.uniform(-1.5, 1.5)),
+                                         format_coordinate(center_lon + rng.uniform(-2.0, 2.0))]
+        config['arrivals_fix_headings'][fix] = f'{(bearing + 180) % 360:.1f}'
+        config['holding_data'].append({'fix': fix, 'inbound_track': str(int(bearing)), 'turn': 'left'})
+
+    for number, airport in enumerate(airports):
+        lat = center_lat + rng.uniform(-1.0, 1.0)
+        lon = center_lon + rng.uniform(-1.0, 1.0)
+        arrival_runway, departure_runway = airport[2:] + '33', airport[2:] + '29'
+        config['controller_data'].append({'name': f'{airport}_TWR', 'frequency': f'{118.0 + number * 0.025:.3f}'})
+        for runway, heading in ((arrival_runway, '326.0'), (departure_runway, '288.0')):
+            config['runway_data'][runway] = {'lat1': format_coordinate(lat), 'lon1': format_coordinate(lon),
+                                             'lat2': format_coordinate(lat + 0.03), 'lon2': format_coordinate(lon - 0.03),
+                                             'heading': heading}
+
+        config['arrivals_star_waypoints'][arrival_runway] = {fix: f'{fix[:2]}{number:03d} {airport[2:]}501 ILS33'
+                                                             for fix in entry_fixes}
+        config['requested_altitude_arrivals'][arrival_runway] = {fix: '15000' for fix in entry_fixes}
+        config['arrivals_hourly_rate'][arrival_runway] = 1_000_000 # last_wave ends the session
+        config['arrivals_wave_intervals'][arrival_runway] = 5
+        config['arrivals_wave_minimum'][arrival_runway] = 1
+        config['arrivals_wave_maximum'][arrival_runway] = 6
+
+        config['departures_first_spawn'][departure_runway] = [format_coordinate(lat), format_coordinate(lon)]
+        config['departures_spawn_offset'][departure_runway] = ['-2500', '9200']
+        config['departures_sid_waypoints'][departure_runway] = {fix: f'{airport[2:]}901 {airport[2:]}902'
+                                                                for fix in exit_fixes}
+        config['requested_altitude_departures'][airport] = '6000'
+
+    return config
+
+def build_synthetic_flight(callsign, origin, destination, route, altitude, true_air_speed):
+    '''A single flight with all fields of the flights JSON.'''
+
+    return {'callsign': callsign, 'transponder': 'N', 'altitude': str(altitude),
+            'flight_plan_type': 'I', 'aircraft_type': 'B738/M', 'true_air_speed': str(true_air_speed),
+            'origin_airport': origin, 'departure_time_est': '', 'departure_time_act': '',
+            'final_cruising_altitude': '36000', 'destination_airport': destination,
+            'hrs_en_route': '00', 'mins_en_route': '00', 'hrs_fuel': '0', 'mins_fuel': '0',
+            'alternate_airport': '', 'remarks': '/V', 'fpl_route': route,
+            'max_taxi_speed': '20', 'taxiway_usage': '1', 'object_extent': '0.010'}
+
+def build_synthetic_flights(airports, entry_fixes, exit_fixes, arrivals, departures, rng):
+    '''Builds the flights JSON with the requested number of arrivals and departures,
+    spread randomly over the airports and fixes.'''
+
+    callsigns = (f'SYN{number}' for number in itertools.count(1))
+    return {
+        'arrivals': [build_synthetic_flight(next(callsigns), 'EDDF', rng.choice(airports),
+                                            f'ABC DCT DEF DCT {rng.choice(entry_fixes)}',
+                                            rng.randrange(9000, 24000, 1000), 420)
+                     for _ in range(arrivals)],
+        'departures': [build_synthetic_flight(next(callsigns), rng.choice(airports), 'EDDF',
+                                              f'{rng.choice(exit_fixes)} DCT GHI DCT JKL',
+                                              350, 0)
+                       for _ in range(departures)],
+    }
+
+def write_synthetic_tma(data_dir, airports=3, entry_fixes=24, exit_fixes=12,
+                        arrivals=10_000, departures=5_000, seed=0):
+    '''Writes SYN_config.json and SYN_flights.json to data_dir and returns their paths.'''
+
+    rng = random.Random(seed)
+    airport_names = [f'EP{chr(65 + number // 26)}{chr(65 + number % 26)}' for number in range(airports)]
+    entry_fix_names = [f'EN{number:03d}' for number in range(entry_fixes)]
+    exit_fix_names = [f'EX{number:03d}' for number in range(exit_fixes)]
+
+    config_path = os.path.join(data_dir, f'{SYNTHETIC_TMA}_config.json')
+    flights_path = os.path.join(data_dir, f'{SYNTHETIC_TMA}_flights.json')
+    with open(config_path, 'w', encoding='utf-8') as config_file:
+        json.dump(build_synthetic_config(airport_names, entry_fix_names, exit_fix_names, rng), config_file, indent=2)
+    with open(flights_path, 'w', encoding='utf-8') as flights_file:
+        json.dump(build_synthetic_flights(airport_names, entry_fix_names, exit_fix_names,
+                                          arrivals, departures, rng), flights_file, indent=2)
+    return config_path, flights_path, airport_names
+
+def time_case(function, repeat, setup=None):
+    '''Runs function repeat times and returns the wall times in seconds.
+    setup (untimed) prepares the arguments for each run. Output printed by the
+    generator is swallowed, so that it does not distort the timings.'''
+
+    timings = []
+    for _ in range(repeat):
+        arguments = setup() if setup else ()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            function(*arguments)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+def run_benchmarks(data_dir, airport_names, last_wave, departures_per_runway, repeat, seed):
+    '''Runs every benchmark case and returns {case name: timings}.'''
+
+    config_path = os.path.join(data_dir, f'{SYNTHETIC_TMA}_config.json')
+    flights_path = os.path.join(data_dir, f'{SYNTHETIC_TMA}_flights.json')
+    arrival_runways = [airport[2:] + '33' for airport in airport_names]
+    departure_runways = [(airport[2:] + '29', departures_per_runway) for airport in airport_names]
+    random.seed(seed)
+
+    tma_data = load_tma_data(config_path, flights_path)
+    sim_data = tma_data.sim_data
+
+    def wave_arguments():
+        return (arrival_runways, sim_data, build_arrival_index(tma_data.arrival_pools), SquawkAllocator(),
+                0, last_wave)
+
+    def departure_arguments():
+        return (departures_per_runway, departure_runways[0][0], tma_data.departure_pools, sim_data,
+                SquawkAllocator())
+
+    return {
+        'import_data': time_case(lambda: (import_data(config_path), import_data(flights_path)), repeat),
+        'load_tma_data_cold': time_case(lambda: load_tma_data(config_path, flights_path, use_cache=False), repeat),
+        'load_tma_data_cached': time_case(lambda: load_tma_data(config_path, flights_path), repeat),
+        'build_arrival_index': time_case(lambda: build_arrival_index(tma_data.arrival_pools), repeat),
+        'generate_arrivals_string': time_case(generate_arrivals_string, repeat, setup=wave_arguments),
+        'generate_departures_string': time_case(generate_departures_string, repeat, setup=departure_arguments),
+        'generate_scenario': time_case(lambda: generate_scenario(flights_path, config_path, arrival_runways,
+                                                                 departure_runways, last_wave=last_wave), repeat),
+    }
+
+def summarize(timings):
+    '''min/median/max of the timings of each case.'''
+
+    return {case: {'min': min(runs), 'median': statistics.median(runs), 'max': max(runs), 'runs': runs}
+            for case, runs in timings.items()}
+
+def print_comparison(results, baseline):
+    '''Prints the median time of each case against a previous JSON report.'''
+
+    print(f'{"case":<30}{"baseline":>12}{"current":>12}{"ratio":>8}')
+    for case, summary in results['cases'].items():
+        previous = baseline['cases'].get(case)
+        if not previous:
+            print(f'{case:<30}{"-":>12}{summary["median"]:>12.4f}{"-":>8}')
+            continue
+        ratio = summary['median'] / previous['median'] if previous['median'] else float('inf')
+        print(f'{case:<30}{previous["median"]:>12.4f}{summary["median"]:>12.4f}{ratio:>8.2f}')
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmarks the scenario generator on synthetic TMA data.')
+    arg_parser.add_argument('-arrivals', type=int, default=10_000, help='Number of arrivals in the flight library.')
+    arg_parser.add_argument('-departures', type=int, default=5_000, help='Number of departures in the flight library.')
+    arg_parser.add_argument('-airports', type=int, default=3, help='Number of airports (one arrival and one departure runway each).')
+    arg_parser.add_argument('-entry_fixes', type=int, default=24, help='Number of TMA entry fixes.')
+    arg_parser.add_argument('-exit_fixes', type=int, default=12, help='Number of SID exit fixes.')
+    arg_parser.add_argument('-last_wave', type=int, default=240, help='Minute of the last arrival wave.')
+    arg_parser.add_argument('-dep_count', type=int, default=50, help='Number of departures per runway.')
+    arg_parser.add_argument('-repeat', type=int, default=5, help='Number of timed runs per case.')
+    arg_parser.add_argument('-seed', type=int, default=0, help='Seed for the synthetic data and the generator.')
+    arg_parser.add_argument('-output_path', type=str, help='Path to the JSON report. Printed if not provided.')
+    arg_parser.add_argument('-compare', type=str, help='Path to a previous JSON report to compare against.')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        _, _, airport_names = write_synthetic_tma(data_dir, args.airports, args.entry_fixes, args.exit_fixes,
+                                                  args.arrivals, args.departures, args.seed)
+        timings = run_benchmarks(data_dir, airport_names, args.last_wave, args.dep_count, args.repeat, args.seed)
+
+    results = {'python': platform.python_version(),
+               'parameters': {key: value for key, value in vars(args).items() if key not in ('output_path', 'compare')},
+               'cases': summarize(timings)}
+
+    if args.output_path:
+        with open(args.output_path, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        print_comparison(results, import_data(args.compare))
+
+if __name__ == "__main__":
+    main()
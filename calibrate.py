@@ -0,0 +1,217 @@
+'''Monte Carlo calibration of the scenario difficulty. Runs the arrival wave schedule of
+the generator (generator.iter_arrival_schedule) many times with different seeds, without
+rendering any text, and reports the distributions of the total arrivals, the peak number
+of arrivals spawning in any 5 minutes and the session length (minute of the last arrival).
+Sessions are simulated on a pool of worker processes.
+
+It can also suggest arrivals_wave_intervals for a target number of arrivals per hour
+and runway, by simulating every interval for each runway in turn.'''
+
+import argparse
+import dataclasses
+import json
+import math
+import random
+import statistics
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from defaults import DEFAULT_WAVE_START, DEFAULT_LAST_WAVE, DEFAULT_ARRIVALS_HOURLY_RATE, \
+                     CALIBRATION_RUNS, CALIBRATION_WINDOW, MAX_WAVE_INTERVAL
+from generator import build_arrival_index, iter_arrival_schedule
+from synthesizer import FlightSynthesizer
+from tma_registry import registry, validate_runways
+
+SESSIONS_PER_TASK = 250
+
+_calibration_data = {}
+
+
+def simulate_session(tma_data, arrival_runways, start, last_wave, rng):
+    '''The arrivals of one scenario as (spawn minute, runway), in time order.'''
+
+    arrival_index = build_arrival_index(tma_data.arrival_pools, rng)
+    synthesizer = FlightSynthesizer.for_tma(tma_data, rng)
+    return [(minute, runway)
+            for minute, runway, wave in iter_arrival_schedule(arrival_runways, tma_data.sim_data, arrival_index,
+                                                              start, last_wave, rng=rng, synthesizer=synthesizer)
+            for _ in wave]
+
+def session_metrics(arrivals, start, window = CALIBRATION_WINDOW):
+    '''Total arrivals, arrivals per runway, the most arrivals spawning within window minutes
+    and the session length in minutes (up to the last arrival) of a simulated session.'''
+
+    minutes = [minute for minute, _ in arrivals]
+    peak = max((bisect_left(minutes, minute + window) - first for first, minute in enumerate(minutes)), default=0)
+    return {'arrivals': len(arrivals),
+            'runways': Counter(runway for _, runway in arrivals),
+            'peak': peak,
+            'length': minutes[-1] - start if minutes else 0}
+
+def _init_worker(tma_data):
+    '''Stores the TMA data loaded by the parent process in the worker process.'''
+
+    _calibration_data['tma_data'] = tma_data
+
+def _simulate_sessions(seeds, arrival_runways, start, last_wave, overrides):
+    '''Metrics of a session per seed, with the config keys in overrides replaced.'''
+
+    tma_data = _calibration_data['tma_data']
+    if overrides:
+        tma_data = dataclasses.replace(tma_data, sim_data={**tma_data.sim_data, **overrides})
+    return [session_metrics(simulate_session(tma_data, arrival_runways, start, last_wave, random.Random(seed)), start)
+            for seed in seeds]
+
+def describe(values):
+    '''mean, min, 5th/50th/95th percentile and max of the values.'''
+
+    values = sorted(values)
+    if len(values) < 2:
+        values = values * 2 or [0, 0]
+    p5, *_, p95 = statistics.quantiles(values, n=20, method='inclusive')
+    return {'mean': statistics.fmean(values), 'min': values[0], 'p5': p5,
+            'p50': statistics.median(values), 'p95': p95, 'max': values[-1]}
+
+
+class Calibrator:
+    '''Simulates sessions of a TMA on a pool of jobs worker processes.
+    Every simulation draws its seeds from seed, so a seeded calibration is repeatable.'''
+
+    def __init__(self, tma_data, arrival_runways, start = DEFAULT_WAVE_START, last_wave = DEFAULT_LAST_WAVE,
+                 jobs = None, seed = None):
+        self.tma_data = tma_data
+        self.arrival_runways = arrival_runways
+        self.start = start
+        self.last_wave = last_wave
+        self.seed = seed
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(tma_data,))
+
+    def close(self):
+        self.pool.shutdown()
+
+    def simulate(self, runs, overrides = None):
+        '''Metrics of runs sessions, see session_metrics.'''
+
+        seed_source = random.Random(self.seed) if self.seed is not None else random.SystemRandom()
+        seeds = [seed_source.getrandbits(64) for _ in range(runs)]
+        futures = [self.pool.submit(_simulate_sessions, seeds[first:first + SESSIONS_PER_TASK],
+                                    self.arrival_runways, self.start, self.last_wave, overrides)
+                   for first in range(0, runs, SESSIONS_PER_TASK)]
+        return [metrics for future in futures for metrics in future.result()]
+
+    def hourly_rates(self, sessions):
+        '''Mean arrivals per hour of each runway over the simulated sessions.'''
+
+        hours = max(self.last_wave - self.start, 1) / 60
+        return {runway: statistics.fmean(session['runways'][runway] for session in sessions) / hours
+                for runway in self.arrival_runways}
+
+    def report(self, runs):
+        '''Distributions of the metrics over runs sessions.'''
+
+        sessions = self.simulate(runs)
+        return {'runs': runs,
+                'arrival_runways': self.arrival_runways,
+                'start': self.start,
+                'last_wave': self.last_wave,
+                'arrivals': describe([session['arrivals'] for session in sessions]),
+                'runway_arrivals': {runway: describe([session['runways'][runway] for session in sessions])
+                                    for runway in self.arrival_runways},
+                f'peak_{CALIBRATION_WINDOW}_minutes': describe([session['peak'] for session in sessions]),
+                'session_length': describe([session['length'] for session in sessions]),
+                'hourly_rates': self.hourly_rates(sessions)}
+
+    def suggest_intervals(self, target_rate, runs):
+        '''arrivals_wave_intervals that bring every runway closest to target_rate arrivals
+        per hour, chosen one runway at a time with the others at their best interval so far.
+        Also raises arrivals_hourly_rate and arrivals_max_capacity where they would cap the target.'''
+
+        sim_data = self.tma_data.sim_data
+        intervals = {**sim_data['arrivals_wave_intervals']}
+        hourly_rates = {**sim_data.get('arrivals_hourly_rate', {})}
+        for runway in self.arrival_runways:
+            if hourly_rates.get(runway, DEFAULT_ARRIVALS_HOURLY_RATE) < target_rate:
+                hourly_rates[runway] = math.ceil(target_rate)
+        capacities = {**sim_data.get('arrivals_max_capacity', {})}
+        session_target = math.ceil(target_rate * max(self.last_wave - self.start, 1) / 60)
+        for runway in self.arrival_runways:
+            if runway in capacities and capacities[runway] < session_target:
+                capacities[runway] = session_target
+        best_rates = {}
+        for runway in self.arrival_runways:
+            candidates = {}
+            for interval in range(1, MAX_WAVE_INTERVAL + 1):
+                overrides = {'arrivals_wave_intervals': {**intervals, runway: interval},
+                             'arrivals_hourly_rate': hourly_rates,
+                             'arrivals_max_capacity': capacities}
+                candidates[interval] = self.hourly_rates(self.simulate(runs, overrides))
+            intervals[runway] = min(candidates, key=lambda interval: abs(candidates[interval][runway] - target_rate))
+            best_rates = candidates[intervals[runway]]
+        return {'arrivals_wave_intervals': {runway: intervals[runway] for runway in self.arrival_runways},
+                'arrivals_hourly_rate': {runway: hourly_rates.get(runway, DEFAULT_ARRIVALS_HOURLY_RATE)
+                                         for runway in self.arrival_runways},
+                'arrivals_max_capacity': {runway: capacities[runway] for runway in self.arrival_runways
+                                          if runway in capacities},
+                'hourly_rates': best_rates}
+
+
+def format_report(report):
+    '''The distributions of a report as a table.'''
+
+    lines = [f'{report["runs"]} sessions of {" ".join(report["arrival_runways"])}, '
+             f'waves from minute {report["start"]} to {report["last_wave"]}',
+             f'{"":<26}{"mean":>8}{"min":>8}{"p5":>8}{"p50":>8}{"p95":>8}{"max":>8}']
+    rows = [('arrivals', report['arrivals'])]
+    rows += [(f'arrivals {runway}', summary) for runway, summary in report['runway_arrivals'].items()]
+    rows += [(f'peak in {CALIBRATION_WINDOW} minutes', report[f'peak_{CALIBRATION_WINDOW}_minutes']),
+             ('session length (min)', report['session_length'])]
+    for name, summary in rows:
+        lines.append(f'{name:<26}' + ''.join(f'{summary[key]:>8.1f}' for key in ('mean', 'min', 'p5', 'p50', 'p95', 'max')))
+    lines.append('arrivals per hour: ' + ', '.join(f'{runway} {rate:.1f}' for runway, rate in report['hourly_rates'].items()))
+    return '\n'.join(lines)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Simulates the arrival waves of a TMA many times to calibrate the difficulty.')
+    arg_parser.add_argument('TMA', type=str, help='TMA name, eg. EPWA.')
+    arg_parser.add_argument('-arr', nargs='+', required=True, help='List of arrival runways, eg. WA33 MO26.')
+    arg_parser.add_argument('-runs', type=int, default=CALIBRATION_RUNS, help='Number of simulated sessions.')
+    arg_parser.add_argument('-start', type=int, default=DEFAULT_WAVE_START, help='Minute of the first wave.')
+    arg_parser.add_argument('-last_wave', type=int, default=DEFAULT_LAST_WAVE, help='Minute of the last wave.')
+    arg_parser.add_argument('-target_rate', type=float, help='Suggest wave intervals for this many arrivals per hour and runway.')
+    arg_parser.add_argument('-jobs', type=int, help='Number of worker processes. Defaults to the number of CPUs.')
+    arg_parser.add_argument('-seed', type=int, help='Seed of the simulations, for repeatable results.')
+    arg_parser.add_argument('-output_path', type=str, help='Path to a JSON report.')
+    args = arg_parser.parse_args()
+
+    try:
+        if args.runs < 1:
+            raise ValueError('-runs must be at least 1.')
+        tma_data = registry.get(args.TMA)
+        validate_runways(args.TMA, tma_data, args.arr, [])
+        calibrator = Calibrator(tma_data, args.arr, args.start, args.last_wave, args.jobs, args.seed)
+        try:
+            report = calibrator.report(args.runs)
+            print(format_report(report))
+            if args.target_rate is not None:
+                # every interval of every runway is simulated, a tenth of the runs is enough to compare them
+                report['suggestion'] = calibrator.suggest_intervals(args.target_rate, max(args.runs // 10, 100))
+                print(f'\nFor {args.target_rate:g} arrivals per hour and runway, set in the config:')
+                print(json.dumps({key: value for key, value in report['suggestion'].items() if key != 'hourly_rates'},
+                                 indent=4))
+                print('Simulated arrivals per hour: ' + ', '.join(f'{runway} {rate:.1f}' for runway, rate
+                                                                 in report['suggestion']['hourly_rates'].items()))
+        finally:
+            calibrator.close()
+
+        if args.output_path:
+            with open(args.output_path, 'w', encoding='utf-8') as output_file:
+                json.dump(report, output_file, indent=2)
+
+    except FileNotFoundError:
+        print(f'{args.TMA} TMA not found. Ensure the config and flights JSON files are in the data folder.')
+    except ValueError as ve:
+        print(f'Error: {ve}')
+
+if __name__ == "__main__":
+    main()
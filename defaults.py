@@ -3,6 +3,10 @@
 DEFAULT_SPAWN = ('51.0', '20.0')
 # +/- in the middle of Poland
 
+EARTH_RADIUS_NM = 3440.065
+GRID_CELL_SIZE = 0.5 # degrees of latitude, the cells of the entry fix index (see spatial)
+MAX_SNAP_DISTANCE = 100 # nm, arrivals ending further from any entry fix are not snapped to one
+
 MINIMUM_ARRIVAL_ALTITUDE = 5000
 
 DEFAULT_REQ_ALT_ARRIVAL = '10000'
@@ -18,9 +22,52 @@ DEFAULT_OBJECT_EXTENT = '0.010'
 DEFAULT_WAVE_START = 0 # minutes
 DEFAULT_LAST_WAVE = 30 # minutes
 
+DEFAULT_ARRIVALS_HOURLY_RATE = 30 # arrivals per runway per hour, unless set in the config
+DEFAULT_FIX_SEPARATION = 2 # minutes between two arrivals spawning at the same entry fix
+
+MAX_CACHED_FRAMES = 20_000 # compiled flight blocks kept by a renderer, see renderer.FlightRenderer
+
+IMPORT_BATCH_SIZE = 5000 # flights inserted into the flight store at once
+
+CALIBRATION_RUNS = 2000 # simulated sessions per calibration
+CALIBRATION_WINDOW = 5 # minutes, the peak load is the most arrivals spawning within it
+MAX_WAVE_INTERVAL = 20 # minutes, the longest arrivals_wave_intervals tried by the calibration
+
+DEFAULT_WATCH_INTERVAL = 0.5 # seconds between checks of the data folder in watch mode
+
+MINHASH_PERMUTATIONS = 64 # hashes in the signature of a scenario of a diverse batch (see diversity)
+MINHASH_BANDS = 16 # LSH bands of the signature, scenarios sharing any band are compared
+DUPLICATE_SIMILARITY = 0.6 # estimated Jaccard similarity of flights from which a scenario is a near duplicate
+MAX_DIVERSITY_ATTEMPTS = 20 # scenarios generated for one place of a diverse batch before keeping the least similar
+USAGE_PENALTY = 2 # exponent of the uses of a flight or fix lowering its chance in a diverse batch
+
+DEFAULT_SCENARIO_CACHE_DIR = '.scenario_cache'
+DEFAULT_SCENARIO_CACHE_SIZE = 256 * 1024 * 1024 # bytes
+
+DEFAULT_SERVER_HOST = '127.0.0.1'
+DEFAULT_SERVER_PORT = 8000
+MAX_REQUEST_SIZE = 64 * 1024 # bytes
+
 EXCEPTION_MSG_SID_OR_STAR = "Either SID or STAR waypoints must be provided for each flight."
 EXCEPTION_MSG_SID_AND_STAR = "Only one of SID or STAR waypoints should be provided for each flight."
 
 SPAWN_OFFSET_LO, SPAWN_OFFSET_HI = -0.1, 0.1
+NM_PER_DEGREE = 60 # of latitude
+SPAWN_LATERAL_SEPARATION = 3 # nm between arrivals spawning at the same time, unless vertically separated
+SPAWN_VERTICAL_SEPARATION = 1000 # ft
+MAX_PLACEMENT_ATTEMPTS = 50 # new spawn offsets drawn for an arrival too close to another
+MAX_SPAWN_DEVIATION = 20 # nm from the arrival spawn of its entry fix before the validator flags an arrival
+
+COORDINATE_DECIMALS = 7
+DEPARTURE_SPAWN_OFFSET_UNIT = 1e-7
+# departures_spawn_offset in the config is given in units of the 7th decimal place of a degree
+
+DEFAULT_AERODROME_MARGIN = 0.01 # degrees around the runways, unless the config has aerodrome_boundaries
+DEFAULT_DEPARTURE_SLOT_SPACING = 70 # metres between departure slots along a departures_queue
+MAX_DEPARTURE_SLOTS = 500 # per runway
+MAX_DEPARTURE_LANES = 15 # parallel lanes of departures_spawn_offset slots
 
 FIR_PREFIX = 'EP'
+
+DEFAULT_RESERVED_SQUAWKS = ('0000', '1000', '1200', '2000', '7000', '7500', '7600', '7700', '7777')
+# never assigned: no code, conspicuity codes, VFR, emergency, radio failure, hijack and test
@@ -0,0 +1,131 @@
+'''Departure slots: the positions where departing aircraft spawn, per departure runway.
+The slots are computed once when the TMA data is compiled (see tma_cache), so a
+scenario just takes the first n slots of the runway. Every slot lies within the
+aerodrome boundary of the runway's airport.
+
+The config can define the slots of a runway in one of three ways, as float or string coordinates:
+    "departures_slots": {"WA29": [[52.1634482, 20.9753497], ...]}   the slots themselves
+    "departures_queue": {"WA29": [[52.1634482, 20.9753497], ...]}   a taxiway polyline from the
+        holding point backwards, with a slot every departures_slot_spacing metres
+    departures_first_spawn and departures_spawn_offset   a line of slots from the first spawn,
+        continued in parallel lanes next to it whenever it leaves the aerodrome
+
+The boundary is a polygon per airport in "aerodrome_boundaries": {"EPWA": [[lat, lon], ...]},
+by default the box around the airport's runways with DEFAULT_AERODROME_MARGIN around it.
+
+The shipped EPWA config defines none of departures_slots, departures_queue and
+aerodrome_boundaries: its slots are the lanes from departures_first_spawn within the default box.'''
+
+import math
+
+from defaults import FIR_PREFIX, DEPARTURE_SPAWN_OFFSET_UNIT, DEFAULT_AERODROME_MARGIN, \
+                     DEFAULT_DEPARTURE_SLOT_SPACING, MAX_DEPARTURE_SLOTS, MAX_DEPARTURE_LANES
+
+METRES_PER_DEGREE = math.pi / 180 * 6371000 # of latitude
+# the config keys the slots are built from
+SLOT_CONFIG_KEYS = ('runway_data', 'departures_slots', 'departures_queue', 'departures_slot_spacing',
+                    'departures_first_spawn', 'departures_spawn_offset', 'aerodrome_boundaries')
+
+
+def point_in_polygon(latitude, longitude, polygon):
+    '''Ray casting test. Good enough for an aerodrome, where lat/lon is as good as flat.'''
+
+    inside = False
+    previous_lat, previous_lon = polygon[-1]
+    for lat, lon in polygon:
+        if (lat > latitude) != (previous_lat > latitude):
+            crossing_lon = lon + (latitude - lat) * (previous_lon - lon) / (previous_lat - lat)
+            if longitude < crossing_lon:
+                inside = not inside
+        previous_lat, previous_lon = lat, lon
+    return inside
+
+def _to_floats(points):
+    return [(float(lat), float(lon)) for lat, lon in points]
+
+def aerodrome_boundary(sim_data, airport):
+    '''The boundary polygon of the airport, from the config or around its runways.'''
+
+    boundaries = sim_data.get('aerodrome_boundaries', {})
+    if airport in boundaries:
+        return _to_floats(boundaries[airport])
+
+    thresholds = [(float(runway[f'lat{end}']), float(runway[f'lon{end}']))
+                  for designation, runway in sim_data['runway_data'].items()
+                  if FIR_PREFIX + designation[:2] == airport
+                  for end in (1, 2)]
+    if not thresholds:
+        raise ValueError(f'No runways of {airport} to derive its aerodrome boundary from.')
+    south = min(lat for lat, _ in thresholds) - DEFAULT_AERODROME_MARGIN
+    north = max(lat for lat, _ in thresholds) + DEFAULT_AERODROME_MARGIN
+    west = min(lon for _, lon in thresholds) - DEFAULT_AERODROME_MARGIN
+    east = max(lon for _, lon in thresholds) + DEFAULT_AERODROME_MARGIN
+    return [(south, west), (south, east), (north, east), (north, west)]
+
+def slots_along_polyline(polyline, spacing):
+    '''A slot every spacing metres along the polyline, starting at its first point.'''
+
+    slots = [polyline[0]]
+    carried = 0.0 # metres walked since the last slot
+    for (lat1, lon1), (lat2, lon2) in zip(polyline, polyline[1:]):
+        lon_scale = math.cos(math.radians((lat1 + lat2) / 2))
+        length = math.hypot(lat2 - lat1, (lon2 - lon1) * lon_scale) * METRES_PER_DEGREE
+        walked = spacing - carried
+        while walked <= length and len(slots) < MAX_DEPARTURE_SLOTS:
+            fraction = walked / length
+            slots.append((lat1 + fraction * (lat2 - lat1), lon1 + fraction * (lon2 - lon1)))
+            walked += spacing
+        carried = length - (walked - spacing)
+    return slots
+
+def slots_in_lanes(first_spawn, offset, boundary):
+    '''Slots on a line from first_spawn, one offset apart, while inside the boundary.
+    The following lanes are parallel to it, one offset length to either side in turn
+    (0, +1, -1, +2, -2, ...), each starting next to first_spawn.'''
+
+    first_lat, first_lon = first_spawn
+    step_lat, step_lon = (int(value) * DEPARTURE_SPAWN_OFFSET_UNIT for value in offset)
+    if not step_lat and not step_lon:
+        return [first_spawn]
+
+    # perpendicular of the step with the same length in metres, back in degrees
+    lon_scale = math.cos(math.radians(first_lat))
+    lane_lat, lane_lon = -step_lon * lon_scale, step_lat / lon_scale
+
+    slots = []
+    for lane in range(MAX_DEPARTURE_LANES):
+        side = (lane + 1) // 2 * (1 if lane % 2 else -1)
+        lat, lon = first_lat + side * lane_lat, first_lon + side * lane_lon
+        while point_in_polygon(lat, lon, boundary) and len(slots) < MAX_DEPARTURE_SLOTS:
+            slots.append((lat, lon))
+            lat, lon = lat + step_lat, lon + step_lon
+    return slots
+
+def build_departure_slots(sim_data, runway):
+    '''The departure slots of the runway as (latitude, longitude) floats, nearest to the runway first.'''
+
+    airport = FIR_PREFIX + runway[:2]
+    boundary = aerodrome_boundary(sim_data, airport)
+
+    if runway in sim_data.get('departures_slots', {}):
+        slots = _to_floats(sim_data['departures_slots'][runway])
+    elif runway in sim_data.get('departures_queue', {}):
+        slots = slots_along_polyline(_to_floats(sim_data['departures_queue'][runway]),
+                                     sim_data.get('departures_slot_spacing', DEFAULT_DEPARTURE_SLOT_SPACING))
+    else:
+        return slots_in_lanes(_to_floats([sim_data['departures_first_spawn'][runway]])[0],
+                              sim_data['departures_spawn_offset'][runway],
+                              boundary)
+
+    for lat, lon in slots:
+        if not point_in_polygon(lat, lon, boundary):
+            raise ValueError(f'Departure slot ({lat}, {lon}) of runway {runway} is outside of {airport}.')
+    return slots
+
+def build_all_departure_slots(sim_data):
+    '''{runway: slots} for every departure runway in the config.'''
+
+    runways = set(sim_data.get('departures_first_spawn', {})) \
+              | set(sim_data.get('departures_slots', {})) \
+              | set(sim_data.get('departures_queue', {}))
+    return {runway: build_departure_slots(sim_data, runway) for runway in sorted(runways)}
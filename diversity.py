@@ -0,0 +1,179 @@
+'''Diverse batches: scenarios of one runway configuration that differ from each other as
+much as the library allows. Without it, every scenario of a batch draws its flights and
+entry fixes independently, so many come out almost the same.
+
+A DiversitySampler is shared by the scenarios of a batch and replaces the uniform draws
+of the generator: the flights of a pool, the order of the entry fixes in a wave and the
+departures are drawn with the RNG of the scenario by weighted sampling without replacement,
+with weights falling with how often the flight, entry fix or exit fix was used by the
+scenarios accepted so far. The usage of the flights is kept in an array of counters,
+one per callsign.
+
+Every accepted scenario is also added to a ScenarioIndex, which keeps a MinHash signature
+of its flights (callsign with entry or exit fix, and the order of the entry fixes) in
+locality-sensitive hashing buckets. A new scenario is only compared with the scenarios
+sharing a bucket with it, and rejected as a near duplicate of any that are too similar.'''
+
+import random
+import zlib
+from array import array
+from collections import Counter
+
+from defaults import MINHASH_PERMUTATIONS, MINHASH_BANDS, DUPLICATE_SIMILARITY, USAGE_PENALTY
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+class DiversitySampler:
+    '''Usage counts of a batch and the weighted draws based on them. The flights drawn
+    for a scenario are only counted once it is accepted (see commit).'''
+
+    def __init__(self):
+        self.slots = {} # callsign: position in uses
+        self.uses = array('I')
+        self.entry_fix_uses = Counter()
+        self.exit_fix_uses = Counter()
+        self.scenarios = 0
+        self.drawn = []
+
+    def _slot(self, callsign):
+        slot = self.slots.get(callsign)
+        if slot is None:
+            slot = self.slots[callsign] = len(self.uses)
+            self.uses.append(0)
+        return slot
+
+    def flight_uses(self, flight):
+        slot = self.slots.get(flight.callsign)
+        return 0 if slot is None else self.uses[slot]
+
+    def _fix_share(self, uses):
+        '''Uses of a fix per accepted scenario.'''
+
+        return uses / max(self.scenarios, 1)
+
+    def _ordered(self, items, uses, rng):
+        '''The items in the order of a weighted draw without replacement, most likely first.
+        The weight of an item is 1 / (1 + its uses above the least used item) ** USAGE_PENALTY,
+        drawn with Efraimidis-Spirakis keys, random() ** (1 / weight).'''
+
+        least = min(uses, default=0)
+        keys = [rng.random() ** ((1 + item_uses - least) ** USAGE_PENALTY) for item_uses in uses]
+        return [item for _, item in sorted(zip(keys, items), key=lambda pair: pair[0], reverse=True)]
+
+    def arrange_arrivals(self, pool, rng = random):
+        '''A copy of an arrival pool for a scenario, the flights to draw first at its end
+        (see generator.build_arrival_index). Pools of a flight store are shuffled as usual,
+        their flights are only read once drawn.'''
+
+        if hasattr(pool, 'shuffled'):
+            return pool.shuffled(rng)
+        ordered = self._ordered(pool, [self.flight_uses(flight) for flight in pool], rng)
+        ordered.reverse()
+        return ordered
+
+    def arrange_fixes(self, fixes, rng = random):
+        '''Orders the entry fixes of a wave in place, the less used first.'''
+
+        fixes[:] = self._ordered(fixes, [self._fix_share(self.entry_fix_uses[fix]) for fix in fixes], rng)
+
+    def sample_departures(self, pool, n, rng = random):
+        '''n departures of the pool, preferring less used flights and exit fixes. The uses of
+        an exit fix are shared by its flights in the pool, so the flights of a rare exit fix
+        are not drawn over and over. Raises ValueError if the pool has fewer, as random.sample does.'''
+
+        if not 0 <= n <= len(pool):
+            raise ValueError('Sample larger than population or is negative')
+        if hasattr(pool, 'exit_fix_counts'):
+            return self._sample_stored_departures(pool, n, rng)
+        exit_fix_flights = Counter(flight.exit_fix for flight in pool)
+        uses = [self.flight_uses(flight) + self.exit_fix_uses[flight.exit_fix] / exit_fix_flights[flight.exit_fix]
+                for flight in pool]
+        return self._ordered(pool, uses, rng)[:n]
+
+    def _sample_stored_departures(self, pool, n, rng):
+        '''n departures of a flight store pool (see flight_store.StoredPool), which are only
+        read once drawn: the exit fixes are drawn one flight at a time by their uses per
+        flight, then the flights of every exit fix at random.'''
+
+        exit_fix_flights = pool.exit_fix_counts()
+        drawn = Counter()
+        for _ in range(n):
+            exit_fixes = [fix for fix, count in exit_fix_flights.items() if drawn[fix] < count]
+            uses = [(self.exit_fix_uses[fix] + drawn[fix]) / exit_fix_flights[fix] for fix in exit_fixes]
+            drawn[self._ordered(exit_fixes, uses, rng)[0]] += 1
+        departures = [flight for fix, count in drawn.items() for flight in pool.sample_exit_fix(fix, count, rng)]
+        rng.shuffle(departures)
+        return departures
+
+    def draw_arrival(self, flight):
+        '''Notes an arrival drawn for the scenario being generated.'''
+
+        self.drawn.append(('A', flight.callsign, flight.entry_fix))
+
+    def draw_departure(self, flight):
+        '''Notes a departure drawn for the scenario being generated.'''
+
+        self.drawn.append(('D', flight.callsign, flight.exit_fix))
+
+    def take_drawn(self):
+        '''The flights drawn since the last call, as (kind, callsign, fix).'''
+
+        drawn, self.drawn = self.drawn, []
+        return drawn
+
+    def commit(self, drawn):
+        '''Counts the flights of an accepted scenario.'''
+
+        self.scenarios += 1
+        for kind, callsign, fix in drawn:
+            self.uses[self._slot(callsign)] += 1
+            (self.entry_fix_uses if kind == 'A' else self.exit_fix_uses)[fix] += 1
+
+
+def scenario_tokens(drawn):
+    '''The features of a scenario compared by the MinHash: every flight with its fix,
+    and every pair of consecutive entry fixes.'''
+
+    tokens = {f'{kind}:{callsign}:{fix}' for kind, callsign, fix in drawn}
+    entry_fixes = [fix for kind, _, fix in drawn if kind == 'A']
+    tokens.update(f'>{first}:{second}' for first, second in zip(entry_fixes, entry_fixes[1:]))
+    return tokens
+
+
+class ScenarioIndex:
+    '''MinHash signatures of the accepted scenarios in LSH buckets: bands of rows of the
+    signature, two scenarios sharing any band being candidates. With 64 permutations in
+    16 bands, scenarios about half similar or more are likely to share one.'''
+
+    def __init__(self, permutations = MINHASH_PERMUTATIONS, bands = MINHASH_BANDS,
+                 similarity = DUPLICATE_SIMILARITY):
+        # the permutations are fixed, so signatures are comparable across batches
+        permutation_rng = random.Random(permutations)
+        self.permutations = [(permutation_rng.randrange(1, MERSENNE_PRIME), permutation_rng.randrange(MERSENNE_PRIME))
+                             for _ in range(permutations)]
+        self.rows = permutations // bands
+        self.similarity = similarity
+        self.buckets = {} # (band, rows of the band): [positions in signatures]
+        self.signatures = []
+
+    def signature(self, tokens):
+        hashes = [zlib.crc32(token.encode()) for token in tokens] or [0]
+        return tuple(min((a * value + b) % MERSENNE_PRIME for value in hashes) for a, b in self.permutations)
+
+    def _bands(self, signature):
+        for band in range(len(signature) // self.rows):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def most_similar(self, signature):
+        '''The highest estimated Jaccard similarity of the signature with an indexed scenario
+        sharing a bucket with it, 0 if there is none.'''
+
+        candidates = {position for band in self._bands(signature) for position in self.buckets.get(band, ())}
+        return max((sum(mine == theirs for mine, theirs in zip(signature, self.signatures[position]))
+                    / len(signature) for position in candidates), default=0)
+
+    def add(self, signature):
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, []).append(len(self.signatures))
+        self.signatures.append(signature)
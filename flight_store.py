@@ -0,0 +1,420 @@
+'''On-disk flight library for large traffic dumps. The flights are kept in an SQLite
+database next to the TMA config (e.g. data/EPWA_flights.db) and indexed by entry fix,
+exit fix, origin and destination. Loading a TMA from the store only counts the flights
+of each pool; the flights themselves are read when a scenario draws them, so the
+library never has to fit in memory.
+
+Dumps are imported row by row from CSV, JSON Lines (optionally gzipped) or a flights
+JSON file. A row needs callsign, aircraft_type, origin_airport, destination_airport
+and fpl_route (other column names can be mapped to these); the other fields of the
+flights JSON fall back to defaults. Flights to an airport of the TMA become arrivals,
+their route cut at the last TMA entry fix with a STAR to every runway of the airport,
+or snapped to the nearest one (see spatial).
+Flights from an airport of the TMA become departures, their route starting at the
+first SID exit fix of all its departure runways. Other rows are skipped.'''
+
+import csv
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import uuid
+from collections import Counter
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+
+from defaults import FIR_PREFIX, DEFAULT_REQ_ALT_ARRIVAL, DEFAULT_TAXI_SPEED, DEFAULT_TAXIWAY_USAGE, \
+                     DEFAULT_OBJECT_EXTENT, IMPORT_BATCH_SIZE
+from departure_slots import build_all_departure_slots
+from flights import make_flight
+from spatial import EntryFixResolver, airport_fixes
+from tma_cache import TMAData, hash_file
+
+STORE_SUFFIX = '_flights.db'
+ARRIVAL = 'arrival'
+DEPARTURE = 'departure'
+
+REQUIRED_FIELDS = ('callsign', 'aircraft_type', 'origin_airport', 'destination_airport', 'fpl_route')
+# the other fields of a flight in the flights JSON, with the values used when a row has none
+DEFAULT_FIELDS = {
+    'transponder': 'N',
+    'flight_plan_type': 'I',
+    'departure_time_est': '',
+    'departure_time_act': '',
+    'final_cruising_altitude': '',
+    'hrs_en_route': '00',
+    'mins_en_route': '00',
+    'hrs_fuel': '0',
+    'mins_fuel': '0',
+    'alternate_airport': '',
+    'remarks': '/V',
+    'max_taxi_speed': DEFAULT_TAXI_SPEED,
+    'taxiway_usage': DEFAULT_TAXIWAY_USAGE,
+    'object_extent': DEFAULT_OBJECT_EXTENT,
+}
+ARRIVAL_TRUE_AIR_SPEED = '420'
+DEPARTURE_TRUE_AIR_SPEED = '0'
+RECORD_FIELDS = (*REQUIRED_FIELDS, *DEFAULT_FIELDS, 'altitude', 'true_air_speed', 'latitude', 'longitude')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS flights (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    callsign TEXT NOT NULL,
+    origin_airport TEXT NOT NULL,
+    destination_airport TEXT NOT NULL,
+    entry_fix TEXT NOT NULL,
+    exit_fix TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    UNIQUE (kind, callsign)
+);
+CREATE INDEX IF NOT EXISTS arrivals_by_entry_fix ON flights (kind, entry_fix, destination_airport, position);
+CREATE INDEX IF NOT EXISTS departures_by_origin ON flights (kind, origin_airport, position);
+CREATE INDEX IF NOT EXISTS departures_by_exit_fix ON flights (kind, exit_fix, origin_airport);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+'''
+INSERT_FLIGHT = ('INSERT INTO flights (kind, callsign, origin_airport, destination_airport, entry_fix, exit_fix, '
+                 'position, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def get_store_path(config_path):
+    '''data/EPWA_config.json -> data/EPWA_flights.db'''
+
+    root = config_path[:-len('_config.json')] if config_path.endswith('_config.json') else config_path
+    return root + STORE_SUFFIX
+
+
+@dataclass
+class ImportReport:
+    '''Counts of an import: rows read, usable rows per kind, duplicate callsigns among them,
+    skipped rows by reason and the flights per kind in the store afterwards.'''
+
+    rows: int = 0
+    usable: Counter = field(default_factory=Counter)
+    duplicates: int = 0
+    skipped: Counter = field(default_factory=Counter)
+    stored: Counter = field(default_factory=Counter)
+
+    def __str__(self):
+        lines = [f'{self.rows} rows read: {self.usable[ARRIVAL]} arrivals and {self.usable[DEPARTURE]} departures, '
+                 f'{self.duplicates} of them with a callsign already in the store.']
+        lines += [f'{count} rows skipped: {reason}' for reason, count in self.skipped.most_common()]
+        lines.append(f'The store holds {self.stored[ARRIVAL]} arrivals and {self.stored[DEPARTURE]} departures.')
+        return '\n'.join(lines)
+
+
+class FlightMapper:
+    '''Turns dump rows into flight records of the TMA, see the module docstring.'''
+
+    def __init__(self, sim_data, column_map=None):
+        self.sim_data = sim_data
+        self.column_map = column_map or {}
+        self.departure_altitude = str(int(float(sim_data['airport_alt'])))
+        self.resolver = EntryFixResolver(sim_data)
+        self.entry_fixes = self.resolver.entry_fixes
+        self.exit_fixes = airport_fixes(sim_data['departures_sid_waypoints'])
+        self.arrival_altitudes = {}
+        for runway, altitudes in sim_data['requested_altitude_arrivals'].items():
+            for fix, altitude in altitudes.items():
+                self.arrival_altitudes.setdefault((FIR_PREFIX + runway[:2], fix), str(altitude))
+
+    def map(self, row, kind=None):
+        '''Returns (kind, flight record) or (None, reason) for rows that cannot be used.
+        kind is derived from the airports unless given.'''
+
+        row = {self.column_map.get(column, column): value for column, value in row.items()}
+        missing = [name for name in REQUIRED_FIELDS if not row.get(name)]
+        if missing:
+            return None, f'missing {", ".join(missing)}'
+        record = {**DEFAULT_FIELDS,
+                  **{name: str(value).strip() for name, value in row.items()
+                     if name in RECORD_FIELDS and value not in (None, '')}}
+        route = record['fpl_route'].split()
+
+        if kind in (None, ARRIVAL) and record['destination_airport'] in self.entry_fixes:
+            route = self.resolver.resolve(record['destination_airport'], route,
+                                          record.get('latitude'), record.get('longitude'))
+            if route is None:
+                return None, 'no TMA entry fix in or near the route'
+            record.setdefault('altitude', self.arrival_altitudes.get((record['destination_airport'], route[-1]),
+                                                                     DEFAULT_REQ_ALT_ARRIVAL))
+            record.setdefault('true_air_speed', ARRIVAL_TRUE_AIR_SPEED)
+            kind = ARRIVAL
+        elif kind in (None, DEPARTURE) and record['origin_airport'] in self.exit_fixes:
+            exit_fixes = self.exit_fixes[record['origin_airport']]
+            starts = [position for position, waypoint in enumerate(route) if waypoint in exit_fixes]
+            if not starts:
+                return None, 'no SID exit fix in the route'
+            route = route[starts[0]:]
+            record.setdefault('altitude', self.departure_altitude)
+            record.setdefault('true_air_speed', DEPARTURE_TRUE_AIR_SPEED)
+            kind = DEPARTURE
+        else:
+            return None, 'neither from nor to an airport of the TMA'
+
+        record['fpl_route'] = ' '.join(route)
+        try:
+            int(record['altitude'])
+        except ValueError:
+            return None, 'altitude is not a whole number'
+        return kind, record
+
+
+def iter_dump_rows(path):
+    '''Yields (kind or None, row dict) from a CSV, JSON Lines or flights JSON file, reading
+    CSV and JSON Lines line by line. .gz files are decompressed on the fly.'''
+
+    name = path[:-len('.gz')] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    with (gzip.open(path, 'rt', encoding='utf-8', newline='') if path.endswith('.gz')
+          else open(path, 'r', encoding='utf-8', newline='')) as dump_file:
+        if extension == '.csv':
+            for row in csv.DictReader(dump_file):
+                yield None, row
+        elif extension in ('.jsonl', '.ndjson'):
+            for line in dump_file:
+                if line.strip():
+                    yield None, json.loads(line)
+        elif extension == '.json':
+            flight_data = json.load(dump_file)
+            for kind, key in ((ARRIVAL, 'arrivals'), (DEPARTURE, 'departures')):
+                for row in flight_data.get(key, []):
+                    yield kind, row
+        else:
+            raise ValueError(f'Unknown dump format of {path}, expected .csv, .jsonl or .json.')
+
+
+class FlightStore:
+    '''The SQLite flight library of a TMA. Every flight has a position in its pool
+    (0, 1, 2, ... in the order of import), so a drawn position is read through the
+    pool's index. Only the path is pickled, so a store can be handed to worker processes,
+    which open their own connection.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @property
+    def connection(self):
+        # a connection must not cross a fork, e.g. into batch workers
+        if self._connection is None or self._pid != os.getpid():
+            # read by the thread that generates the scenario, e.g. in the GUI
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def revision(self):
+        '''Changes with every import, so cached scenarios of the old library are not reused.'''
+
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return row[0] if row else ''
+
+    def import_dump(self, path, mapper, report=None):
+        '''Streams the dump into the store in batches, all in one transaction.
+        Flights with a callsign already in the store are ignored. Fields with their default
+        value are left out of the stored record. Returns the ImportReport.'''
+
+        report = report or ImportReport()
+        connection = self.connection
+        callsigns = {ARRIVAL: set(), DEPARTURE: set()}
+        for kind, callsign in connection.execute('SELECT kind, callsign FROM flights'):
+            callsigns[kind].add(callsign)
+        pool_sizes = Counter({(ARRIVAL, (fix, airport)): count for fix, airport, count in connection.execute(
+            'SELECT entry_fix, destination_airport, COUNT(*) FROM flights WHERE kind = ? '
+            'GROUP BY entry_fix, destination_airport', (ARRIVAL,))})
+        pool_sizes.update({(DEPARTURE, airport): count for airport, count in connection.execute(
+            'SELECT origin_airport, COUNT(*) FROM flights WHERE kind = ? GROUP BY origin_airport', (DEPARTURE,))})
+
+        batch = []
+        with connection:
+            for kind, row in iter_dump_rows(path):
+                report.rows += 1
+                kind, record = mapper.map(row, kind)
+                if kind is None:
+                    report.skipped[record] += 1
+                    continue
+                report.usable[kind] += 1
+                if record['callsign'] in callsigns[kind]:
+                    report.duplicates += 1
+                    continue
+                callsigns[kind].add(record['callsign'])
+
+                route = record['fpl_route'].split()
+                pool = (kind, (route[-1], record['destination_airport']) if kind == ARRIVAL else record['origin_airport'])
+                stored_record = {name: value for name, value in record.items() if DEFAULT_FIELDS.get(name) != value}
+                batch.append((kind, record['callsign'], record['origin_airport'], record['destination_airport'],
+                              route[-1], route[0], pool_sizes[pool], json.dumps(stored_record, separators=(',', ':'))))
+                pool_sizes[pool] += 1
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    connection.executemany(INSERT_FLIGHT, batch)
+                    batch.clear()
+            connection.executemany(INSERT_FLIGHT, batch)
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('revision', ?)", (uuid.uuid4().hex,))
+        report.stored = Counter(dict(connection.execute('SELECT kind, COUNT(*) FROM flights GROUP BY kind')))
+        return report
+
+    def has_callsign(self, callsign):
+        '''Whether an arrival or departure has the callsign.'''
+
+        return self.connection.execute('SELECT 1 FROM flights WHERE kind IN (?, ?) AND callsign = ?',
+                                       (ARRIVAL, DEPARTURE, callsign)).fetchone() is not None
+
+    def flight(self, kind, key, position):
+        '''The Flight record at the position of the pool.'''
+
+        if kind == ARRIVAL:
+            row = self.connection.execute('SELECT record FROM flights WHERE kind = ? AND entry_fix = ? '
+                                          'AND destination_airport = ? AND position = ?',
+                                          (kind, *key, position)).fetchone()
+        else:
+            row = self.connection.execute('SELECT record FROM flights WHERE kind = ? AND origin_airport = ? '
+                                          'AND position = ?', (kind, key, position)).fetchone()
+        return make_flight({**DEFAULT_FIELDS, **json.loads(row[0])})
+
+    def pool_callsigns(self, kind, key):
+        '''(position, callsign) of every flight of the pool.'''
+
+        if kind == ARRIVAL:
+            return self.connection.execute('SELECT position, callsign FROM flights WHERE kind = ? AND entry_fix = ? '
+                                           'AND destination_airport = ?', (kind, *key)).fetchall()
+        return self.connection.execute('SELECT position, callsign FROM flights WHERE kind = ? AND origin_airport = ?',
+                                       (kind, key)).fetchall()
+
+    def exit_fix_counts(self, airport):
+        '''{exit fix: number of departures} of the departure pool of the airport.'''
+
+        return dict(self.connection.execute('SELECT exit_fix, COUNT(*) FROM flights WHERE kind = ? '
+                                            'AND origin_airport = ? GROUP BY exit_fix', (DEPARTURE, airport)))
+
+    def exit_fix_positions(self, airport, exit_fix):
+        '''Positions of the departures of the airport's pool with the exit fix.'''
+
+        return [position for position, in self.connection.execute(
+            'SELECT position FROM flights WHERE kind = ? AND exit_fix = ? AND origin_airport = ?',
+            (DEPARTURE, exit_fix, airport))]
+
+    def arrival_pools(self):
+        '''{(entry fix, destination airport): StoredPool}, like TMAData.arrival_pools.'''
+
+        return {(fix, airport): StoredPool(self, ARRIVAL, (fix, airport), range(count))
+                for fix, airport, count in self.connection.execute(
+                    'SELECT entry_fix, destination_airport, COUNT(*) FROM flights WHERE kind = ? '
+                    'GROUP BY entry_fix, destination_airport', (ARRIVAL,))}
+
+    def departure_pools(self):
+        '''{origin airport: StoredPool}, like TMAData.departure_pools.'''
+
+        return {airport: StoredPool(self, DEPARTURE, airport, range(count))
+                for airport, count in self.connection.execute(
+                    'SELECT origin_airport, COUNT(*) FROM flights WHERE kind = ? GROUP BY origin_airport',
+                    (DEPARTURE,))}
+
+
+class StoredPool(Sequence):
+    '''A pool of flights in a FlightStore: the positions of its flights, each Flight is
+    only read when it is drawn. Works wherever the generator takes a list of flights:
+    rng.sample picks from it, and build_arrival_index gets a shuffled copy to pop from.'''
+
+    def __init__(self, store, kind, key, positions):
+        self.store = store
+        self.kind = kind
+        self.key = key
+        self.positions = positions
+        self._rng = None
+        self._remaining = len(positions)
+        self._moved = {} # index: position moved there from the end, see pop
+
+    def __len__(self):
+        return self._remaining
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._remaining:
+            raise IndexError(index)
+        return self.store.flight(self.kind, self.key, self.positions[self._moved.get(index, index)])
+
+    def shuffled(self, rng):
+        '''A copy that pops its flights in random order, drawn from rng one at a time.'''
+
+        pool = StoredPool(self.store, self.kind, self.key, [self.positions[self._moved.get(index, index)]
+                                                            for index in range(self._remaining)]
+                          if self._moved else self.positions)
+        pool._rng = rng
+        return pool
+
+    def _current_positions(self):
+        '''The positions still in the pool, None if it is the whole pool of the store.'''
+
+        if isinstance(self.positions, range) and not self._moved and self._remaining == len(self.positions):
+            return None
+        return {self.positions[self._moved.get(index, index)] for index in range(self._remaining)}
+
+    def exit_fix_counts(self):
+        '''{exit fix: number of flights} of a departure pool, without reading the flights.'''
+
+        current = self._current_positions()
+        if current is None:
+            return self.store.exit_fix_counts(self.key)
+        counts = Counter()
+        for exit_fix in self.store.exit_fix_counts(self.key):
+            counts[exit_fix] = sum(position in current for position in self.store.exit_fix_positions(self.key, exit_fix))
+        return {exit_fix: count for exit_fix, count in counts.items() if count}
+
+    def sample_exit_fix(self, exit_fix, n, rng):
+        '''n random flights of a departure pool with the exit fix.'''
+
+        positions = self.store.exit_fix_positions(self.key, exit_fix)
+        current = self._current_positions()
+        if current is not None:
+            positions = [position for position in positions if position in current]
+        return [self.store.flight(self.kind, self.key, position) for position in rng.sample(positions, n)]
+
+    def without(self, callsigns):
+        '''A copy without the flights with these callsigns.'''
+
+        in_pool = set(self.positions[self._moved.get(index, index)] for index in range(self._remaining))
+        return StoredPool(self.store, self.kind, self.key,
+                          sorted(position for position, callsign in self.store.pool_callsigns(self.kind, self.key)
+                                 if position in in_pool and callsign not in callsigns))
+
+    def pop(self):
+        '''Draws the last flight, or a random one of a shuffled copy. The drawn index
+        is filled with the last one (a Fisher-Yates shuffle, one step per flight).'''
+
+        if not self._remaining:
+            raise IndexError('pop from an empty pool')
+        last = self._remaining - 1
+        index = self._rng.randrange(self._remaining) if self._rng else last
+        flight = self[index]
+        last_moved = self._moved.pop(last, last)
+        if index != last:
+            self._moved[index] = last_moved
+        self._remaining -= 1
+        return flight
+
+
+def load_store_tma_data(config_path, store_path):
+    '''TMAData of the config with the flights in the store at store_path. arrivals and
+    departures stay empty, the flights are only in the pools (see StoredPool).
+    The store checks the flights against the config when they are imported.'''
+
+    with open(config_path, 'r', encoding='utf-8') as config_file:
+        sim_data = json.load(config_file)
+    store = FlightStore(store_path)
+    version = hashlib.sha256((hash_file(config_path) + store.revision()).encode()).hexdigest()
+    return TMAData(sim_data, [], [], version,
+                   store.arrival_pools(), store.departure_pools(), build_all_departure_slots(sim_data))
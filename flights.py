@@ -0,0 +1,99 @@
+'''Compact flight records built once when the flight data is loaded.
+Everything that does not change between scenarios (route tokens, entry and exit fix,
+the $FP and SIMDATA lines) is derived here instead of on every generated flight.'''
+
+import sys
+from dataclasses import dataclass, replace
+
+from defaults import DEFAULT_TAXI_SPEED, DEFAULT_TAXIWAY_USAGE, DEFAULT_OBJECT_EXTENT
+from templates import FPL_TEMPLATE, SIMDATA_TEMPLATE
+
+
+@dataclass(slots=True)
+class Flight:
+    '''A single arrival or departure from the flights JSON.
+    entry_fix is the last waypoint of the route (TMA boundary for arrivals),
+    exit_fix is the first one (SID exit fix for departures).
+    latitude and longitude are optional fixed spawn coordinates.'''
+
+    callsign: str
+    transponder: str
+    altitude: int
+    origin_airport: str
+    destination_airport: str
+    fpl_route: str
+    route: tuple
+    entry_fix: str
+    exit_fix: str
+    fpl: str
+    simdata: str
+    latitude: str = None
+    longitude: str = None
+
+
+def generate_fpl_data(flight_data):
+    '''Generates flight plan data for the given flight. Formula per ES docs.
+    $FP<callsign>:*A:<flight plan type>:<aircraft type>:<true air speed>:<origin airport>:
+    <departure time EST>:<departure time ACT>:<final cruising altitude>:<destination airport>:
+    <HRS en route>:<MINS en route>:<HRS fuel>:<MINS fuel>:<alternate airport>:<remarks>:<route>'''
+
+    return FPL_TEMPLATE.format(flight_data['callsign'],
+                               flight_data['flight_plan_type'],
+                               flight_data['aircraft_type'],
+                               flight_data['true_air_speed'],
+                               flight_data['origin_airport'],
+                               flight_data['departure_time_est'],
+                               flight_data['departure_time_act'],
+                               flight_data['final_cruising_altitude'],
+                               flight_data['destination_airport'],
+                               flight_data['hrs_en_route'],
+                               flight_data['mins_en_route'],
+                               flight_data['hrs_fuel'],
+                               flight_data['mins_fuel'],
+                               flight_data['alternate_airport'],
+                               flight_data['remarks'],
+                               flight_data['fpl_route'])
+
+def generate_simdata(flight_data):
+    '''Generates simulation data for the given flight. Formula per ES docs.
+    SIMDATA:<callsign>:<plane type>:<livery>:<maximum taxi speed>:<taxiway usage>:<object extent>'''
+
+    taxi_speed = flight_data.get('max_taxi_speed', DEFAULT_TAXI_SPEED)
+    taxiway_usage = flight_data.get('taxiway_usage', DEFAULT_TAXIWAY_USAGE)
+    object_extent = flight_data.get('object_extent', DEFAULT_OBJECT_EXTENT)
+    simdata = SIMDATA_TEMPLATE.format(flight_data['callsign'],
+                                      taxi_speed,
+                                      taxiway_usage,
+                                      object_extent)
+    return simdata
+
+def make_flight(flight_data):
+    '''Builds a Flight from a flight dictionary as defined in the flights JSON.
+    Fix and airport names are interned, since they repeat across the whole library.'''
+
+    route = tuple(sys.intern(waypoint) for waypoint in flight_data['fpl_route'].split())
+    return Flight(callsign=flight_data['callsign'],
+                  transponder=flight_data['transponder'],
+                  altitude=int(flight_data['altitude']),
+                  origin_airport=sys.intern(flight_data['origin_airport']),
+                  destination_airport=sys.intern(flight_data['destination_airport']),
+                  fpl_route=flight_data['fpl_route'],
+                  route=route,
+                  entry_fix=route[-1],
+                  exit_fix=route[0],
+                  fpl=generate_fpl_data(flight_data),
+                  simdata=generate_simdata(flight_data),
+                  latitude=flight_data.get('latitude') or None,
+                  longitude=flight_data.get('longitude') or None)
+
+def rename_flight(flight, callsign, aircraft_type=None):
+    '''A copy of the flight with another callsign and, if given, aircraft type,
+    e.g. for synthetic traffic (see the synthesizer module).'''
+
+    fpl = flight.fpl.split(':', 16)
+    fpl[0] = '$FP' + callsign
+    if aircraft_type:
+        fpl[3] = aircraft_type
+    simdata = flight.simdata.split(':')
+    simdata[1] = callsign
+    return replace(flight, callsign=callsign, fpl=':'.join(fpl), simdata=':'.join(simdata))
@@ -2,22 +2,34 @@
 Uses JSON data about flights and TMA data. Tailored for approach training scenarios
 on Vatsim (S3 level)'''
 
-import argparse
+import contextlib
 import json
+import math
+import os
 import random
-import itertools
+import heapq
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 
-from defaults import MINIMUM_ARRIVAL_ALTITUDE, DEFAULT_SPAWN, DEFAULT_TAXI_SPEED, \
-                     DEFAULT_TAXIWAY_USAGE, DEFAULT_OBJECT_EXTENT, \
-                     DEFAULT_REQ_ALT_DEPARTURE, DEFAULT_REQ_ALT_ARRIVAL, \
+from defaults import MINIMUM_ARRIVAL_ALTITUDE, DEFAULT_SPAWN, \
                      DEFAULT_WAVE_START, DEFAULT_LAST_WAVE, \
-                     EXCEPTION_MSG_SID_AND_STAR, EXCEPTION_MSG_SID_OR_STAR, \
                      SPAWN_OFFSET_LO, SPAWN_OFFSET_HI, \
-                     FIR_PREFIX
+                     COORDINATE_DECIMALS, \
+                     FIR_PREFIX, DEFAULT_ARRIVALS_HOURLY_RATE, DEFAULT_FIX_SEPARATION, \
+                     MAX_DIVERSITY_ATTEMPTS
 
-from templates import HOLDING_TEMPLATE, POSITION_TEMPLATE, FPL_TEMPLATE, PSEUDOPILOT_TEMPLATE, \
-                      SIMDATA_TEMPLATE, ROUTE_TEMPLATE, REQUALT_TEMPLATE, FLIGHT_TEMPLATE, \
-                      SCENARIO_TEMPLATE, RUNWAY_TEMPLATE
+from departure_slots import build_departure_slots
+from diversity import DiversitySampler, ScenarioIndex, scenario_tokens
+from instrumentation import SILENT, Profiler
+from placement import SpawnPlacer
+from renderer import FlightRenderer
+from squawk import SquawkAllocator
+from synthesizer import FlightSynthesizer
+from tma_cache import load_tma_data
+
+from templates import HOLDING_TEMPLATE, PSEUDOPILOT_TEMPLATE, \
+                      SCENARIO_HEADER_TEMPLATE, SCENARIO_FOOTER, RUNWAY_TEMPLATE
 
 
 def import_data(data_path):
@@ -67,380 +79,588 @@ def generate_controllers(controller_data, pseudopilot_data):
                                                        controller["frequency"]))
     return '\n'.join(controllers)
 
-def transform_heading(initial_heading):
-    '''Transforms a heading given as int or str in degrees into an integer
-    accepted by Euroscope/sweatbox. Formula per Euroscope docs.'''
-
-    transformed_heading = int(float(initial_heading) * 2.88 + 0.5) << 2
-    return transformed_heading
-
-def get_spawn_coordinates(flight_data, arrival_spawns):
+def get_spawn_coordinates(flight, arrival_spawns):
     '''Reads the flight data and determines the spawn coordinates.'''
-    latitude = flight_data.get('latitude', None)
-    longitude = flight_data.get('longitude', None)
-    if not latitude or not longitude:
-        tma_boundary = flight_data['fpl_route'].split()[-1]  # last wpt is the TMA boundary
-        spawn_latitude, spawn_longitude = arrival_spawns.get(tma_boundary, DEFAULT_SPAWN)
+    if not flight.latitude or not flight.longitude:
+        # entry fix (last wpt) is the TMA boundary
+        spawn_latitude, spawn_longitude = arrival_spawns.get(flight.entry_fix, DEFAULT_SPAWN)
     else:
-        spawn_latitude, spawn_longitude = latitude, longitude
-    return spawn_latitude, spawn_longitude
-
-def generate_inbound_spawn(flight_data, arrival_spawns):
-    '''Generates the inbound spawn coordinates and randomizes them by an offset.'''
-
-    raw_spawn_latitude, raw_spawn_longitude = get_spawn_coordinates(flight_data, arrival_spawns)
-    spawn_latitude = str(float(raw_spawn_latitude) + random.uniform(SPAWN_OFFSET_LO, SPAWN_OFFSET_HI))[:10]
-    spawn_longitude = str(float(raw_spawn_longitude) + random.uniform(SPAWN_OFFSET_LO, SPAWN_OFFSET_HI))[:10]
+        spawn_latitude, spawn_longitude = flight.latitude, flight.longitude
     return spawn_latitude, spawn_longitude
 
-def generate_departure_spawns(init_lat, init_lon, offset_lat, offset_lon):
-    '''Generates infinite spawn position on a single axis (e.g. runway axis or taxiway axis),
-    starting from (init_lat, init_lon) and moving along the specified offsets.'''
-
-    i = 0
-    while True:
-        dot_lat, dot_lon = init_lat.find('.'), init_lon.find('.')
-        latitude = f'{init_lat[:dot_lat]}.{int(init_lat[dot_lat+1:]) + i * int(offset_lat)}'
-        longitude = f'{init_lon[:dot_lon]}.{int(init_lon[dot_lon+1:]) + i * int(offset_lon)}'
-        yield (latitude, longitude)
-        i += 1
-
-def is_proper_arrival(flight_data, sim_data):
-    '''Checks if the last waypoint is an entry fix to TMA. If it is, it is a properly
-    defined arrival.'''
-
-    if sim_data:
-        return flight_data['fpl_route'].split()[-1] in sim_data['arrivals_fix_headings'].keys()
-    return False
-
-def generate_initial_heading(flight_data, sim_data=None, runway=None):
-    '''For arrivals, reads the heading from the simulation data according to the TMA entry fix.
-    For departures, reads the heading from the runway data.
-     
-    Caution: for departures it is assumed that the departures spawn on the runway!'''
-
-    if is_proper_arrival(flight_data, sim_data):
-        heading = sim_data['arrivals_fix_headings'][flight_data['fpl_route'].split()[-1]]
-
-    else:
-        assert sim_data and runway, 'When no initial heading is provided, sim data and runway are required.'
-        heading = sim_data['runway_data'][runway]['heading']
-    return transform_heading(heading)
-
-def generate_initial_altitude(flight_data):
-    '''Generates the initial altitude for the flight. For arrival, slightly randomizes
-    the altitude to simulate the ongoing descent'''
-
-    raw_altitude = int(flight_data['altitude'])
-    if raw_altitude >= MINIMUM_ARRIVAL_ALTITUDE:
-        altitude = str(raw_altitude + random.choice([-100, -0, 100]) * random.randint(0, 9))
-    else:
-        altitude = str(raw_altitude)
-    return altitude
-
-def generate_position_data(flight_data, spawn, squawk, sim_data=None, runway=None):
-    '''Generates position data for the given flight. Formula per ES docs.
-    @<transponder flag>:<callsign>:<squawk code>:1:<latitude>:<longitude>:<altitude>:0:<heading>:0'''
-
-    spawn_latitude, spawn_longitude = spawn
-    heading = generate_initial_heading(flight_data, sim_data, runway)
-    altitude = generate_initial_altitude(flight_data)
-    return POSITION_TEMPLATE.format(flight_data['transponder'], flight_data['callsign'],
-                                    squawk, spawn_latitude, spawn_longitude,
-                                    altitude, heading)
-
-def generate_fpl_data(flight_data):
-    '''Generates flight plan data for the given flight. Formula per ES docs.
-    $FP<callsign>:*A:<flight plan type>:<aircraft type>:<true air speed>:<origin airport>:
-    <departure time EST>:<departure time ACT>:<final cruising altitude>:<destination airport>:
-    <HRS en route>:<MINS en route>:<HRS fuel>:<MINS fuel>:<alternate airport>:<remarks>:<route>'''
-
-    return FPL_TEMPLATE.format(flight_data['callsign'],
-                               flight_data['flight_plan_type'],
-                               flight_data['aircraft_type'],
-                               flight_data['true_air_speed'],
-                               flight_data['origin_airport'],
-                               flight_data['departure_time_est'],
-                               flight_data['departure_time_act'],
-                               flight_data['final_cruising_altitude'],
-                               flight_data['destination_airport'],
-                               flight_data['hrs_en_route'],
-                               flight_data['mins_en_route'],
-                               flight_data['hrs_fuel'],
-                               flight_data['mins_fuel'],
-                               flight_data['alternate_airport'],
-                               flight_data['remarks'],
-                               flight_data['fpl_route'])
-
-def generate_simdata(flight_data):
-    '''Generates simulation data for the given flight. Formula per ES docs.
-    SIMDATA:<callsign>:<plane type>:<livery>:<maximum taxi speed>:<taxiway usage>:<object extent>'''
-
-    taxi_speed = flight_data.get('max_taxi_speed', DEFAULT_TAXI_SPEED)
-    taxiway_usage = flight_data.get('taxiway_usage', DEFAULT_TAXIWAY_USAGE)
-    object_extent = flight_data.get('object_extent', DEFAULT_OBJECT_EXTENT)
-    simdata = SIMDATA_TEMPLATE.format(flight_data['callsign'],
-                                      taxi_speed,
-                                      taxiway_usage,
-                                      object_extent)
-    return simdata
-
-def generate_route(flight_data, sid_waypoints='', star_waypoints=''):
-    '''Generates route data for the given flight. Formula per ES docs, but simplified (route only).
-    $ROUTE:<point by point route>'''
-    assert sid_waypoints or star_waypoints, EXCEPTION_MSG_SID_OR_STAR
-    assert not (sid_waypoints and star_waypoints), EXCEPTION_MSG_SID_AND_STAR
-
-    route = ''
-    if star_waypoints:
-        route += ROUTE_TEMPLATE.format(flight_data['fpl_route'].split()[-1] + ' ' + star_waypoints)
-    elif sid_waypoints:
-        route += ROUTE_TEMPLATE.format(sid_waypoints + ' ' + flight_data['fpl_route'])
-    return route
-
-def generate_reqalt(flight_data, requested_altitude_arrivals,
-                    requested_altitude_departures, destination_runway = None,
-                    sid_waypoints='', star_waypoints=''):
-    '''Generates requested altitude data for the given flight. Formula per ES docs.
-    $REQALT:<fix>:<altitude>
-    
-    If star_waypoints are provided, assumes it is an arrival and the last waypoint
-    in the route is the TMA boundary used as <fix>. If sid_waypoints are provided,
-    omits the <fix> and uses the default initial climb.'''
-
-    assert sid_waypoints or star_waypoints, EXCEPTION_MSG_SID_OR_STAR
-    assert not (sid_waypoints and star_waypoints), EXCEPTION_MSG_SID_AND_STAR
-
-    tma_boundary = flight_data['fpl_route'].split()[-1]
-
-    if star_waypoints:
-        try:
-            entry_fix = requested_altitude_arrivals[destination_runway][tma_boundary]
-            reqalt = REQUALT_TEMPLATE.format(tma_boundary, entry_fix)
-        except KeyError:
-            reqalt = REQUALT_TEMPLATE.format('', DEFAULT_REQ_ALT_ARRIVAL)
-    elif sid_waypoints:
-        departure_icao = flight_data['origin_airport']
-        reqalt = REQUALT_TEMPLATE.format('', requested_altitude_departures.get(departure_icao, DEFAULT_REQ_ALT_DEPARTURE))
-    else:
-        reqalt = REQUALT_TEMPLATE.format('', DEFAULT_REQ_ALT_DEPARTURE)
-
-    return reqalt
-
-def generate_single_flight(flight_data, spawn, pseudopilot_data,
-                           initial_pseudopilot, start, squawk,
-                           sim_data = None,
-                           departure_runway = None,
-                           destination_runway = None,
-                           requested_altitude_arrivals = None,
-                           requested_altitude_departures = None,
-                           sid_waypoints = '', star_waypoints = ''):
-
-    '''Puts together the various data to generate a single string with flight data
-    formatted per ES docs.'''
-
-    position = generate_position_data(flight_data,
-                                      spawn,
-                                      squawk,
-                                      sim_data=sim_data,
-                                      runway=departure_runway)
-    flight_plan = generate_fpl_data(flight_data)
-    simdata = generate_simdata(flight_data)
-    route = generate_route(flight_data, sid_waypoints, star_waypoints)
-    reqalt = generate_reqalt(flight_data,
-                             requested_altitude_arrivals,
-                             requested_altitude_departures,
-                             destination_runway,
-                             sid_waypoints,
-                             star_waypoints)
-
-    flight = FLIGHT_TEMPLATE.format(pseudopilot_data,
-                                    position,
-                                    flight_plan,
-                                    simdata,
-                                    route,
-                                    str(start),
-                                    reqalt,
-                                    initial_pseudopilot)
-
-    return flight
-
-def filter_flights_by_entry_point(flights, entry_point):
-    '''Filters the list of flights by the last waypoint in their flight plan,
-    assumed to be the TMA entry fix.'''
-
-    filtered = [flight for flight in flights['arrivals'] if flight['fpl_route'].split()[-1] == entry_point]
-    return random.sample(filtered, k=len(filtered)) if filtered else []
-
-def generate_arrival_wave(flight_data, runway, inbound_spawn_points, min_size, max_size):
+def format_coordinate(value):
+    '''Formats a coordinate in degrees the way the JSON data does (7 decimal places).'''
+
+    return f'{value:.{COORDINATE_DECIMALS}f}'
+
+def generate_inbound_spawns(wave, arrival_spawns, rng = random):
+    '''Generates the inbound spawn coordinates of a whole wave at once and randomizes
+    each of them by an offset. All offsets are drawn from rng in a single pass.'''
+
+    offsets = [rng.uniform(SPAWN_OFFSET_LO, SPAWN_OFFSET_HI) for _ in range(2 * len(wave))]
+    spawns = []
+    for flight, offset_latitude, offset_longitude in zip(wave, offsets[::2], offsets[1::2]):
+        raw_spawn_latitude, raw_spawn_longitude = get_spawn_coordinates(flight, arrival_spawns)
+        spawns.append((format_coordinate(float(raw_spawn_latitude) + offset_latitude),
+                       format_coordinate(float(raw_spawn_longitude) + offset_longitude)))
+    return spawns
+
+def generate_initial_altitudes(flights, rng = random):
+    '''Generates the initial altitudes for a list of flights. For arrivals, slightly randomizes
+    the altitude to simulate the ongoing descent: -900 to +900 ft in steps of 100 ft,
+    level more likely (direction and size drawn together with a single rng call per flight).'''
+
+    altitudes = []
+    for flight in flights:
+        raw_altitude = flight.altitude
+        if raw_altitude >= MINIMUM_ARRIVAL_ALTITUDE:
+            jitter = rng.randrange(30) # 3 directions (down, level, up) x 10 sizes (0-9)
+            altitudes.append(str(raw_altitude + (jitter // 10 - 1) * 100 * (jitter % 10)))
+        else:
+            altitudes.append(str(raw_altitude))
+    return altitudes
+
+def build_arrival_index(arrival_pools, rng = random, sampler = None):
+    '''Copies the arrival pools keyed by (TMA entry fix, destination airport)
+    (see tma_cache.compile_tma_data) once per scenario. Each copy is shuffled,
+    so waves can simply pop flights from its end. Pools of a flight store
+    (see flight_store.StoredPool) shuffle themselves without reading the flights.
+    With a diversity.DiversitySampler, the flights used less in the batch come first.'''
+
+    if sampler:
+        return {key: sampler.arrange_arrivals(pool, rng) for key, pool in arrival_pools.items()}
+    return {key: pool.shuffled(rng) if hasattr(pool, 'shuffled') else rng.sample(pool, k=len(pool))
+            for key, pool in arrival_pools.items()}
+
+def generate_arrival_wave(arrival_index, runway, inbound_spawn_points, max_wave_size,
+                          start = 0, fix_free_at = None, instrumentation = SILENT, rng = random,
+                          closed_fixes = (), synthesizer = None, sampler = None):
     '''Generates a wave of arrival flights for a specific runway.
     Expects runway defined as final two letters and number, e.g. WA33 or KK25.
 
-    1) Shuffles the inbound spawn points to ensure more diverse scenarios.
-    2) Filters all flights in flight_data by the TMA entry points.
-    3) Generates a wave of size between min_size and max_size (inclusive)
-    4) Returns a list of dictionaries with flight data.'''
+    1) Shuffles the inbound spawn points to ensure more diverse scenarios
+       (the less used in the batch first with a diversity.DiversitySampler sampler).
+    2) Pops one flight per TMA entry point from the pool for the runway's airport,
+       skipping entry points that are still busy at start (see fix_free_at) or closed_fixes.
+       Once the pool of an entry point is empty, the synthesizer (if any) makes a new flight.
+    3) Stops after max_wave_size flights.
+    4) Returns a list of Flight records.'''
 
-    max_wave_size = random.randint(min_size, max_size)
-    random.shuffle(inbound_spawn_points)
-    fix_to_flights = {fix: filter_flights_by_entry_point(flight_data, fix) for fix in inbound_spawn_points}
-    print(f"Generating wave with max size {max_wave_size}.")
+    if sampler:
+        sampler.arrange_fixes(inbound_spawn_points, rng)
+    else:
+        rng.shuffle(inbound_spawn_points)
+    destination = FIR_PREFIX + runway[:2] #e.g. EP + WA (from WA33)
+    fix_free_at = fix_free_at or {}
+    instrumentation.log(f"Generating wave with max size {max_wave_size}.")
     wave = []
     for fix in inbound_spawn_points:
-        if fix_to_flights[fix]:
-            flight = fix_to_flights[fix][-1]
-            destination = FIR_PREFIX + runway[:2] #e.g. EP + WA (from WA33)
-            if flight['destination_airport'] == destination:
-                wave.append(fix_to_flights[fix].pop())
-                print(f"Added flight {flight['callsign']} as arrival from fix {fix}.")
-            if len(wave) >= max_wave_size:
-                break
+        if len(wave) >= max_wave_size:
+            break
+        if fix_free_at.get(fix, start) > start or fix in closed_fixes:
+            continue
+        pool = arrival_index.get((fix, destination))
+        if pool:
+            flight = pool.pop()
+        elif synthesizer and synthesizer.can_arrive(fix, destination):
+            flight = synthesizer.arrival(fix, destination)
+            instrumentation.count('synthesized')
+        else:
+            continue
+        wave.append(flight)
+        if sampler:
+            sampler.draw_arrival(flight)
+        instrumentation.log(f"Added flight {flight.callsign} as arrival from fix {fix}.")
+    instrumentation.count('waves')
+    instrumentation.count('arrivals', len(wave))
     return wave
 
-def convert_arrival_wave_to_string(wave, sim_data, squawk_generator, runway, start_time = 0):
-    '''Converts a list of dictionaries representing flight data into a string format,
-    formatted per ES docs.'''
-
-    flight_strings = []
-    for flight in wave:
-        entry_fix = flight['fpl_route'].split()[-1]
-        spawn = generate_inbound_spawn(flight, sim_data['arrival_spawns'])
-        squawk = next(squawk_generator)
-        flight_string = generate_single_flight(flight,
-                                               spawn,
-                                               sim_data['pseudopilot_data'],
-                                               sim_data['initial_pseudopilot'],
-                                               start_time,
-                                               squawk,
-                                               sim_data=sim_data,
-                                               destination_runway=runway,
-                                               requested_altitude_arrivals=sim_data['requested_altitude_arrivals'],
-                                               star_waypoints=sim_data['arrivals_star_waypoints'][runway][entry_fix])
-        flight_strings.append(flight_string)
-    return '\n'.join(flight_strings)
-
-
-def generate_flights_in_waves(runway, sim_data, flight_data, squawk_generator,
-                              min_size, max_size, wave_interval,
-                              start, last_wave):
-
-    '''Generates a series of arrival flight waves for a specific runway.
-    The waves stops after last_wave (minute) is reached or exceeded, 
-    or the total number of planes reaches or exceeds the runway capacity.'''
-
-    capacity = sim_data['arrivals_max_capacity'][runway]
-    inbound_spawn_points = list(sim_data['arrival_spawns'].keys())
-
-    plane_count = 0
-    wave_num = 0
-    all_planes = ''
-
-    while True:
-        wave_num += 1
-        wave = generate_arrival_wave(flight_data, runway, inbound_spawn_points, min_size, max_size)
-        plane_count += len(wave)
+def place_inbound_spawns(wave, spawns, altitudes, arrival_spawns, placer, start_time, rng = random):
+    '''Moves the spawns of the wave that are too close to another arrival spawning at the same
+    time, see the placement module. Returns the spawns, formatted as generate_inbound_spawns does.'''
+
+    bases = [tuple(map(float, get_spawn_coordinates(flight, arrival_spawns))) for flight in wave]
+    moved = placer.place(start_time, [(float(latitude), float(longitude)) for latitude, longitude in spawns],
+                         bases, [int(altitude) for altitude in altitudes], rng)
+    for position, (latitude, longitude) in moved.items():
+        spawns[position] = format_coordinate(latitude), format_coordinate(longitude)
+    return spawns
+
+def iter_arrival_wave(wave, sim_data, squawks, runway, start_time = 0,
+                      instrumentation = SILENT, rng = random, renderer = None, placer = None):
+    '''Yields the flight strings of a wave of arrivals one by one, formatted per ES docs
+    by the FlightRenderer renderer (a new one unless given).
+    Spawn positions, altitudes and squawk codes (from the SquawkAllocator squawks)
+    are generated for the whole wave at once. With a SpawnPlacer placer, the spawns
+    are kept apart from the other arrivals spawning at start_time.'''
+
+    renderer = renderer or FlightRenderer(sim_data)
+    spawns = generate_inbound_spawns(wave, sim_data['arrival_spawns'], rng)
+    altitudes = generate_initial_altitudes(wave, rng)
+    if placer:
+        with instrumentation.stage('placement'):
+            spawns = place_inbound_spawns(wave, spawns, altitudes, sim_data['arrival_spawns'],
+                                          placer, start_time, rng)
+    codes = squawks.allocate_many(len(wave), FIR_PREFIX + runway[:2])
+    for flight, spawn, altitude, squawk in zip(wave, spawns, altitudes, codes):
+        with instrumentation.stage('render'):
+            flight_string = renderer.render(flight, runway, spawn, squawk, altitude, start_time)
+        yield flight_string
+
+def _fixes_taken_near(taken_fix_times, minute, separation):
+    '''Entry fixes with a taken arrival less than separation minutes from minute.
+    taken_fix_times maps a fix to the sorted START minutes of its arrivals.'''
+
+    taken = set()
+    for fix, minutes in taken_fix_times.items():
+        position = bisect_left(minutes, minute - separation + 1)
+        if position < len(minutes) and minutes[position] < minute + separation:
+            taken.add(fix)
+    return taken
+
+def iter_arrival_schedule(arrival_runways, sim_data, arrival_index, start, last_wave,
+                          instrumentation = SILENT, rng = random, taken_fix_times = None, synthesizer = None,
+                          sampler = None):
+    '''Schedules the arrival waves of all arrival runways on a single timeline and yields
+    them in time order as (start minute, runway, list of Flight records).
+
+    The next wave of every runway waits in a heap. The break between the waves of
+    a runway is a random walk around its arrivals_wave_intervals. A wave is limited by
+    the runway's arrivals_hourly_rate (at most that many arrivals in any 60 minutes),
+    by its optional arrivals_max_capacity (at most that many arrivals in the whole session)
+    and by the entry fixes: after an arrival spawns at a fix, the fix stays closed to
+    all runways for arrivals_fix_separation minutes. Waves start until last_wave (minute)
+    or until the flights to the runway's airport run out. Flights are drawn from
+    arrival_index (see build_arrival_index), so a flight is used at most once per scenario.
+    With a synthesizer (see the synthesizer module) the flights never run out.
+
+    taken_fix_times are arrivals already in the scenario (see scenario_file), as
+    {fix: sorted START minutes}. The fix separation is kept from them as well.
+    The entry fixes of the waves are ordered by sampler, see generate_arrival_wave.'''
 
-        string_wave = convert_arrival_wave_to_string(wave, sim_data, squawk_generator, runway, start_time=start)
-        all_planes += string_wave + '\n'
-
-        if start >= last_wave or plane_count >= capacity:
-            break
-        wave_interval = wave_interval + random.choice([-1, 0, 1])
-        print(f'Break between waves: {wave_interval} minutes.')
-        start += wave_interval
+    inbound_spawn_points = list(sim_data['arrival_spawns'].keys())
+    fix_separation = sim_data.get('arrivals_fix_separation', DEFAULT_FIX_SEPARATION)
+    hourly_rates = sim_data.get('arrivals_hourly_rate', {})
+    capacities = sim_data.get('arrivals_max_capacity', {})
+    session_arrivals = Counter()
+    wave_intervals = {runway: sim_data['arrivals_wave_intervals'][runway] for runway in arrival_runways}
+    recent_arrivals = {runway: deque() for runway in arrival_runways}
+    remaining = Counter()
+    for (_, destination), pool in arrival_index.items():
+        remaining[destination] += len(pool)
+    fix_free_at = {}
+
+    # (start minute, position in arrival_runways, runway), the position keeps the order of equal starts
+    timeline = [(start, number, runway) for number, runway in enumerate(arrival_runways)]
+    heapq.heapify(timeline)
+    while timeline:
+        wave_start, number, runway = heapq.heappop(timeline)
+        destination = FIR_PREFIX + runway[:2]
+        if not remaining[destination] and not (synthesizer and synthesizer.arrives_to(destination)):
+            instrumentation.log(f'No more arrivals to {destination}.')
+            continue
 
-    print(f'{plane_count} arriving planes to {FIR_PREFIX+runway[:2]} generated in {wave_num} waves.')
-    return all_planes
+        capacity_left = capacities.get(runway, math.inf) - session_arrivals[runway]
+        if capacity_left <= 0:
+            instrumentation.log(f'Runway {runway} reached its capacity of {capacities[runway]} arrivals.')
+            continue
 
-def generate_squawk():
-    '''Generates a sequence of squawk codes. Simple to the fault, 
-    generates codes from 0001 to 6777, but does not ignore 1000, 1200 etc.'''
+        recent = recent_arrivals[runway]
+        while recent and recent[0] <= wave_start - 60:
+            recent.popleft()
+        room = hourly_rates.get(runway, DEFAULT_ARRIVALS_HOURLY_RATE) - len(recent)
+        if room <= 0:
+            # the runway is full, retry once the oldest arrival leaves the 60 minute window
+            if recent and recent[0] + 60 <= last_wave:
+                heapq.heappush(timeline, (recent[0] + 60, number, runway))
+            continue
 
-    max_squawk = 3583 #oct 6777
-    squawk = 1
-    while squawk <= max_squawk:
-        yield str(oct(squawk))[2:].zfill(4)
-        squawk += 1
+        max_wave_size = min(rng.randint(sim_data['arrivals_wave_minimum'][runway],
+                                        sim_data['arrivals_wave_maximum'][runway]), room, capacity_left)
+        closed_fixes = _fixes_taken_near(taken_fix_times, wave_start, fix_separation) if taken_fix_times else ()
+        wave = generate_arrival_wave(arrival_index, runway, inbound_spawn_points, max_wave_size,
+                                     wave_start, fix_free_at, instrumentation, rng, closed_fixes, synthesizer,
+                                     sampler)
+        session_arrivals[runway] += len(wave)
+        for flight in wave:
+            fix_free_at[flight.entry_fix] = wave_start + fix_separation
+            recent.append(wave_start)
+        remaining[destination] = max(0, remaining[destination] - len(wave))
+        if wave:
+            yield wave_start, runway, wave
+
+        wave_intervals[runway] = max(1, wave_intervals[runway] + rng.choice([-1, 0, 1]))
+        instrumentation.log(f'Break between waves to {runway}: {wave_intervals[runway]} minutes.')
+        if wave_start + wave_intervals[runway] <= last_wave:
+            heapq.heappush(timeline, (wave_start + wave_intervals[runway], number, runway))
+
+def iter_arrivals(arrival_runways, sim_data, arrival_index, squawks, start, last_wave,
+                  instrumentation = SILENT, rng = random, renderer = None, taken_fix_times = None,
+                  synthesizer = None, placer = None, sampler = None):
+    '''Yields the scenario text of the arrivals to all arrival runways chunk by chunk,
+    as soon as each flight is generated. The waves come in time order, see iter_arrival_schedule.
+    Arrivals spawning at the same time are kept apart by the SpawnPlacer placer
+    (a new one with the config's spawn_separation unless given).'''
+
+    renderer = renderer or FlightRenderer(sim_data)
+    placer = placer or SpawnPlacer.from_config(sim_data)
+    arrival_counts = Counter()
+    for wave_start, runway, wave in iter_arrival_schedule(arrival_runways, sim_data, arrival_index,
+                                                          start, last_wave, instrumentation, rng,
+                                                          taken_fix_times, synthesizer, sampler):
+        arrival_counts[runway] += len(wave)
+        for flight_num, flight_string in enumerate(iter_arrival_wave(wave, sim_data, squawks,
+                                                                     runway, start_time=wave_start,
+                                                                     instrumentation=instrumentation,
+                                                                     rng=rng,
+                                                                     renderer=renderer,
+                                                                     placer=placer)):
+            if flight_num:
+                yield '\n'
+            yield flight_string
+        yield '\n'
 
-def generate_departures_string(n, runway, flight_data, sim_data, squawk_generator):
+    for runway in arrival_runways:
+        instrumentation.log(f'{arrival_counts[runway]} arriving planes to {FIR_PREFIX+runway[:2]} runway {runway[2:]} generated.')
+
+def generate_arrivals_string(arrival_runways, sim_data, arrival_index, squawks, start, last_wave,
+                             instrumentation = SILENT, rng = random):
+    '''Generates the arrivals to all arrival runways as a single string. See iter_arrivals.'''
+
+    return ''.join(iter_arrivals(arrival_runways, sim_data, arrival_index, squawks, start, last_wave,
+                                 instrumentation, rng))
+
+def _sample_departures(pool, n, rng, sampler):
+    if sampler:
+        return sampler.sample_departures(pool, n, rng)
+    return rng.sample(pool, n)
+
+def iter_departures(n, runway, departure_pools, sim_data, squawks,
+                    instrumentation = SILENT, rng = random, departure_slots = None, renderer = None,
+                    synthesizer = None, sampler = None):
+    '''Yields the scenario text of departure flights for a specific runway, flight by flight.
+    The flights are a sample of n from the departure flights defined in the flight data JSON,
+    grouped by origin airport in departure_pools (see tma_cache.compile_tma_data),
+    weighted towards the flights and exit fixes used less in the batch by a diversity.DiversitySampler sampler.
+    They spawn at the first n departure_slots of the runway (see the departure_slots module),
+    computed from sim_data if not given. If there are fewer than n flights, the synthesizer
+    (if any) makes the rest from those drawn.'''
+
+    renderer = renderer or FlightRenderer(sim_data)
+    desired_destination = FIR_PREFIX + runway[:2]
+    if departure_slots is None:
+        departure_slots = build_departure_slots(sim_data, runway)
+    if n > len(departure_slots):
+        raise ValueError(f'Only {len(departure_slots)} departure slots within the aerodrome '
+                         f'for runway {runway}, {n} departures requested.')
+    pool = departure_pools.get(desired_destination, [])
+    if synthesizer and n > len(pool):
+        # the synthetic flights are made from the drawn ones, no other flight of the pool is read
+        library = _sample_departures(pool, len(pool), rng, sampler)
+        departures = library + list(synthesizer.departures(n - len(library), desired_destination, library))
+        instrumentation.count('synthesized', n - len(pool))
+    else:
+        departures = _sample_departures(pool, n, rng, sampler)
+    spawns = [(format_coordinate(lat), format_coordinate(lon)) for lat, lon in departure_slots[:n]]
+    altitudes = generate_initial_altitudes(departures, rng)
+    codes = squawks.allocate_many(n, desired_destination)
+
+    for flight, spawn, altitude, squawk in zip(departures, spawns, altitudes, codes):
+        with instrumentation.stage('render'):
+            flight_string = renderer.render(flight, runway, spawn, squawk, altitude, 0, arrival=False)
+        yield flight_string
+        yield '\n'
+        if sampler:
+            sampler.draw_departure(flight)
+        instrumentation.log(f"Added flight {flight.callsign} as departure to fix {flight.exit_fix}.")
+    instrumentation.count('departures', n)
+    instrumentation.log(f'Generated {n} departures from {FIR_PREFIX+runway[:2]} runway {runway[2:]}.')
+
+def generate_departures_string(n, runway, departure_pools, sim_data, squawks,
+                               instrumentation = SILENT, rng = random):
     '''Generates a string representation of departure flights for a specific runway.
-    The flights are a sample of n from the departure flights defined in the flight data JSON.'''
+    See iter_departures.'''
 
-    departures_string = ''
-    spawns = generate_departure_spawns(*sim_data['departures_first_spawn'][runway], *sim_data['departures_spawn_offset'][runway])
-    desired_destination = FIR_PREFIX + runway[:2]
-    departures_to_target = [flight for flight in flight_data['departures'] if flight['origin_airport'] == desired_destination]
-    departures = random.sample(departures_to_target, n)
-    departure_sid_waypoints = sim_data['departures_sid_waypoints']
-
-    for flight in departures:
-        spawn = next(spawns)
-        squawk = next(squawk_generator)
-        exit_fix = flight['fpl_route'].split()[0]
-        departures_string += generate_single_flight(flight,
-                                                    spawn,
-                                                    sim_data['pseudopilot_data'],
-                                                    sim_data['initial_pseudopilot'],
-                                                    start=0,
-                                                    squawk=squawk,
-                                                    sim_data=sim_data,
-                                                    departure_runway=runway,
-                                                    sid_waypoints=departure_sid_waypoints[runway][exit_fix],
-                                                    requested_altitude_departures=sim_data['requested_altitude_departures'])
-        departures_string += '\n'
-        print(f"Added flight {flight['callsign']} as departure to fix {exit_fix}.")
-    print(f'Generated {n} departures from {FIR_PREFIX+runway[:2]} runway {runway[2:]}.')
-    return departures_string
+    return ''.join(iter_departures(n, runway, departure_pools, sim_data, squawks,
+                                   instrumentation, rng))
 
 def generate_scenario(flights_data_path,
                       simulation_data_path,
                       arrival_runways,
                       departure_runways,
                       start = DEFAULT_WAVE_START,
-                      last_wave = DEFAULT_LAST_WAVE):
-    '''Generates a Euroscope sweatbox scenario with arrivals and departures.'''
-
-    sim_data = import_data(simulation_data_path)
-    flight_data = import_data(flights_data_path)
-
-    runways = generate_runways(sim_data['runway_data'], arrival_runways, departure_runways)
-    holdings = generate_holdings(sim_data['holding_data'])
-    controllers = generate_controllers(sim_data['controller_data'], sim_data['pseudopilot_data'])
-
-    squawk_generator = generate_squawk()
-
-    all_flights = ''
-
-    arrivals = ''
-
-    for runway in arrival_runways:
-        arrivals += generate_flights_in_waves(runway,
-                                              sim_data,
-                                              flight_data,
-                                              squawk_generator=squawk_generator,
-                                              start=start,
-                                              last_wave=last_wave,
-                                              wave_interval=sim_data['arrivals_wave_intervals'][runway],
-                                              min_size=sim_data['arrivals_wave_minimum'][runway],
-                                              max_size=sim_data['arrivals_wave_maximum'][runway])
-    all_flights += arrivals
+                      last_wave = DEFAULT_LAST_WAVE,
+                      instrumentation = SILENT,
+                      seed = None):
+    '''Generates a Euroscope sweatbox scenario with arrivals and departures.
+    The same seed with the same data and parameters gives the same scenario.'''
+
+    return ''.join(iter_scenario(flights_data_path, simulation_data_path,
+                                 arrival_runways, departure_runways,
+                                 start=start, last_wave=last_wave,
+                                 instrumentation=instrumentation, seed=seed))
+
+def generate_scenario_from_data(tma_data,
+                                arrival_runways,
+                                departure_runways,
+                                start = DEFAULT_WAVE_START,
+                                last_wave = DEFAULT_LAST_WAVE,
+                                instrumentation = SILENT,
+                                seed = None):
+    '''Generates a Euroscope sweatbox scenario from already loaded TMA data (see tma_cache).'''
+
+    return ''.join(iter_scenario_from_data(tma_data,
+                                           arrival_runways, departure_runways,
+                                           start=start, last_wave=last_wave,
+                                           instrumentation=instrumentation, seed=seed))
+
+def iter_scenario(flights_data_path,
+                  simulation_data_path,
+                  arrival_runways,
+                  departure_runways,
+                  start = DEFAULT_WAVE_START,
+                  last_wave = DEFAULT_LAST_WAVE,
+                  instrumentation = SILENT,
+                  seed = None):
+    '''Yields a Euroscope sweatbox scenario with arrivals and departures chunk by chunk.
+    Pass the result to write_scenario to stream it to a file.'''
+
+    with instrumentation.stage('load'):
+        tma_data = load_tma_data(simulation_data_path, flights_data_path)
+    yield from iter_scenario_from_data(tma_data, arrival_runways, departure_runways,
+                                       start=start, last_wave=last_wave,
+                                       instrumentation=instrumentation, seed=seed)
+
+def iter_scenario_from_data(tma_data,
+                            arrival_runways,
+                            departure_runways,
+                            start = DEFAULT_WAVE_START,
+                            last_wave = DEFAULT_LAST_WAVE,
+                            instrumentation = SILENT,
+                            seed = None,
+                            renderer = None,
+                            callsign_share = None,
+                            sampler = None):
+    '''Yields a Euroscope sweatbox scenario from already loaded TMA data (see tma_cache).
+    The header sections come first, then every flight block as soon as it is generated.
+
+    All randomness comes from a random.Random(seed) of this scenario, so a given seed
+    reproduces the scenario. Without a seed, the generator is seeded from the OS.
+
+    The stages (header, index, arrivals, departures <runway>) are reported
+    to instrumentation, see the instrumentation module.
+
+    Flight blocks are rendered by renderer, a renderer.FlightRenderer of this TMA that
+    can be kept across scenarios to reuse what it rendered before.
+
+    If the TMA config enables synthetic flights, flights are synthesized once the library
+    runs out (see the synthesizer module), with the callsigns of callsign_share.
+
+    The scenarios of a diverse batch share a diversity.DiversitySampler sampler, which
+    prefers the flights and fixes used less by the other scenarios and notes the drawn flights.'''
+
+    rng = random.Random(seed)
+    instrumentation.plan(['header', 'index', 'arrivals']
+                         + [f'departures {runway}' for runway, _ in departure_runways])
+
+    with instrumentation.stage('header'):
+        sim_data = tma_data.sim_data
+        runways = generate_runways(sim_data['runway_data'], arrival_runways, departure_runways)
+        holdings = generate_holdings(sim_data['holding_data'])
+        controllers = generate_controllers(sim_data['controller_data'], sim_data['pseudopilot_data'])
+        header = SCENARIO_HEADER_TEMPLATE.format(sim_data['pseudopilot_data'],
+                                                 sim_data['airport_alt'],
+                                                 runways,
+                                                 holdings,
+                                                 controllers)
+    yield header
+
+    squawks = SquawkAllocator.from_config(sim_data)
+    synthesizer = FlightSynthesizer.for_tma(tma_data, rng, callsign_share)
+    renderer = renderer or FlightRenderer(sim_data)
+    with instrumentation.stage('index'):
+        arrival_index = build_arrival_index(tma_data.arrival_pools, rng, sampler)
+
+    yield from instrumentation.timed('arrivals',
+                                     iter_arrivals(arrival_runways,
+                                                   sim_data,
+                                                   arrival_index,
+                                                   squawks,
+                                                   start=start,
+                                                   last_wave=last_wave,
+                                                   instrumentation=instrumentation,
+                                                   rng=rng,
+                                                   renderer=renderer,
+                                                   synthesizer=synthesizer,
+                                                   sampler=sampler))
 
     for runway, departure_number in departure_runways:
-        all_flights += generate_departures_string(departure_number,
-                                                  runway,
-                                                  flight_data,
-                                                  sim_data,
-                                                  squawk_generator)
-
-    return SCENARIO_TEMPLATE.format(sim_data['pseudopilot_data'],
-                                    sim_data['airport_alt'],
-                                    runways,
-                                    holdings,
-                                    controllers,
-                                    all_flights)
+        yield from instrumentation.timed(f'departures {runway}',
+                                         iter_departures(departure_number,
+                                                         runway,
+                                                         tma_data.departure_pools,
+                                                         sim_data,
+                                                         squawks,
+                                                         instrumentation=instrumentation,
+                                                         rng=rng,
+                                                         departure_slots=tma_data.departure_slots.get(runway),
+                                                         renderer=renderer,
+                                                         synthesizer=synthesizer,
+                                                         sampler=sampler))
+
+    yield SCENARIO_FOOTER
+
+def _write_chunks(scenario_file, scenario_chunks, instrumentation):
+    '''Writes the chunks one by one, timing only the writes as the 'write' stage.'''
+
+    for chunk in scenario_chunks:
+        with instrumentation.stage('write'):
+            scenario_file.write(chunk)
 
 def save_scenario(output_path, scenario):
     '''Saves the scenario to output_path text file.'''
 
     with open(output_path, 'w', encoding='utf-8') as scenario_file:
         scenario_file.write(scenario)
+
+def write_scenario(output, scenario_chunks, instrumentation = SILENT):
+    '''Streams the scenario chunks (see iter_scenario) to output, which is either
+    a path to a text file or any file-like object with a write method.
+    A file is only created at the path once the whole scenario has been generated.'''
+
+    if hasattr(output, 'write'):
+        _write_chunks(output, scenario_chunks, instrumentation)
+        return
+
+    partial_path = output + '.part'
+    try:
+        with open(partial_path, 'w', encoding='utf-8') as scenario_file:
+            _write_chunks(scenario_file, scenario_chunks, instrumentation)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError): # open itself failed
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, output)
+
+_batch_data = {}
+
+def _init_batch_worker(tma_data):
+    '''Stores the TMA data loaded by the parent process in the worker process,
+    with a renderer shared by all scenarios of the worker.'''
+
+    _batch_data['tma_data'] = tma_data
+    _batch_data['renderer'] = FlightRenderer(tma_data.sim_data)
+
+def _generate_batch_scenario(output_path, seed, arrival_runways, departure_runways, start, last_wave,
+                             profile, callsign_share = None):
+    '''Generates and saves a single scenario of a batch with its own RNG stream
+    and share of the synthetic callsigns.
+    Returns the path and, if profile is set, the Profiler of this scenario.'''
+
+    profiler = Profiler() if profile else None
+    instrumentation = profiler or SILENT
+    with instrumentation.stage('total'):
+        write_scenario(output_path, iter_scenario_from_data(_batch_data['tma_data'],
+                                                            arrival_runways,
+                                                            departure_runways,
+                                                            start=start,
+                                                            last_wave=last_wave,
+                                                            instrumentation=instrumentation,
+                                                            seed=seed,
+                                                            renderer=_batch_data['renderer'],
+                                                            callsign_share=callsign_share),
+                       instrumentation)
+    return output_path, profiler
+
+def _generate_diverse_batch(tma_data, output_paths, seed_source, arrival_runways, departure_runways,
+                            start, last_wave, instrumentation = SILENT):
+    '''Generates and saves the scenarios of a diverse batch one after another, as each
+    depends on the flights used by the previous ones (see the diversity module).
+    A scenario too similar to an earlier one is generated again with a new seed,
+    up to MAX_DIVERSITY_ATTEMPTS times, after which the least similar attempt is kept.'''
+
+    sampler = DiversitySampler()
+    index = ScenarioIndex()
+    renderer = FlightRenderer(tma_data.sim_data)
+    for number, output_path in enumerate(output_paths):
+        best = None
+        for _ in range(MAX_DIVERSITY_ATTEMPTS):
+            with instrumentation.stage('total'):
+                scenario = ''.join(iter_scenario_from_data(tma_data,
+                                                           arrival_runways,
+                                                           departure_runways,
+                                                           start=start,
+                                                           last_wave=last_wave,
+                                                           instrumentation=instrumentation,
+                                                           seed=seed_source.getrandbits(64),
+                                                           renderer=renderer,
+                                                           callsign_share=(number, len(output_paths)),
+                                                           sampler=sampler))
+            drawn = sampler.take_drawn()
+            signature = index.signature(scenario_tokens(drawn))
+            similarity = index.most_similar(signature)
+            if best is None or similarity < best[0]:
+                best = similarity, scenario, drawn, signature
+            if similarity < index.similarity:
+                break
+            instrumentation.count('near duplicates')
+            instrumentation.log(f'Scenario {number + 1} is {similarity:.0%} similar to an earlier one, generating it again.')
+
+        _, scenario, drawn, signature = best
+        sampler.commit(drawn)
+        index.add(signature)
+        write_scenario(output_path, [scenario], instrumentation)
+    return list(output_paths)
+
+def generate_scenarios(n,
+                       flights_data_path,
+                       simulation_data_path,
+                       arrival_runways,
+                       departure_runways,
+                       output_pattern = 'scenario_{}.txt',
+                       jobs = None,
+                       start = DEFAULT_WAVE_START,
+                       last_wave = DEFAULT_LAST_WAVE,
+                       profiler = None,
+                       seed = None,
+                       tma_data = None,
+                       diverse = False):
+    '''Generates n scenarios across a pool of jobs processes (all CPUs by default).
+    The TMA data is loaded once (unless already loaded and given as tma_data) and handed to each worker. Every scenario is seeded
+    separately and saved to output_pattern formatted with its number (1 to n).
+    The seeds of the scenarios are drawn from seed, so a seeded batch is reproducible.
+    If a Profiler is given, the timings of all workers are merged into it.
+    A diverse batch avoids reusing flights and fixes and rejects near duplicate scenarios
+    (see _generate_diverse_batch), generating the scenarios in this process.
+    Returns the list of saved paths.'''
+
+    if tma_data is None:
+        with (profiler or SILENT).stage('load'):
+            tma_data = load_tma_data(simulation_data_path, flights_data_path)
+    seed_source = random.Random(seed) if seed is not None else random.SystemRandom()
+    if diverse:
+        return _generate_diverse_batch(tma_data, [output_pattern.format(number) for number in range(1, n + 1)],
+                                       seed_source, arrival_runways, departure_runways, start, last_wave,
+                                       profiler or SILENT)
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_batch_worker,
+                             initargs=(tma_data,)) as pool:
+        futures = [pool.submit(_generate_batch_scenario,
+                               output_pattern.format(number),
+                               seed_source.getrandbits(64),
+                               arrival_runways,
+                               departure_runways,
+                               start,
+                               last_wave,
+                               profiler is not None,
+                               (number - 1, n))
+                   for number in range(1, n + 1)]
+
+        saved_paths = []
+        for future in futures:
+            saved_path, worker_profiler = future.result()
+            saved_paths.append(saved_path)
+            if profiler is not None:
+                profiler.merge(worker_profiler)
+        return saved_paths
@@ -0,0 +1,124 @@
+'''Pluggable instrumentation for scenario generation. The generator reports stages,
+counters and log messages to an Instrumentation object. The default one is silent,
+Profiler collects per-stage timings for the --profile mode.'''
+
+import contextlib
+import json
+import time
+from collections import Counter, defaultdict
+
+_NO_TIMING = contextlib.nullcontext()
+
+
+class Instrumentation:
+    '''Silent instrumentation, used by default. Subclasses override the hooks they need.
+    With verbose=True, log messages (e.g. every added flight) are printed.'''
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def plan(self, stage_names):
+        '''Called once per scenario with the names of its top-level stages, in order.'''
+
+    def stage_started(self, name):
+        '''Called whenever a stage (see stage and timed) begins.'''
+
+    def stage(self, name):
+        '''Context manager around a stage of work.'''
+
+        self.stage_started(name)
+        return _NO_TIMING
+
+    def timed(self, name, iterable):
+        '''Wraps an iterable (e.g. a generator yielding scenario text) whose iteration is a stage.
+        Only the time spent producing the items counts, not the time the consumer spends on them.'''
+
+        self.stage_started(name)
+        return iterable
+
+    def count(self, name, amount=1):
+        '''Increments a counter, e.g. the number of generated arrivals.'''
+
+    def log(self, message):
+        '''A progress message for humans.'''
+
+        if self.verbose:
+            print(message)
+
+SILENT = Instrumentation()
+
+
+class Profiler(Instrumentation):
+    '''Collects the total time and the number of calls per stage, and the counters.
+    Stage times are inclusive: 'arrivals WA33' contains the 'render' time of its flights.'''
+
+    def __init__(self, verbose=False):
+        super().__init__(verbose)
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.stage_started(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+            self.calls[name] += 1
+
+    def timed(self, name, iterable):
+        self.stage_started(name)
+        return self._timed_iteration(name, iter(iterable))
+
+    def _timed_iteration(self, name, iterator):
+        self.calls[name] += 1
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds[name] += time.perf_counter() - started
+                return
+            self.seconds[name] += time.perf_counter() - started
+            yield item
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def merge(self, other):
+        '''Adds the timings and counters of another Profiler, e.g. from a batch worker.'''
+
+        for name, seconds in other.seconds.items():
+            self.seconds[name] += seconds
+        self.calls.update(other.calls)
+        self.counters.update(other.counters)
+
+    def report(self):
+        '''The collected data as a dictionary. Flights per second are counted
+        against the 'total' stage, i.e. the whole generation including writing.'''
+
+        flights = self.counters['arrivals'] + self.counters['departures']
+        total = self.seconds.get('total', 0.0)
+        return {'stages': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]}
+                           for name in self.seconds},
+                'counters': dict(self.counters),
+                'flights_per_second': flights / total if total else None}
+
+    def format_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def format_table(self):
+        '''The collected data as a plain text table.'''
+
+        report = self.report()
+        lines = [f'{"stage":<24}{"seconds":>12}{"calls":>10}']
+        for name, stage in report['stages'].items():
+            lines.append(f'{name:<24}{stage["seconds"]:>12.4f}{stage["calls"]:>10}')
+        lines.append('')
+        for name, value in report['counters'].items():
+            lines.append(f'{name:<24}{value:>12}')
+        if report['flights_per_second'] is not None:
+            lines.append(f'{"flights per second":<24}{report["flights_per_second"]:>12.1f}')
+        return '\n'.join(lines)
@@ -0,0 +1,92 @@
+'''Placement of the arrivals that spawn at the same time. Every arrival spawns at a random
+offset around the arrival spawn of its entry fix, so two of them (e.g. of different runways
+at a shared fix) could spawn almost on top of each other at similar altitudes. The placer
+checks every spawn of a START minute against the others placed at that minute and moves those
+too close by rejection sampling: new offsets are drawn until the arrival is laterally or
+vertically separated from all others, or the best one found is kept.
+
+The placed arrivals are kept in a grid hash with cells as wide as the lateral separation,
+so a spawn is only checked against the arrivals in the 3 x 3 cells around it. Placing
+hundreds of arrivals at once stays linear instead of comparing every pair.'''
+
+import math
+
+from defaults import SPAWN_OFFSET_LO, SPAWN_OFFSET_HI, NM_PER_DEGREE, SPAWN_LATERAL_SEPARATION, \
+                     SPAWN_VERTICAL_SEPARATION, MAX_PLACEMENT_ATTEMPTS
+
+
+class SpawnPlacer:
+    '''Keeps the arrivals spawning at the same START separated by lateral (nm)
+    or vertical (ft) separation, one placer per scenario.'''
+
+    def __init__(self, lateral = SPAWN_LATERAL_SEPARATION, vertical = SPAWN_VERTICAL_SEPARATION,
+                 attempts = MAX_PLACEMENT_ATTEMPTS):
+        self.lateral = lateral
+        self.vertical = vertical
+        self.attempts = attempts
+        self.cell_size = lateral / NM_PER_DEGREE # degrees of latitude
+        self.reference_cos = None
+        self.cells = {} # START: {cell: [(latitude, longitude, altitude)]}
+
+    @classmethod
+    def from_config(cls, sim_data):
+        '''The placer with the spawn_separation of the config, {"lateral": nm, "vertical": ft}, if any.'''
+
+        separation = sim_data.get('spawn_separation', {})
+        return cls(separation.get('lateral', SPAWN_LATERAL_SEPARATION),
+                   separation.get('vertical', SPAWN_VERTICAL_SEPARATION))
+
+    def _cell(self, latitude, longitude):
+        if self.reference_cos is None:
+            self.reference_cos = math.cos(math.radians(latitude))
+        return math.floor(latitude / self.cell_size), math.floor(longitude * self.reference_cos / self.cell_size)
+
+    def _clearance(self, cells, latitude, longitude, altitude):
+        '''Lateral distance (nm) to the nearest arrival in cells not vertically separated from the point,
+        up to the lateral separation (infinity if there is none that near).'''
+
+        row, column = self._cell(latitude, longitude)
+        longitude_scale = math.cos(math.radians(latitude))
+        # cells are narrower in nm further from the equator than the first arrival
+        columns = math.ceil(self.reference_cos / max(longitude_scale, 0.01))
+        nearest = math.inf
+        for cell_row in (row - 1, row, row + 1):
+            for cell_column in range(column - columns, column + columns + 1):
+                for other_latitude, other_longitude, other_altitude in cells.get((cell_row, cell_column), ()):
+                    if abs(other_altitude - altitude) >= self.vertical:
+                        continue
+                    distance = math.hypot(latitude - other_latitude,
+                                          (longitude - other_longitude) * longitude_scale) * NM_PER_DEGREE
+                    nearest = min(nearest, distance)
+        return nearest
+
+    def add(self, start, latitude, longitude, altitude):
+        '''Records an arrival spawning at START, e.g. one already in an edited scenario.'''
+
+        self.cells.setdefault(start, {}).setdefault(self._cell(latitude, longitude), []) \
+                  .append((latitude, longitude, altitude))
+
+    def place(self, start, spawns, bases, altitudes, rng):
+        '''Places the arrivals of a wave spawning at START, in order. spawns are their drawn
+        (latitude, longitude), bases the points the offsets are drawn around and altitudes in ft.
+        Returns {position in the wave: (latitude, longitude)} of the arrivals that had to move.'''
+
+        moved = {}
+        for position, ((latitude, longitude), (base_latitude, base_longitude), altitude) \
+                in enumerate(zip(spawns, bases, altitudes)):
+            cells = self.cells.get(start, {})
+            clearance = self._clearance(cells, latitude, longitude, altitude)
+            if clearance < self.lateral:
+                best = clearance, latitude, longitude
+                for _ in range(self.attempts):
+                    candidate = (base_latitude + rng.uniform(SPAWN_OFFSET_LO, SPAWN_OFFSET_HI),
+                                 base_longitude + rng.uniform(SPAWN_OFFSET_LO, SPAWN_OFFSET_HI))
+                    candidate_clearance = self._clearance(cells, *candidate, altitude)
+                    if candidate_clearance > best[0]:
+                        best = candidate_clearance, *candidate
+                        if candidate_clearance >= self.lateral:
+                            break
+                _, latitude, longitude = best
+                moved[position] = latitude, longitude
+            self.add(start, latitude, longitude, altitude)
+        return moved
@@ -0,0 +1,168 @@
+'''Flight block rendering for the hot path of scenario generation.
+Most of a flight block does not change between emissions: the $FP and SIMDATA lines
+belong to the flight, the $ROUTE and REQALT lines to its runway and fix. The renderer
+formats the templates once per flight and runway into a frame, the constant text
+around the fields that do change (squawk, position, altitude, START), and then only
+joins the frame with those fields. The blocks are FLIGHT_TEMPLATE with POSITION_TEMPLATE
+in it, formatted per ES docs.
+The lines that only depend on the flight, runway and fix are generated here as well.'''
+
+from collections import OrderedDict
+
+from defaults import DEFAULT_REQ_ALT_DEPARTURE, DEFAULT_REQ_ALT_ARRIVAL, \
+                     EXCEPTION_MSG_SID_AND_STAR, EXCEPTION_MSG_SID_OR_STAR, MAX_CACHED_FRAMES
+from templates import FLIGHT_TEMPLATE, POSITION_TEMPLATE, ROUTE_TEMPLATE, REQUALT_TEMPLATE
+
+FIELD = '\0'
+# placeholder for the fields of each emission, never part of the data
+
+
+def transform_heading(initial_heading):
+    '''Transforms a heading given as int or str in degrees into an integer
+    accepted by Euroscope/sweatbox. Formula per Euroscope docs.'''
+
+    transformed_heading = int(float(initial_heading) * 2.88 + 0.5) << 2
+    return transformed_heading
+
+def is_proper_arrival(flight, sim_data):
+    '''Checks if the last waypoint is an entry fix to TMA. If it is, it is a properly
+    defined arrival.'''
+
+    if sim_data:
+        return flight.entry_fix in sim_data['arrivals_fix_headings']
+    return False
+
+def generate_initial_heading(flight, sim_data=None, runway=None):
+    '''For arrivals, reads the heading from the simulation data according to the TMA entry fix.
+    For departures, reads the heading from the runway data.
+     
+    Caution: for departures it is assumed that the departures spawn on the runway!'''
+
+    if is_proper_arrival(flight, sim_data):
+        heading = sim_data['arrivals_fix_headings'][flight.entry_fix]
+
+    else:
+        assert sim_data and runway, 'When no initial heading is provided, sim data and runway are required.'
+        heading = sim_data['runway_data'][runway]['heading']
+    return transform_heading(heading)
+
+def generate_route(flight, sid_waypoints='', star_waypoints=''):
+    '''Generates route data for the given flight. Formula per ES docs, but simplified (route only).
+    $ROUTE:<point by point route>'''
+    assert sid_waypoints or star_waypoints, EXCEPTION_MSG_SID_OR_STAR
+    assert not (sid_waypoints and star_waypoints), EXCEPTION_MSG_SID_AND_STAR
+
+    route = ''
+    if star_waypoints:
+        route += ROUTE_TEMPLATE.format(flight.entry_fix + ' ' + star_waypoints)
+    elif sid_waypoints:
+        route += ROUTE_TEMPLATE.format(sid_waypoints + ' ' + flight.fpl_route)
+    return route
+
+def generate_reqalt(flight, requested_altitude_arrivals,
+                    requested_altitude_departures, destination_runway = None,
+                    sid_waypoints='', star_waypoints=''):
+    '''Generates requested altitude data for the given flight. Formula per ES docs.
+    $REQALT:<fix>:<altitude>
+    
+    If star_waypoints are provided, assumes it is an arrival and the last waypoint
+    in the route is the TMA boundary used as <fix>. If sid_waypoints are provided,
+    omits the <fix> and uses the default initial climb.'''
+
+    assert sid_waypoints or star_waypoints, EXCEPTION_MSG_SID_OR_STAR
+    assert not (sid_waypoints and star_waypoints), EXCEPTION_MSG_SID_AND_STAR
+
+    tma_boundary = flight.entry_fix
+
+    if star_waypoints:
+        try:
+            entry_fix = requested_altitude_arrivals[destination_runway][tma_boundary]
+            reqalt = REQUALT_TEMPLATE.format(tma_boundary, entry_fix)
+        except KeyError:
+            reqalt = REQUALT_TEMPLATE.format('', DEFAULT_REQ_ALT_ARRIVAL)
+    elif sid_waypoints:
+        departure_icao = flight.origin_airport
+        reqalt = REQUALT_TEMPLATE.format('', requested_altitude_departures.get(departure_icao, DEFAULT_REQ_ALT_DEPARTURE))
+    else:
+        reqalt = REQUALT_TEMPLATE.format('', DEFAULT_REQ_ALT_DEPARTURE)
+
+    return reqalt
+
+
+class FlightRenderer:
+    '''Renders the flight blocks of a TMA. A renderer can be kept for many scenarios
+    (e.g. one per batch worker), the frames it compiled are reused by all of them.
+    At most max_frames frames are kept, the least recently used are dropped first, as
+    synthetic and stored flights are new objects that are rarely rendered again.'''
+
+    def __init__(self, sim_data, max_frames = MAX_CACHED_FRAMES):
+        self.sim_data = sim_data
+        self.max_frames = max_frames
+        self._procedures = {} # (runway, fix or airport): (route, reqalt) of arrivals and departures
+        self._frames = OrderedDict() # (callsign, runway): (flight, frame), least recently used first
+
+    def _procedure_lines(self, flight, runway, arrival):
+        '''$ROUTE and REQALT lines, the same for all arrivals from a fix to a runway.
+        The route of a departure contains its flight plan, so only its REQALT is shared.'''
+
+        sim_data = self.sim_data
+        if arrival:
+            key = (runway, flight.entry_fix)
+            if key not in self._procedures:
+                star_waypoints = sim_data['arrivals_star_waypoints'][runway][flight.entry_fix]
+                self._procedures[key] = (generate_route(flight, star_waypoints=star_waypoints),
+                                         generate_reqalt(flight, sim_data['requested_altitude_arrivals'], None,
+                                                         destination_runway=runway, star_waypoints=star_waypoints))
+            return self._procedures[key]
+
+        sid_waypoints = sim_data['departures_sid_waypoints'][runway][flight.exit_fix]
+        key = (runway, flight.origin_airport)
+        if key not in self._procedures:
+            self._procedures[key] = (None, generate_reqalt(flight, None, sim_data['requested_altitude_departures'],
+                                                           sid_waypoints=sid_waypoints))
+        return generate_route(flight, sid_waypoints=sid_waypoints), self._procedures[key][1]
+
+    def compile_frame(self, flight, runway, arrival):
+        '''The flight block of the flight on the runway, split at the fields of each emission:
+        squawk, latitude, longitude, altitude and START.'''
+
+        route, reqalt = self._procedure_lines(flight, runway, arrival)
+        heading = generate_initial_heading(flight, self.sim_data, None if arrival else runway)
+        position = POSITION_TEMPLATE.format(flight.transponder, flight.callsign,
+                                            FIELD, FIELD, FIELD, FIELD, heading)
+        return tuple(FLIGHT_TEMPLATE.format(self.sim_data['pseudopilot_data'],
+                                            position,
+                                            flight.fpl,
+                                            flight.simdata,
+                                            route,
+                                            FIELD,
+                                            reqalt,
+                                            self.sim_data['initial_pseudopilot']).split(FIELD))
+
+    def frame(self, flight, runway, arrival):
+        '''The compiled frame, from the cache if the flight was rendered on the runway before.'''
+
+        key = (flight.callsign, runway)
+        cached = self._frames.get(key)
+        if cached is None or cached[0] is not flight:
+            cached = self._frames[key] = (flight, self.compile_frame(flight, runway, arrival))
+            if len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        self._frames.move_to_end(key)
+        return cached[1]
+
+    def render_into(self, buffer, flight, runway, spawn, squawk, altitude, start, arrival=True):
+        '''Appends the pieces of the flight block to buffer, a list shared by many flights
+        (e.g. a whole scenario) and joined once.'''
+
+        before_squawk, before_latitude, before_longitude, before_altitude, before_start, rest = \
+            self.frame(flight, runway, arrival)
+        buffer.extend((before_squawk, squawk, before_latitude, spawn[0], before_longitude, spawn[1],
+                       before_altitude, str(altitude), before_start, str(start), rest))
+
+    def render(self, flight, runway, spawn, squawk, altitude, start, arrival=True):
+        '''The flight block as a string.'''
+
+        buffer = []
+        self.render_into(buffer, flight, runway, spawn, squawk, altitude, start, arrival)
+        return ''.join(buffer)
@@ -2,7 +2,84 @@
 
 import argparse
 import itertools
-from generator import save_scenario, generate_scenario
+import os
+from generator import generate_scenarios, write_scenario
+from instrumentation import Instrumentation, Profiler
+from scenario_cache import ScenarioCache, write_cached_scenario
+from scenario_file import read_scenario, edit_scenario
+from tma_registry import registry, validate_runways
+from watch import watch_scenario
+
+def to_output_pattern(output_path):
+    '''Turns an output path into a numbered pattern for batch runs,
+    e.g. scenario.txt -> scenario_{}.txt. Paths that already contain {} are kept.'''
+
+    if '{}' in output_path:
+        return output_path
+    root, extension = os.path.splitext(output_path)
+    return f'{root}_{{}}{extension}'
+
+def generate_new_scenarios(args, profiler, instrumentation):
+    '''Generates the -count scenarios, a single one through the scenario cache.'''
+
+    saved_scenario_path = args.output_path
+    if not args.arr:
+        raise ValueError('At least one arrival runway must be specified with -arr.')
+    if not args.dep:
+        raise ValueError('At least one departure runway must be specified with -dep.')
+    if args.count < 1:
+        raise ValueError('-count must be at least 1.')
+    if args.diverse and args.count < 2:
+        raise ValueError('-diverse varies the scenarios of a batch, it needs -count above 1.')
+    if not saved_scenario_path:
+        saved_scenario_path = 'test_scenario.txt'
+
+    batched_departures = [(rwy, int(n)) for rwy, n in itertools.batched(args.dep, 2)]
+    with instrumentation.stage('load'):
+        tma_data = registry.get(args.TMA)
+    validate_runways(args.TMA, tma_data, args.arr, batched_departures)
+
+    if args.watch:
+        if args.count > 1:
+            raise ValueError('-watch regenerates a single scenario, it cannot be used with -count.')
+        watch_scenario(args.TMA, args.arr, batched_departures, saved_scenario_path,
+                       seed=args.seed, instrumentation=instrumentation)
+    elif args.count > 1:
+        config_path, flights_path = registry.paths(args.TMA)
+        saved_paths = generate_scenarios(args.count, flights_path, config_path, args.arr, batched_departures,
+                                         output_pattern=to_output_pattern(saved_scenario_path),
+                                         jobs=args.jobs,
+                                         profiler=profiler,
+                                         seed=args.seed,
+                                         tma_data=tma_data,
+                                         diverse=args.diverse)
+        print(f'Saved {len(saved_paths)} scenarios: {", ".join(saved_paths)}')
+    else:
+        with instrumentation.stage('total'):
+            cache = None if args.no_cache else ScenarioCache()
+            if write_cached_scenario(saved_scenario_path, tma_data, args.arr, batched_departures,
+                                     seed=args.seed, cache=cache, instrumentation=instrumentation):
+                print(f'Scenario with seed {args.seed} reused from the cache.')
+
+def edit_existing_scenario(args, instrumentation):
+    '''Regenerates the -arr arrivals and -dep departures of the -edit scenario, keeping the rest.'''
+
+    if not args.arr and not args.dep:
+        raise ValueError('Specify the runways to regenerate in the edited scenario with -arr and -dep.')
+    if not os.path.exists(args.edit):
+        raise ValueError(f'Scenario {args.edit} not found.')
+
+    departures = [(rwy, int(n)) for rwy, n in itertools.batched(args.dep or [], 2)]
+    with instrumentation.stage('load'):
+        tma_data = registry.get(args.TMA)
+    validate_runways(args.TMA, tma_data, args.arr or [], departures)
+    output_path = args.output_path or args.edit
+    with instrumentation.stage('total'):
+        scenario = read_scenario(args.edit, tma_data.sim_data)
+        edit_scenario(scenario, tma_data, args.arr or [], departures,
+                      instrumentation=instrumentation, seed=args.seed)
+        write_scenario(output_path, [str(scenario)], instrumentation)
+    print(f'Saved edited scenario to {output_path}')
 
 def main():
     arg_parser = argparse.ArgumentParser(description='Generates a Euroscope sweatbox scenario with arrivals and departures.')
@@ -10,26 +87,47 @@ def main():
     arg_parser.add_argument('TMA', type=str, help='TMA name, eg. EPWA.')
     arg_parser.add_argument('-arr', nargs='+', help='List of arrival runways, eg. WA33, MO26, LL25.')
     arg_parser.add_argument('-dep', nargs='+', help='List of departure runways followed by <number of departures>, eg. WA33 10.')
+    arg_parser.add_argument('-count', type=int, default=1, help='Number of scenarios to generate. Output files are numbered, eg. scenario_1.txt.')
+    arg_parser.add_argument('-jobs', type=int, help='Number of worker processes for -count above 1. Defaults to the number of CPUs.')
+    arg_parser.add_argument('-edit', type=str, help='Path to an existing scenario to edit. Only the arrivals of the -arr runways '
+                                                   'and the departures of the -dep runways are generated again. '
+                                                   'Saved to -output_path, by default over the edited scenario.')
+    arg_parser.add_argument('-seed', type=int, help='Seed of the random generator. The same seed gives the same scenario.')
+    arg_parser.add_argument('-diverse', action='store_true', help='With -count, prefer the flights and entry fixes '
+                                                                 'used least so far in the batch and generate again '
+                                                                 'scenarios too similar to an earlier one.')
+    arg_parser.add_argument('-watch', action='store_true', help='Keep running and generate the scenario again, '
+                                                               'with the same seed, whenever the TMA files change.')
+    arg_parser.add_argument('-no_cache', action='store_true', help='Always generate seeded scenarios instead of reusing cached ones.')
+    arg_parser.add_argument('-verbose', action='store_true', help='Print every generated wave and flight (single scenario only).')
+    arg_parser.add_argument('--profile', nargs='?', const='table', choices=['table', 'json'],
+                            help='Print the time spent in each generation stage as a table (default) or JSON.')
     args = arg_parser.parse_args()
 
-    config_path = f'data//{args.TMA}_config.json'
-    flights_path = f'data//{args.TMA}_flights.json'
-
     try:
-        saved_scenario_path = args.output_path
+        profiler = Profiler(verbose=args.verbose) if args.profile else None
+        instrumentation = profiler or Instrumentation(verbose=args.verbose)
 
-        if not args.arr:
-            raise ValueError('At least one arrival runway must be specified with -arr.')
-        if not args.dep:
-            raise ValueError('At least one departure runway must be specified with -dep.')
-        if not saved_scenario_path:
-            saved_scenario_path = 'test_scenario.txt'
+        if args.edit and args.watch:
+            raise ValueError('-watch cannot be used with -edit.')
+        if args.edit and args.diverse:
+            raise ValueError('-diverse cannot be used with -edit.')
+        if args.edit:
+            edit_existing_scenario(args, instrumentation)
+        else:
+            generate_new_scenarios(args, profiler, instrumentation)
 
-        batched_departures = [(rwy, int(n)) for rwy, n in itertools.batched(args.dep, 2)]
-        save_scenario(saved_scenario_path, generate_scenario(flights_path, config_path, args.arr, batched_departures))
+        if profiler:
+            print(profiler.format_json() if args.profile == 'json' else profiler.format_table())
 
-    except FileNotFoundError:
-        print(f'{args.TMA} TMA not found. Ensure the config and flights JSON files are in the data folder. The format is <TMA>_<type>.json')
+    except FileNotFoundError as error:
+        if error.filename not in registry.paths(args.TMA):
+            print(f'Error: {error}') # e.g. the folder of -output_path does not exist
+        else:
+            print(f'{args.TMA} TMA not found. Ensure the config and flights JSON files are in the data folder. The format is <TMA>_<type>.json')
+            print(f'Available TMAs: {", ".join(registry.names()) or "none"}')
+    except OSError as error:
+        print(f'Error: {error}')
     except ValueError as ve:
         print(f'Error: {ve}')
     except KeyError as ke:
@@ -1,9 +1,22 @@
 '''Simple GUI for the ES scenario generator.'''
 
 import tkinter as tk
-from tkinter import filedialog, messagebox
-import subprocess
-import os
+from tkinter import filedialog, messagebox, ttk
+import itertools
+import queue
+import threading
+
+from instrumentation import Instrumentation
+from scenario_cache import ScenarioCache, write_cached_scenario
+from tma_registry import registry, validate_runways
+
+POLL_INTERVAL = 100 # ms
+
+# messages from the generation thread, read by the Tk mainloop
+generation_events = queue.Queue()
+
+# seeded scenarios generated before
+scenario_cache = ScenarioCache()
 
 def select_output_file():
     file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
@@ -11,11 +24,73 @@ def select_output_file():
         output_path_entry.delete(0, tk.END)
         output_path_entry.insert(0, file_path)
 
+class ProgressInstrumentation(Instrumentation):
+    '''Posts the top-level generation stages to the events queue for the progress bar.'''
+
+    stage_names = [] # nothing is planned when the scenario comes from the cache
+
+    def plan(self, stage_names):
+        self.stage_names = stage_names
+
+    def stage_started(self, name):
+        if name in self.stage_names:
+            generation_events.put(("stage", (name, self.stage_names.index(name) + 1, len(self.stage_names))))
+
+def generate_in_background(tma, arrivals_list, departures_list, output_path, seed):
+    '''Runs on the worker thread. Never touches the widgets, only posts events.'''
+
+    try:
+        batched_departures = [(rwy, int(n)) for rwy, n in itertools.batched(departures_list, 2)]
+        tma_data = registry.get(tma) # stays loaded between clicks
+        validate_runways(tma, tma_data, arrivals_list, batched_departures)
+        if write_cached_scenario(output_path, tma_data, arrivals_list, batched_departures,
+                                 seed=seed, cache=scenario_cache, instrumentation=ProgressInstrumentation()):
+            generation_events.put(("done", f"Scenario with seed {seed} reused and saved to {output_path}."))
+        else:
+            generation_events.put(("done", f"Scenario generated and saved to {output_path}."))
+    except FileNotFoundError as error:
+        if error.filename not in registry.paths(tma):
+            generation_events.put(("error", f"Failed to save the scenario.\n{error}")) # e.g. the output folder is missing
+        else:
+            generation_events.put(("error", f"{tma} TMA not found. Ensure the config and flights JSON files are in the data folder."))
+    except ValueError as ve:
+        generation_events.put(("error", f"Failed to generate scenario.\n{ve}"))
+    except KeyError as ke:
+        generation_events.put(("error", f"Missing runway designation {ke} in the JSON data files. Scenario was not saved."))
+    except Exception as error: # e.g. the output file cannot be written, the button must come back anyway
+        generation_events.put(("error", f"Failed to generate scenario.\n{error!r}"))
+
+def poll_generation_events():
+    '''Updates the progress bar from the worker thread's events until it finishes.'''
+
+    while True:
+        try:
+            event, payload = generation_events.get_nowait()
+        except queue.Empty:
+            root.after(POLL_INTERVAL, poll_generation_events)
+            return
+
+        if event == "stage":
+            stage_name, stage_number, stage_count = payload
+            progress_bar.configure(maximum=stage_count, value=stage_number - 1)
+            status_label.configure(text=f"Generating {stage_name}")
+            continue
+
+        progress_bar.configure(value=progress_bar.cget("maximum") if event == "done" else 0)
+        status_label.configure(text="")
+        generate_button.configure(state=tk.NORMAL)
+        if event == "done":
+            messagebox.showinfo("Success", payload)
+        else:
+            messagebox.showerror("Error", payload)
+        return
+
 def run_generator():
     tma = tma_entry.get()
     arrivals = arrivals_entry.get()
     departures = departures_entry.get()
     output_path = output_path_entry.get()
+    seed = seed_entry.get().strip()
 
     if not tma:
         messagebox.showerror("Error", "TMA name is required.")
@@ -32,17 +107,20 @@ def run_generator():
     if not output_path:
         output_path = "test_scenario.txt"
 
+    if seed and not seed.lstrip("-").isdigit():
+        messagebox.showerror("Error", "Seed must be a whole number.")
+        return
+
     arrivals_list = arrivals.split()
     departures_list = departures.split()
 
-    generator_path = os.path.join(os.path.dirname(__file__), "run_cli.py")
-
-    try:
-        command = ["python", generator_path, tma, "-output_path", output_path, "-arr"] + arrivals_list + ["-dep"] + departures_list
-        subprocess.run(command, check=True, cwd=os.path.dirname(generator_path))  # Set the working directory
-        messagebox.showinfo("Success", f"Scenario generated and saved to {output_path}.")
-    except subprocess.CalledProcessError as e:
-        messagebox.showerror("Error", f"Failed to generate scenario.\n{e}")
+    generate_button.configure(state=tk.DISABLED)
+    progress_bar.configure(value=0)
+    status_label.configure(text="Loading TMA data")
+    threading.Thread(target=generate_in_background,
+                     args=(tma, arrivals_list, departures_list, output_path, int(seed) if seed else None),
+                     daemon=True).start()
+    root.after(POLL_INTERVAL, poll_generation_events)
 
 # Create the main window
 root = tk.Tk()
@@ -70,9 +148,20 @@ output_path_entry.grid(row=3, column=1, padx=5, pady=5)
 output_path_button = tk.Button(root, text="Browse...", command=select_output_file)
 output_path_button.grid(row=3, column=2, padx=5, pady=5)
 
+# Seed
+tk.Label(root, text="Seed (optional, repeats a scenario):").grid(row=4, column=0, sticky="w")
+seed_entry = tk.Entry(root, width=30)
+seed_entry.grid(row=4, column=1, padx=5, pady=5)
+
 # Generate Button
 generate_button = tk.Button(root, text="Generate Scenario", command=run_generator)
-generate_button.grid(row=4, column=0, columnspan=3, pady=10)
+generate_button.grid(row=5, column=0, columnspan=3, pady=10)
+
+# Progress
+progress_bar = ttk.Progressbar(root, mode="determinate")
+progress_bar.grid(row=6, column=0, columnspan=3, sticky="we", padx=5)
+status_label = tk.Label(root, text="")
+status_label.grid(row=7, column=0, columnspan=3, pady=5)
 
 # Run the application
 root.mainloop()
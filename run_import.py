@@ -0,0 +1,58 @@
+'''Command-line importer of traffic dumps into the flight store of a TMA (see flight_store).'''
+
+import argparse
+import csv
+import json
+import os
+
+from flight_store import FlightStore, FlightMapper, ImportReport
+from tma_registry import registry, validate_config
+
+def parse_column_map(pairs):
+    '''['dep=origin_airport', ...] -> {'dep': 'origin_airport', ...}'''
+
+    column_map = {}
+    for pair in pairs or []:
+        column, separator, field_name = pair.partition('=')
+        if not separator:
+            raise ValueError(f'Invalid column mapping {pair}, expected <dump column>=<flight field>.')
+        column_map[column] = field_name
+    return column_map
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Imports CSV/JSON Lines traffic dumps into the flight store of a TMA.')
+    arg_parser.add_argument('TMA', type=str, help='TMA name, eg. EPWA.')
+    arg_parser.add_argument('dumps', nargs='+', help='CSV, JSON Lines (.jsonl) or flights JSON files, optionally .gz.')
+    arg_parser.add_argument('-map', nargs='+', help='Dump columns named differently than the flight fields, '
+                                                    'eg. dep=origin_airport arr=destination_airport route=fpl_route.')
+    arg_parser.add_argument('-store', type=str, help='Path to the flight store. Defaults to data/<TMA>_flights.db.')
+    args = arg_parser.parse_args()
+
+    config_path, _ = registry.paths(args.TMA)
+    store_path = args.store or registry.store_path(args.TMA)
+    try:
+        if not os.path.exists(config_path):
+            raise ValueError(f'{config_path} not found.')
+        with open(config_path, 'r', encoding='utf-8') as config_file:
+            sim_data = json.load(config_file)
+        problems = validate_config(sim_data)
+        if problems:
+            raise ValueError('Invalid config:\n' + '\n'.join(f'- {problem}' for problem in problems))
+
+        mapper = FlightMapper(sim_data, parse_column_map(args.map))
+        store = FlightStore(store_path)
+        report = ImportReport()
+        for dump_path in args.dumps:
+            print(f'Importing {dump_path}...')
+            store.import_dump(dump_path, mapper, report)
+        store.close()
+        print(report)
+        print(f'Saved to {store_path}')
+
+    except FileNotFoundError as error:
+        print(f'Error: {error.filename} not found.')
+    except (ValueError, csv.Error) as ve:
+        print(f'Error: {ve}')
+
+if __name__ == "__main__":
+    main()
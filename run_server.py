@@ -0,0 +1,237 @@
+'''Local HTTP/JSON service for the ES scenario generator, e.g. behind a web portal.
+All TMAs in the data folder are loaded once at startup and handed to a pool of
+worker processes, so a request only pays for the generation itself. A scenario is
+generated whole on a worker and buffered there, then sent back in its text chunks.
+
+    GET  /tmas      -> {"tmas": ["EPWA", ...]}
+    POST /scenario  -> the scenario text, sent with chunked transfer encoding
+         {"tma": "EPWA", "arrival_runways": ["WA33", "MO26"], "departure_runways": [["WA29", 10]],
+          "start": 0, "last_wave": 30, "seed": 1}
+
+Only the standard library is used. Try it with curl:
+    curl -d '{"tma": "EPWA", "arrival_runways": ["WA33"], "departure_runways": [["WA29", 10]]}' localhost:8000/scenario'''
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+from defaults import DEFAULT_WAVE_START, DEFAULT_LAST_WAVE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, \
+                     MAX_REQUEST_SIZE
+from generator import iter_scenario_from_data
+from renderer import FlightRenderer
+from tma_registry import registry, validate_runways, TMAValidationError
+
+_worker_data = {}
+
+
+def load_all_tmas():
+    '''Loads and validates every TMA in the data folder. Invalid ones are reported and skipped.'''
+
+    tmas = {}
+    for tma in registry.names():
+        try:
+            tmas[tma] = registry.get(tma)
+        except TMAValidationError as error:
+            print(error)
+    return tmas
+
+def _init_worker(tmas):
+    '''Stores the TMA data loaded by the server in the worker process, with a renderer per TMA.'''
+
+    _worker_data['tmas'] = tmas
+    _worker_data['renderers'] = {tma: FlightRenderer(tma_data.sim_data) for tma, tma_data in tmas.items()}
+
+def _generate(tma, arrival_runways, departure_runways, start, last_wave, seed):
+    '''Generates a scenario in a worker process. Returns its text chunks, all of them:
+    the whole scenario is held in memory before the response starts.'''
+
+    return list(iter_scenario_from_data(_worker_data['tmas'][tma], arrival_runways, departure_runways,
+                                        start=start, last_wave=last_wave, seed=seed,
+                                        renderer=_worker_data['renderers'][tma]))
+
+
+class RequestError(Exception):
+    '''An invalid request, answered with the given HTTP status and message.'''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_scenario_request(body, tmas):
+    '''Validates the JSON body of POST /scenario. Returns the arguments of _generate.'''
+
+    try:
+        request = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f'Invalid JSON: {error}')
+    if not isinstance(request, dict):
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'The request must be a JSON object.')
+
+    tma = request.get('tma')
+    if not isinstance(tma, str):
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'tma must be a TMA name, e.g. EPWA.')
+    if tma not in tmas:
+        raise RequestError(HTTPStatus.NOT_FOUND, f'{tma} TMA not found.')
+
+    arrival_runways = request.get('arrival_runways')
+    if not isinstance(arrival_runways, list) or not arrival_runways \
+            or not all(isinstance(runway, str) for runway in arrival_runways):
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'At least one arrival runway must be specified.')
+
+    departure_runways = request.get('departure_runways')
+    try:
+        if not isinstance(departure_runways, list):
+            raise TypeError(departure_runways)
+        departure_runways = [(runway, number) for runway, number in departure_runways]
+        if not all(isinstance(runway, str) and type(number) is int for runway, number in departure_runways):
+            raise TypeError(departure_runways) # a float or bool number is not a number of departures
+    except (TypeError, ValueError):
+        raise RequestError(HTTPStatus.BAD_REQUEST,
+                           'Departure runways must be a list of [runway, number of departures] pairs.')
+    if not departure_runways:
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'At least one departure runway must be specified.')
+    if any(number < 0 for _, number in departure_runways):
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'The number of departures cannot be negative.')
+
+    timings = [request.get('start', DEFAULT_WAVE_START), request.get('last_wave', DEFAULT_LAST_WAVE)]
+    seed = request.get('seed')
+    if not all(type(value) is int for value in timings) or (seed is not None and type(seed) is not int):
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'start, last_wave and seed must be whole numbers.')
+    if timings[0] > timings[1]:
+        raise RequestError(HTTPStatus.BAD_REQUEST, 'start cannot be after last_wave.')
+
+    try:
+        validate_runways(tma, tmas[tma], arrival_runways, departure_runways)
+    except ValueError as error:
+        raise RequestError(HTTPStatus.UNPROCESSABLE_ENTITY, str(error))
+
+    return tma, arrival_runways, departure_runways, *timings, seed
+
+
+class ScenarioServer:
+    '''One request per connection, every response closes it. At most jobs scenarios
+    are generated at once, further requests wait in the pool's queue.'''
+
+    def __init__(self, tmas, jobs=None, verbose=False):
+        self.tmas = tmas
+        self.verbose = verbose
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(tmas,))
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await self.read_request(reader)
+            if path == '/tmas' and method == 'GET':
+                await self.send_json(writer, HTTPStatus.OK, {'tmas': sorted(self.tmas)})
+            elif path == '/scenario' and method == 'POST':
+                await self.send_scenario(writer, parse_scenario_request(body, self.tmas))
+            elif path in ('/tmas', '/scenario'):
+                raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, f'{method} is not allowed for {path}.')
+            else:
+                raise RequestError(HTTPStatus.NOT_FOUND, f'{path} not found.')
+        except RequestError as error:
+            await self.send_json(writer, error.status, {'error': str(error)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # the client went away
+        except Exception as error: # a bug or a broken worker, the client still gets an answer
+            print(f'Error handling a request: {error!r}')
+            try:
+                await self.send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR,
+                                     {'error': f'Failed to generate scenario: {error!r}'})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        '''Returns (method, path, body) of an HTTP/1.1 request.'''
+
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+        except (asyncio.LimitOverrunError, ValueError):
+            raise RequestError(HTTPStatus.BAD_REQUEST, 'Malformed request.')
+        if len(request_line) != 3:
+            raise RequestError(HTTPStatus.BAD_REQUEST, 'Malformed request line.')
+        if not 0 <= length <= MAX_REQUEST_SIZE:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request too large.')
+
+        method, target, _ = request_line
+        return method, target.split('?')[0], await reader.readexactly(length)
+
+    async def send_scenario(self, writer, arguments):
+        '''Generates the scenario on a worker and sends it back once it is complete, in the
+        chunks of the generator. As the response only starts after the generation, its errors
+        (e.g. an unknown runway) get a proper status.'''
+
+        if self.verbose:
+            print(f'Generating {arguments[0]} scenario: {arguments[1:]}')
+        try:
+            chunks = await asyncio.get_running_loop().run_in_executor(self.pool, _generate, *arguments)
+        except ValueError as error:
+            raise RequestError(HTTPStatus.UNPROCESSABLE_ENTITY, f'Failed to generate scenario. {error}')
+        except KeyError as error:
+            raise RequestError(HTTPStatus.UNPROCESSABLE_ENTITY,
+                               f'Missing runway designation {error} in the JSON data files.')
+
+        writer.write(self.response_head(HTTPStatus.OK, 'text/plain; charset=utf-8',
+                                        'Transfer-Encoding: chunked'))
+        for chunk in chunks:
+            if chunk: # an empty chunk would end the response
+                data = chunk.encode('utf-8')
+                writer.write(b'%X\r\n%b\r\n' % (len(data), data))
+                await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def send_json(self, writer, status, content):
+        data = json.dumps(content).encode('utf-8')
+        writer.write(self.response_head(status, 'application/json', f'Content-Length: {len(data)}') + data)
+        await writer.drain()
+
+    @staticmethod
+    def response_head(status, content_type, length_header):
+        return (f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'{length_header}\r\n'
+                'Connection: close\r\n\r\n').encode('latin-1')
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def serve(host, port, tmas, jobs=None, verbose=False):
+    scenario_server = ScenarioServer(tmas, jobs, verbose)
+    try:
+        server = await asyncio.start_server(scenario_server.handle, host, port)
+        async with server:
+            print(f'Serving {", ".join(sorted(tmas))} on http://{host}:{port}')
+            await server.serve_forever()
+    finally:
+        scenario_server.close()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Serves Euroscope sweatbox scenarios over HTTP.')
+    arg_parser.add_argument('-host', type=str, default=DEFAULT_SERVER_HOST, help='Address to listen on.')
+    arg_parser.add_argument('-port', type=int, default=DEFAULT_SERVER_PORT, help='Port to listen on.')
+    arg_parser.add_argument('-jobs', type=int, help='Number of worker processes. Defaults to the number of CPUs.')
+    arg_parser.add_argument('-verbose', action='store_true', help='Print every request.')
+    args = arg_parser.parse_args()
+
+    tmas = load_all_tmas()
+    if not tmas:
+        print('No TMA found. Ensure the config and flights JSON files are in the data folder.')
+        return
+    try:
+        asyncio.run(serve(args.host, args.port, tmas, args.jobs, args.verbose))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
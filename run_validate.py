@@ -0,0 +1,48 @@
+'''Command-line validator of scenario files of a TMA (see scenario_validator).'''
+
+import argparse
+import json
+from collections import Counter
+
+from scenario_validator import find_scenarios, validate_scenarios
+from tma_registry import registry
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Validates scenario files against the config of their TMA.')
+    arg_parser.add_argument('TMA', type=str, help='TMA name, eg. EPWA.')
+    arg_parser.add_argument('paths', nargs='+', help='Scenario files or folders of them (*.txt, subfolders included).')
+    arg_parser.add_argument('-jobs', type=int, help='Number of worker processes. Defaults to the number of CPUs.')
+    arg_parser.add_argument('-problems_only', action='store_true', help='List only the files with problems.')
+    arg_parser.add_argument('-output_path', type=str, help='Path to a JSON report with the problems and '
+                                                          'the flights spawning every minute of each file.')
+    args = arg_parser.parse_args()
+
+    try:
+        sim_data = registry.get(args.TMA).sim_data
+        paths = find_scenarios(args.paths)
+        if not paths:
+            raise ValueError('No scenario files found.')
+
+        reports = []
+        problem_files = Counter()
+        for report in validate_scenarios(paths, sim_data, args.jobs):
+            reports.append(report)
+            if report.problems:
+                problem_files['files'] += 1
+                problem_files['problems'] += len(report.problems)
+            if report.problems or not args.problems_only:
+                print(report)
+        print(f'{len(reports)} scenarios validated, {problem_files["problems"]} problems '
+              f'in {problem_files["files"]} of them.')
+
+        if args.output_path:
+            with open(args.output_path, 'w', encoding='utf-8') as output_file:
+                json.dump([report.to_json() for report in reports], output_file, indent=2)
+
+    except FileNotFoundError:
+        print(f'{args.TMA} TMA not found. Ensure the config and flights JSON files are in the data folder.')
+    except ValueError as ve:
+        print(f'Error: {ve}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+'''On-disk cache of generated scenarios. Only seeded scenarios are reproducible,
+so only they are cached. A scenario is stored under a hash of everything that
+determines its content: the TMA data version, the runways, the timings and the seed.
+The cache is bounded in size and evicts the least recently used scenarios first.'''
+
+import hashlib
+import json
+import os
+import shutil
+
+from defaults import DEFAULT_WAVE_START, DEFAULT_LAST_WAVE, \
+                     DEFAULT_SCENARIO_CACHE_DIR, DEFAULT_SCENARIO_CACHE_SIZE
+from generator import iter_scenario_from_data, write_scenario
+from instrumentation import SILENT
+
+SCENARIO_KEY_VERSION = 5
+# bump whenever the generator output for the same seed changes, so that old entries are not served
+
+SCENARIO_EXTENSION = '.txt'
+# next to the scripts, wherever they are run from
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), DEFAULT_SCENARIO_CACHE_DIR)
+
+
+class ScenarioCache:
+    '''A folder of scenario files named by their key. The modification time of a file
+    is its last use, refreshed on every hit, and is the order of eviction.'''
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_SCENARIO_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(tma_version, arrival_runways, departure_runways, start, last_wave, seed):
+        '''Content address of a scenario request.'''
+
+        request = {'version': SCENARIO_KEY_VERSION,
+                   'tma': tma_version,
+                   'arrivals': list(arrival_runways),
+                   'departures': [[runway, number] for runway, number in departure_runways],
+                   'start': start,
+                   'last_wave': last_wave,
+                   'seed': seed}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + SCENARIO_EXTENSION)
+
+    def get(self, key):
+        '''Returns the path of the cached scenario and marks it as used, or None.'''
+
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, scenario_path):
+        '''Stores a copy of the scenario file and evicts old entries if the cache is too big.'''
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        partial_path = self._path(key) + '.part'
+        shutil.copyfile(scenario_path, partial_path)
+        os.replace(partial_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        '''Removes the least recently used scenarios until the cache fits in max_bytes.'''
+
+        entries = []
+        with os.scandir(self.cache_dir) as cache_entries:
+            for entry in cache_entries:
+                if entry.name.endswith(SCENARIO_EXTENSION):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError: # evicted concurrently
+                pass
+            total_size -= size
+
+
+def write_cached_scenario(output_path, tma_data, arrival_runways, departure_runways,
+                          start = DEFAULT_WAVE_START,
+                          last_wave = DEFAULT_LAST_WAVE,
+                          seed = None,
+                          cache = None,
+                          instrumentation = SILENT):
+    '''Writes the scenario to output_path, copying it from the cache when the same seeded
+    request was generated before. Unseeded scenarios are always generated.
+    Returns True on a cache hit.'''
+
+    if seed is None or cache is None:
+        write_scenario(output_path, iter_scenario_from_data(tma_data, arrival_runways, departure_runways,
+                                                            start=start, last_wave=last_wave,
+                                                            instrumentation=instrumentation, seed=seed),
+                       instrumentation)
+        return False
+
+    key = cache.make_key(tma_data.version, arrival_runways, departure_runways, start, last_wave, seed)
+    with instrumentation.stage('cache'):
+        cached_path = cache.get(key)
+        if cached_path:
+            try:
+                shutil.copyfile(cached_path, output_path)
+                return True
+            except FileNotFoundError: # evicted in the meantime, generate it again
+                pass
+
+    write_scenario(output_path, iter_scenario_from_data(tma_data, arrival_runways, departure_runways,
+                                                        start=start, last_wave=last_wave,
+                                                        instrumentation=instrumentation, seed=seed),
+                   instrumentation)
+    with instrumentation.stage('cache'):
+        cache.put(key, output_path)
+    return False
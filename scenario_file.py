@@ -0,0 +1,294 @@
+'''Editing of generated scenario files. A scenario is read into its sections (runways,
+holdings, controllers) and its flight blocks, each block tagged with the runway it
+belongs to. The arrivals or departures of a single runway can then be generated again
+without touching the rest of the file: the new flights never reuse a callsign or
+squawk code of the untouched blocks, new arrivals keep the entry fix separation
+from the untouched arrivals and spawn apart from those spawning at the same time,
+and the blocks are spliced back in place.'''
+
+import random
+import re
+from dataclasses import dataclass
+
+from defaults import FIR_PREFIX, DEFAULT_WAVE_START, DEFAULT_LAST_WAVE
+from generator import build_arrival_index, iter_arrivals, iter_departures
+from instrumentation import SILENT
+from placement import SpawnPlacer
+from renderer import transform_heading
+from squawk import SquawkAllocator
+from synthesizer import FlightSynthesizer
+from templates import RUNWAY_TEMPLATE
+
+FLIGHT_BLOCK = re.compile(r'^PSEUDOPILOT:[^\n]*\n@.*?^INITIALPSEUDOPILOT:[^\n]*', re.MULTILINE | re.DOTALL)
+BLOCK_SEPARATOR = '\n\n'
+ARRIVAL = 'arrival'
+DEPARTURE = 'departure'
+
+
+@dataclass(eq=False)
+class FlightBlock:
+    '''A flight block of a scenario file, text being the whole block.
+    kind and runway are None for blocks that match no procedure of the TMA.'''
+
+    text: str
+    callsign: str
+    squawk: str
+    heading: str
+    latitude: str
+    longitude: str
+    altitude: str
+    origin_airport: str
+    destination_airport: str
+    fpl_route: str
+    route: str
+    start: int
+    kind: str = None
+    runway: str = None
+
+    @classmethod
+    def parse(cls, text):
+        fields = {}
+        for line in text.split('\n'):
+            if line.startswith('@'):
+                position = line.split(':')
+                fields.update(callsign=position[1], squawk=position[2], latitude=position[4],
+                              longitude=position[5], altitude=position[6], heading=position[8])
+            elif line.startswith('$FP'):
+                fpl = line.split(':', 16)
+                fields.update(origin_airport=fpl[5], destination_airport=fpl[9], fpl_route=fpl[16])
+            elif line.startswith('$ROUTE:'):
+                fields['route'] = line[len('$ROUTE:'):]
+            elif line.startswith('START:'):
+                fields['start'] = int(line[len('START:'):])
+        try:
+            return cls(text, **fields)
+        except TypeError:
+            raise ValueError(f'Incomplete flight block:\n{text}')
+
+
+@dataclass
+class ScenarioFile:
+    '''A scenario split into the header (everything before the first flight block),
+    the flight blocks and the footer (everything after the last one).
+    str() gives back the text, unchanged as long as nothing was edited.'''
+
+    header: str
+    flights: list
+    footer: str
+
+    def __str__(self):
+        return self.header + BLOCK_SEPARATOR.join(flight.text for flight in self.flights) + self.footer
+
+    def sections(self):
+        '''{'runways': [...], 'holdings': [...], 'controllers': [...]}, the lines of each header section.'''
+
+        lines = self.header.split('\n')
+        return {'runways': [line for line in lines if line.startswith('ILS')],
+                'holdings': [line for line in lines if line.startswith('HOLDING:')],
+                'controllers': [line for line in lines if line.startswith('CONTROLLER:')]}
+
+    def runway_flights(self, runway, kind):
+        '''The flight blocks of the arrivals or departures of the runway.'''
+
+        return [flight for flight in self.flights if flight.runway == runway and flight.kind == kind]
+
+    def add_runway(self, sim_data, runway):
+        '''Adds the ILS line of the runway to the header, unless it is already there.'''
+
+        runway_info = sim_data['runway_data'][runway]
+        line = RUNWAY_TEMPLATE.format(runway[-2:], runway_info['lat1'], runway_info['lon1'],
+                                      runway_info['lat2'], runway_info['lon2'])
+        runway_lines = self.sections()['runways']
+        if line in runway_lines:
+            return
+        if runway_lines:
+            self.header = self.header.replace(runway_lines[-1], runway_lines[-1] + '\n' + line, 1)
+        else:
+            airport_alt = re.search(r'^AIRPORT_ALT:[^\n]*\n', self.header, re.MULTILINE)
+            position = airport_alt.end() if airport_alt else 0
+            self.header = self.header[:position] + '\n' + line + '\n' + self.header[position:]
+
+
+def parse_scenario(text):
+    '''Splits the scenario text into a ScenarioFile. The blocks are not tagged with runways yet,
+    see assign_runways.'''
+
+    blocks = list(FLIGHT_BLOCK.finditer(text))
+    if not blocks:
+        return ScenarioFile(text, [], '')
+    return ScenarioFile(text[:blocks[0].start()],
+                        [FlightBlock.parse(block.group()) for block in blocks],
+                        text[blocks[-1].end():])
+
+class RunwayMatcher:
+    '''Tags flight blocks as the arrival or departure of a runway of the TMA, by matching
+    their $ROUTE with the STARs and SIDs. Departures on runways with the same SID are told
+    apart by their initial heading.'''
+
+    def __init__(self, sim_data):
+        self.arrival_routes = {}
+        for runway, stars in sim_data['arrivals_star_waypoints'].items():
+            for fix, star_waypoints in stars.items():
+                self.arrival_routes.setdefault((FIR_PREFIX + runway[:2], fix + ' ' + star_waypoints), runway)
+        self.departure_routes = {}
+        for runway, sids in sim_data['departures_sid_waypoints'].items():
+            heading = str(transform_heading(sim_data['runway_data'][runway]['heading']))
+            for sid_waypoints in sids.values():
+                self.departure_routes.setdefault((FIR_PREFIX + runway[:2], sid_waypoints), []).append((runway, heading))
+
+    def match(self, flight):
+        '''Sets the kind and runway of the flight block, both None if it matches no procedure.'''
+
+        flight.kind = flight.runway = None
+        runway = self.arrival_routes.get((flight.destination_airport, flight.route))
+        if runway:
+            flight.kind, flight.runway = ARRIVAL, runway
+            return flight
+        if not flight.route.endswith(' ' + flight.fpl_route):
+            return flight
+        sid_waypoints = flight.route[:len(flight.route) - len(flight.fpl_route) - 1]
+        candidates = self.departure_routes.get((flight.origin_airport, sid_waypoints), [])
+        for runway, heading in candidates:
+            if heading == flight.heading or len(candidates) == 1:
+                flight.kind, flight.runway = DEPARTURE, runway
+                break
+        return flight
+
+
+def assign_runways(scenario, sim_data):
+    '''Tags every flight block of the scenario with its runway, see RunwayMatcher.'''
+
+    matcher = RunwayMatcher(sim_data)
+    for flight in scenario.flights:
+        matcher.match(flight)
+    return scenario
+
+def iter_block_texts(lines):
+    '''Yields the text of every flight block in the lines of a scenario (e.g. an open file),
+    reading one line at a time, so a file of any size is never held in memory.'''
+
+    block = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if block is None:
+            if line.startswith('PSEUDOPILOT:'):
+                block = [line]
+        elif len(block) == 1 and not line.startswith('@'):
+            # a controller's PSEUDOPILOT line, or another block starting
+            block = [line] if line.startswith('PSEUDOPILOT:') else None
+        else:
+            block.append(line)
+            if line.startswith('INITIALPSEUDOPILOT:'):
+                yield '\n'.join(block)
+                block = None
+
+def iter_flight_blocks(lines):
+    '''Yields the FlightBlock of every flight block in the lines, see iter_block_texts.'''
+
+    for text in iter_block_texts(lines):
+        yield FlightBlock.parse(text)
+
+def read_scenario(path, sim_data):
+    '''Reads a scenario file into a ScenarioFile with the runways of its flights assigned.'''
+
+    with open(path, encoding='utf-8') as scenario_file:
+        return assign_runways(parse_scenario(scenario_file.read()), sim_data)
+
+def _parse_new_flights(chunks, runway, kind):
+    flights = parse_scenario(''.join(chunks)).flights
+    for flight in flights:
+        flight.kind, flight.runway = kind, runway
+    return flights
+
+def _taken_by(flights, tma_data, rng):
+    '''Callsigns in use, an allocator without the squawk codes in use
+    and a synthesizer (if enabled) that does not make the callsigns in use.'''
+
+    squawks = SquawkAllocator.from_config(tma_data.sim_data)
+    synthesizer = FlightSynthesizer.for_tma(tma_data, rng)
+    for flight in flights:
+        squawks.take(flight.squawk)
+        if synthesizer:
+            synthesizer.reserve(flight.callsign)
+    return {flight.callsign for flight in flights}, squawks, synthesizer
+
+def _without_callsigns(pools, callsigns):
+    return {key: pool.without(callsigns) if hasattr(pool, 'without')
+                 else [flight for flight in pool if flight.callsign not in callsigns]
+            for key, pool in pools.items()}
+
+def regenerate_arrivals(scenario, tma_data, runway, start = DEFAULT_WAVE_START, last_wave = DEFAULT_LAST_WAVE,
+                        instrumentation = SILENT, rng = random):
+    '''Replaces the arrivals to the runway with newly generated waves between start and last_wave.
+    The new blocks are merged into the other arrivals by START. Returns the new blocks.'''
+
+    sim_data = tma_data.sim_data
+    kept = [flight for flight in scenario.flights if not (flight.runway == runway and flight.kind == ARRIVAL)]
+    callsigns, squawks, synthesizer = _taken_by(kept, tma_data, rng)
+    taken_fix_times = {}
+    placer = SpawnPlacer.from_config(sim_data)
+    for flight in kept:
+        if flight.kind == ARRIVAL:
+            taken_fix_times.setdefault(flight.route.split(' ', 1)[0], []).append(flight.start)
+            placer.add(flight.start, float(flight.latitude), float(flight.longitude), int(flight.altitude))
+    for minutes in taken_fix_times.values():
+        minutes.sort()
+
+    arrival_index = build_arrival_index(_without_callsigns(tma_data.arrival_pools, callsigns), rng)
+    new_flights = _parse_new_flights(iter_arrivals([runway], sim_data, arrival_index, squawks, start, last_wave,
+                                                   instrumentation=instrumentation, rng=rng,
+                                                   taken_fix_times=taken_fix_times, synthesizer=synthesizer,
+                                                   placer=placer),
+                                     runway, ARRIVAL)
+
+    # arrivals come first in time order, pending ones go before the first later arrival or any departure
+    flights, pending = [], list(reversed(new_flights))
+    for flight in kept:
+        while pending and (flight.kind == DEPARTURE or flight.kind == ARRIVAL and pending[-1].start < flight.start):
+            flights.append(pending.pop())
+        flights.append(flight)
+    flights.extend(reversed(pending))
+    scenario.flights = flights
+    scenario.add_runway(sim_data, runway)
+    return new_flights
+
+def regenerate_departures(scenario, tma_data, runway, n = None, instrumentation = SILENT, rng = random):
+    '''Replaces the departures from the runway with n new ones (by default as many as there were).
+    They take the place of the old departures, or follow the last block. Returns the new blocks.'''
+
+    sim_data = tma_data.sim_data
+    old_flights = scenario.runway_flights(runway, DEPARTURE)
+    if n is None:
+        n = len(old_flights)
+    kept = [flight for flight in scenario.flights if not (flight.runway == runway and flight.kind == DEPARTURE)]
+    callsigns, squawks, synthesizer = _taken_by(kept, tma_data, rng)
+
+    new_flights = _parse_new_flights(iter_departures(n, runway,
+                                                     _without_callsigns(tma_data.departure_pools, callsigns),
+                                                     sim_data, squawks, instrumentation=instrumentation, rng=rng,
+                                                     departure_slots=tma_data.departure_slots.get(runway),
+                                                     synthesizer=synthesizer),
+                                     runway, DEPARTURE)
+
+    # nothing before the first old departure was removed, so it is at the same position in kept
+    position = next(number for number, flight in enumerate(scenario.flights) if flight is old_flights[0]) \
+               if old_flights else len(kept)
+    scenario.flights = kept[:position] + new_flights + kept[position:]
+    scenario.add_runway(sim_data, runway)
+    return new_flights
+
+def edit_scenario(scenario, tma_data, arrival_runways = (), departure_runways = (),
+                  start = DEFAULT_WAVE_START, last_wave = DEFAULT_LAST_WAVE,
+                  instrumentation = SILENT, seed = None):
+    '''Regenerates the arrivals of arrival_runways and the departures of departure_runways,
+    (runway, number of departures or None to keep the number) pairs, in the ScenarioFile.
+    All randomness comes from a random.Random(seed), as in generator.iter_scenario_from_data.'''
+
+    rng = random.Random(seed)
+    for runway in arrival_runways:
+        with instrumentation.stage(f'arrivals {runway}'):
+            regenerate_arrivals(scenario, tma_data, runway, start, last_wave, instrumentation, rng)
+    for runway, number in departure_runways:
+        with instrumentation.stage(f'departures {runway}'):
+            regenerate_departures(scenario, tma_data, runway, number, instrumentation, rng)
+    return scenario
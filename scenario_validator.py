@@ -0,0 +1,140 @@
+'''Validation of scenario files, generated or edited by hand, against the config of their TMA.
+The flight blocks are streamed from the file (see scenario_file.iter_block_texts) and checked for:
+- blocks that cannot be parsed,
+- callsigns and squawk codes used by more than one flight,
+- routes that match no STAR of arrivals_star_waypoints or SID of departures_sid_waypoints,
+- arrivals spawning far from the arrival spawn of their entry fix and departures spawning
+  outside the aerodrome (see departure_slots.aerodrome_boundary).
+The report of each file also counts the flights spawning at every START minute.
+Whole folders are validated on a pool of worker processes.'''
+
+import glob
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from defaults import FIR_PREFIX, MAX_SPAWN_DEVIATION
+from departure_slots import aerodrome_boundary, point_in_polygon
+from scenario_file import ARRIVAL, DEPARTURE, FlightBlock, RunwayMatcher, iter_block_texts
+from spatial import distance_nm
+
+SCENARIO_PATTERN = '*.txt'
+
+_validator_data = {}
+
+
+@dataclass
+class ScenarioReport:
+    '''The problems found in a scenario file and its traffic.
+    minute_counts: {START minute: flights spawning then}'''
+
+    path: str
+    arrivals: int = 0
+    departures: int = 0
+    problems: list = field(default_factory=list)
+    minute_counts: Counter = field(default_factory=Counter)
+
+    def __str__(self):
+        busiest = max(self.minute_counts.items(), key=lambda item: (item[1], -item[0]), default=None)
+        lines = [f'{self.path}: {self.arrivals} arrivals, {self.departures} departures, '
+                 f'{len(self.problems) or "no"} problems'
+                 + (f', busiest minute {busiest[0]} with {busiest[1]} flights' if busiest else '')]
+        lines += [f'- {problem}' for problem in self.problems]
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return {'path': self.path, 'arrivals': self.arrivals, 'departures': self.departures,
+                'problems': self.problems,
+                'minute_counts': {str(minute): count for minute, count in sorted(self.minute_counts.items())}}
+
+
+class ScenarioValidator:
+    '''Validates scenario files of the TMA with the config sim_data.'''
+
+    def __init__(self, sim_data, max_spawn_deviation = MAX_SPAWN_DEVIATION):
+        self.matcher = RunwayMatcher(sim_data)
+        self.max_spawn_deviation = max_spawn_deviation
+        self.arrival_spawns = {fix: (float(latitude), float(longitude))
+                               for fix, (latitude, longitude) in sim_data['arrival_spawns'].items()}
+        self.aerodromes = {airport: aerodrome_boundary(sim_data, airport)
+                           for airport in {FIR_PREFIX + runway[:2] for runway in sim_data['departures_sid_waypoints']}}
+
+    def _spawn_problem(self, flight):
+        latitude, longitude = float(flight.latitude), float(flight.longitude)
+        if flight.kind == ARRIVAL:
+            fix = flight.route.split(' ', 1)[0]
+            if fix not in self.arrival_spawns:
+                return f'{flight.callsign}: no arrival spawn for its entry fix {fix}'
+            distance = distance_nm(latitude, longitude, *self.arrival_spawns[fix])
+            if distance > self.max_spawn_deviation:
+                return f'{flight.callsign}: spawns {distance:.0f} nm from the arrival spawn of {fix}'
+        elif not point_in_polygon(latitude, longitude, self.aerodromes[flight.origin_airport]):
+            return f'{flight.callsign}: spawns outside the aerodrome of {flight.origin_airport}'
+        return None
+
+    def validate_lines(self, lines, path = ''):
+        '''The ScenarioReport of a scenario given as lines, e.g. an open file.'''
+
+        report = ScenarioReport(path)
+        callsigns, squawks = Counter(), {}
+        for text in iter_block_texts(lines):
+            try:
+                flight = self.matcher.match(FlightBlock.parse(text))
+                problem = self._spawn_problem(flight) if flight.kind else \
+                          f'{flight.callsign}: route {flight.route} matches no STAR or SID of the TMA'
+            except (ValueError, IndexError):
+                report.problems.append(f'cannot parse the flight block starting with {text.splitlines()[1]!r}')
+                continue
+            if problem:
+                report.problems.append(problem)
+            if flight.kind == ARRIVAL:
+                report.arrivals += 1
+            elif flight.kind == DEPARTURE:
+                report.departures += 1
+            report.minute_counts[flight.start] += 1
+            callsigns[flight.callsign] += 1
+            if callsigns[flight.callsign] == 2:
+                report.problems.append(f'{flight.callsign}: callsign used more than once')
+            if flight.squawk in squawks:
+                report.problems.append(f'{flight.callsign}: squawk {flight.squawk} already used by '
+                                       f'{squawks[flight.squawk]}')
+            else:
+                squawks[flight.squawk] = flight.callsign
+        return report
+
+    def validate_file(self, path):
+        '''The ScenarioReport of the scenario file.'''
+
+        try:
+            with open(path, encoding='utf-8', errors='replace') as scenario_file:
+                return self.validate_lines(scenario_file, path)
+        except OSError as error:
+            return ScenarioReport(path, problems=[f'cannot read the file: {error.strerror}'])
+
+
+def find_scenarios(paths):
+    '''The scenario files among paths, with the *.txt files of folders (and their subfolders) in place of them.'''
+
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, '**', SCENARIO_PATTERN), recursive=True)))
+        else:
+            found.append(path)
+    return found
+
+def _init_worker(sim_data):
+    '''Builds the validator once per worker process.'''
+
+    _validator_data['validator'] = ScenarioValidator(sim_data)
+
+def _validate_file(path):
+    return _validator_data['validator'].validate_file(path)
+
+def validate_scenarios(paths, sim_data, jobs = None):
+    '''Yields the ScenarioReport of every scenario file, in order, validated on jobs worker processes
+    (defaults to the number of CPUs).'''
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(sim_data,)) as pool:
+        yield from pool.map(_validate_file, paths, chunksize=max(1, len(paths) // (4 * (jobs or os.cpu_count() or 1))))
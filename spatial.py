@@ -0,0 +1,172 @@
+'''Snapping of arrivals to the TMA entry fixes. Arrivals spawn at the arrival_spawns point
+of their entry fix, the last waypoint of the route, so a route that ends anywhere else
+(e.g. imported traffic filed to a fix just outside the TMA) would never spawn in the right
+place. Such routes are cut at the last entry fix they pass, or else continued direct to the
+entry fix nearest to where they end.
+
+The positions come from arrival_spawns and the optional fix_coordinates of the config,
+{fix: [latitude, longitude]} of any other fixes, e.g. holding fixes and the fixes around
+the TMA that routes end at. The entry fixes are kept in a grid index, so the nearest one
+is found by looking at a few cells instead of measuring the distance to all of them.'''
+
+import math
+
+from defaults import FIR_PREFIX, EARTH_RADIUS_NM, GRID_CELL_SIZE, MAX_SNAP_DISTANCE
+
+# the config keys the snapping depends on
+SNAP_CONFIG_KEYS = ('arrival_spawns', 'fix_coordinates', 'arrivals_star_waypoints')
+
+
+def distance_nm(latitude1, longitude1, latitude2, longitude2):
+    '''Great-circle (haversine) distance in nautical miles between two points in degrees.'''
+
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    half_chord = math.sin((phi2 - phi1) / 2) ** 2 \
+                 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(half_chord)))
+
+def airport_fixes(procedures):
+    '''{airport: fixes with a procedure on every runway of the airport}, e.g. of arrivals_star_waypoints.'''
+
+    fixes = {}
+    for runway, runway_procedures in procedures.items():
+        airport = FIR_PREFIX + runway[:2]
+        fixes[airport] = fixes.get(airport, set(runway_procedures)) & set(runway_procedures)
+    return fixes
+
+
+class GridIndex:
+    '''Named points in a grid of cells of cell_size degrees of latitude. The cells are as many
+    degrees of longitude wider as makes them about square at the latitude of the first point.'''
+
+    def __init__(self, points, cell_size = GRID_CELL_SIZE):
+        '''points: {name: (latitude, longitude)}'''
+
+        self.cell_size = cell_size
+        latitudes = [latitude for latitude, _ in points.values()]
+        self.reference_cos = math.cos(math.radians(latitudes[0])) if latitudes else 1.0
+        self.longitude_cell_size = cell_size / max(self.reference_cos, 0.01)
+        self.latitude_range = (min(latitudes, default=0.0), max(latitudes, default=0.0))
+        self.cells = {}
+        for name, (latitude, longitude) in points.items():
+            self.cells.setdefault(self._cell(latitude, longitude), []).append((name, latitude, longitude))
+        rows = [row for row, _ in self.cells] or [0]
+        columns = [column for _, column in self.cells] or [0]
+        self.row_range, self.column_range = (min(rows), max(rows)), (min(columns), max(columns))
+
+    def __len__(self):
+        return sum(map(len, self.cells.values()))
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.longitude_cell_size)
+
+    def _ring(self, row, column, radius):
+        '''The cells radius cells away from (row, column), in the Chebyshev sense.'''
+
+        if radius == 0:
+            yield row, column
+            return
+        for delta in range(-radius, radius + 1):
+            yield row - radius, column + delta
+            yield row + radius, column + delta
+        for delta in range(-radius + 1, radius):
+            yield row + delta, column - radius
+            yield row + delta, column + radius
+
+    def nearest(self, latitude, longitude, max_distance = None):
+        '''(name, distance in nm) of the point nearest to the given one,
+        None if the index is empty or nothing is within max_distance.'''
+
+        if not self.cells:
+            return None
+        row, column = self._cell(latitude, longitude)
+        # a cell r rings away is at least r - 1 cells away both north-south and east-west, and an
+        # east-west cell is narrowest at the latitude furthest from the equator
+        furthest = max(abs(latitude), *map(abs, self.latitude_range))
+        cell_nm = self.cell_size * math.pi / 180 * EARTH_RADIUS_NM \
+                  * min(1.0, math.cos(math.radians(furthest)) / self.reference_cos)
+        last_radius = max(abs(row - self.row_range[0]), abs(row - self.row_range[1]),
+                          abs(column - self.column_range[0]), abs(column - self.column_range[1]))
+        best = None
+        for radius in range(last_radius + 1):
+            if best and best[1] <= (radius - 1) * cell_nm:
+                break
+            if max_distance is not None and (radius - 1) * cell_nm > max_distance:
+                break
+            for cell in self._ring(row, column, radius):
+                for name, point_latitude, point_longitude in self.cells.get(cell, ()):
+                    distance = distance_nm(latitude, longitude, point_latitude, point_longitude)
+                    if best is None or distance < best[1]:
+                        best = name, distance
+        if best is None or max_distance is not None and best[1] > max_distance:
+            return None
+        return best
+
+
+class EntryFixResolver:
+    '''Resolves arrival routes to routes ending at an entry fix of the destination airport.
+    The entry fixes of an airport are those with an arrival spawn and a STAR to every runway
+    of the airport (see airport_fixes). Snaps are remembered per fix, as many routes end at
+    the same few fixes.'''
+
+    def __init__(self, sim_data, max_distance = MAX_SNAP_DISTANCE):
+        self.max_distance = max_distance
+        spawns = sim_data['arrival_spawns']
+        self.fix_coordinates = {fix: (float(latitude), float(longitude))
+                                for fix, (latitude, longitude) in spawns.items()}
+        self.fix_coordinates.update((fix, (float(latitude), float(longitude)))
+                                    for fix, (latitude, longitude) in sim_data.get('fix_coordinates', {}).items())
+        self.entry_fixes = {airport: {fix for fix in fixes if fix in spawns}
+                            for airport, fixes in airport_fixes(sim_data['arrivals_star_waypoints']).items()}
+        self.indexes = {airport: GridIndex({fix: self.fix_coordinates[fix] for fix in fixes})
+                        for airport, fixes in self.entry_fixes.items()}
+        self.snapped_fixes = {}
+
+    def nearest_entry_fix(self, airport, latitude, longitude):
+        '''The entry fix of the airport nearest to the point, None if none is within max_distance.'''
+
+        index = self.indexes.get(airport)
+        nearest = index.nearest(latitude, longitude, self.max_distance) if index else None
+        return nearest[0] if nearest else None
+
+    def _snap_fix(self, airport, fix):
+        key = airport, fix
+        if key not in self.snapped_fixes:
+            self.snapped_fixes[key] = self.nearest_entry_fix(airport, *self.fix_coordinates[fix])
+        return self.snapped_fixes[key]
+
+    def resolve(self, airport, route, latitude = None, longitude = None):
+        '''The route (list of waypoints) to the airport, ending at an entry fix:
+        - unchanged if it already does,
+        - cut at the last entry fix in the route,
+        - continued direct to the entry fix nearest to the given spawn coordinates,
+        - cut after the last waypoint with known coordinates and continued direct to the entry fix nearest to it.
+        None if the airport has no entry fixes or none is within max_distance.'''
+
+        entry_fixes = self.entry_fixes.get(airport)
+        if not entry_fixes or not route:
+            return None
+        if route[-1] in entry_fixes:
+            return route
+        for position in range(len(route) - 1, -1, -1):
+            if route[position] in entry_fixes:
+                return route[:position + 1]
+        if latitude and longitude:
+            fix = self.nearest_entry_fix(airport, float(latitude), float(longitude))
+            return route + [fix] if fix else None
+        for position in range(len(route) - 1, -1, -1):
+            if route[position] in self.fix_coordinates:
+                fix = self._snap_fix(airport, route[position])
+                return route[:position + 1] + [fix] if fix else None
+        return None
+
+    def snap(self, flight_data):
+        '''A copy of the arrival of the flights JSON with its fpl_route resolved,
+        the arrival itself if it needs no change or cannot be resolved.'''
+
+        route = flight_data['fpl_route'].split()
+        resolved = self.resolve(flight_data['destination_airport'], route,
+                                flight_data.get('latitude'), flight_data.get('longitude'))
+        if resolved is None or resolved == route:
+            return flight_data
+        return {**flight_data, 'fpl_route': ' '.join(resolved)}
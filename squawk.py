@@ -0,0 +1,93 @@
+'''Squawk code allocation. The 4096 codes 0000-7777 (octal) are the bits of a single
+integer bitmap, a set bit being a free code. Allocating takes the lowest free bit,
+so codes are handed out in ascending order without scanning.
+
+Reserved codes (emergency, conspicuity etc., see DEFAULT_RESERVED_SQUAWKS) are never
+handed out. The TMA config can reserve more and give airports their own code blocks:
+    "squawk_reserved": ["0100-0177", "4000"],
+    "squawk_blocks": {"EPWA": ["2001-2077"], "EPMO": ["2101-2177"]}
+Codes outside of all blocks are shared by everyone.'''
+
+from defaults import DEFAULT_RESERVED_SQUAWKS
+
+SQUAWK_CODES = 4096 # 0000-7777 octal
+ALL_CODES = (1 << SQUAWK_CODES) - 1
+
+
+def parse_squawk(code):
+    '''0017 -> 15'''
+
+    if len(code) != 4 or not all(digit in '01234567' for digit in code):
+        raise ValueError(f'Invalid squawk code {code}, expected four octal digits.')
+    return int(code, 8)
+
+def format_squawk(number):
+    '''15 -> 0017'''
+
+    return f'{number:04o}'
+
+def squawk_mask(ranges):
+    '''Bitmap of codes in ranges, e.g. ["7500", "2001-2077"] (both ends included).'''
+
+    mask = 0
+    for squawk_range in ranges:
+        first, _, last = squawk_range.partition('-')
+        first = parse_squawk(first.strip())
+        last = parse_squawk(last.strip()) if last else first
+        if last < first:
+            raise ValueError(f'Invalid squawk range {squawk_range}.')
+        mask |= ((1 << (last - first + 1)) - 1) << first
+    return mask
+
+
+class SquawkAllocator:
+    '''Hands out unique squawk codes. Airports with a block get codes from it first
+    and from the shared codes once it is used up, other airports only from the shared codes.'''
+
+    def __init__(self, reserved=(), blocks=None):
+        reserved_mask = squawk_mask(DEFAULT_RESERVED_SQUAWKS) | squawk_mask(reserved)
+        self.blocks = {airport: squawk_mask(ranges) & ~reserved_mask
+                       for airport, ranges in (blocks or {}).items()}
+        blocked_mask = 0
+        for block in self.blocks.values():
+            blocked_mask |= block
+        self.shared = ALL_CODES & ~reserved_mask & ~blocked_mask
+        self.usable = ALL_CODES & ~reserved_mask
+        self.free = self.usable
+
+    @classmethod
+    def from_config(cls, sim_data):
+        '''An allocator with the reserved codes and blocks of the TMA config.'''
+
+        return cls(sim_data.get('squawk_reserved', ()), sim_data.get('squawk_blocks'))
+
+    def available(self, airport=None):
+        '''Number of codes that allocate can still hand out for the airport.'''
+
+        return (self.free & (self.blocks.get(airport, 0) | self.shared)).bit_count()
+
+    def allocate(self, airport=None):
+        '''Returns the lowest free code for the airport as a string, e.g. '0017'.'''
+
+        candidates = self.free & self.blocks.get(airport, 0) or self.free & self.shared
+        if not candidates:
+            raise ValueError(f'No free squawk codes left for {airport or "the scenario"}.')
+        lowest = candidates & -candidates
+        self.free ^= lowest
+        return format_squawk(lowest.bit_length() - 1)
+
+    def allocate_many(self, n, airport=None):
+        '''Allocates n codes at once, e.g. for a whole wave. Nothing is allocated
+        if there are not enough free codes.'''
+
+        available = self.available(airport)
+        if n > available:
+            raise ValueError(f'Not enough free squawk codes for {airport or "the scenario"}: '
+                             f'{n} needed, {available} left.')
+        return [self.allocate(airport) for _ in range(n)]
+
+    def take(self, code):
+        '''Marks a code that is already in use (e.g. in an edited scenario) as allocated.
+        Codes that are reserved or taken already are ignored.'''
+
+        self.free &= ~(1 << parse_squawk(code))
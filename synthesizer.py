@@ -0,0 +1,165 @@
+'''Synthetic traffic for scenarios that need more flights than the library has, e.g. long
+high-density sessions. Once the pool of an entry fix or airport runs dry, new flights are
+made on demand from a template flight of the same pool (its route, origin, destination
+and altitude) with a new callsign and an aircraft type from the TMA's mix.
+
+Synthesis is enabled per TMA by the synthetic_flights key of the config:
+    "synthetic_flights": {"airlines": {"LOT": 5, "RYR": 3}, "aircraft_types": {"B738/M": 4, "E195/M": 2}}
+Both are optional weights; by default the mix of the library is used.
+
+A synthetic callsign is the airline followed by a digit and two digits or letters
+(e.g. LOT3MH). Every airline has a bitmap of its 11664 callsigns, so uniqueness within
+a scenario costs a few kB however many flights are made, and a callsign of the
+library is never made. The scenarios of a batch each get their own share of the
+callsigns, so they are unique across the batch as well.'''
+
+import random
+from collections import Counter
+
+from flights import rename_flight
+
+CALLSIGN_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+CALLSIGN_SUFFIXES = 9 * len(CALLSIGN_CHARACTERS) ** 2 # per airline
+
+
+def format_callsign(airline, number):
+    '''('LOT', 0) -> LOT100, the numbers 0 to CALLSIGN_SUFFIXES - 1 make all callsigns of the airline.'''
+
+    first, rest = divmod(number, len(CALLSIGN_CHARACTERS) ** 2)
+    second, third = divmod(rest, len(CALLSIGN_CHARACTERS))
+    return f'{airline}{first + 1}{CALLSIGN_CHARACTERS[second]}{CALLSIGN_CHARACTERS[third]}'
+
+def parse_callsign(callsign):
+    '''LOT100 -> ('LOT', 0), None for callsigns that synthesis never makes.'''
+
+    if len(callsign) != 6 or callsign[3] not in '123456789' \
+       or callsign[4] not in CALLSIGN_CHARACTERS or callsign[5] not in CALLSIGN_CHARACTERS:
+        return None
+    size = len(CALLSIGN_CHARACTERS)
+    return callsign[:3], ((int(callsign[3]) - 1) * size + CALLSIGN_CHARACTERS.index(callsign[4])) * size \
+                         + CALLSIGN_CHARACTERS.index(callsign[5])
+
+def _aircraft_type(flight):
+    return flight.fpl.split(':', 4)[3]
+
+def _outside_share(index, count):
+    '''Bitmap of the callsign numbers that are not in share index of count.'''
+
+    share = 0
+    for number in range(index, CALLSIGN_SUFFIXES, count):
+        share |= 1 << number
+    return ((1 << CALLSIGN_SUFFIXES) - 1) & ~share
+
+
+class LibraryCallsigns:
+    '''The callsigns of the TMA's flight library: its Flight records and any flight stores
+    behind its pools (see flight_store), looked up when asked.'''
+
+    def __init__(self, tma_data):
+        self.callsigns = {flight.callsign for flight in tma_data.arrivals} \
+                         | {flight.callsign for flight in tma_data.departures}
+        pools = [*tma_data.arrival_pools.values(), *tma_data.departure_pools.values()]
+        self.stores = list({id(pool.store): pool.store for pool in pools if hasattr(pool, 'store')}.values())
+
+    def __contains__(self, callsign):
+        return callsign in self.callsigns or any(store.has_callsign(callsign) for store in self.stores)
+
+
+class FlightSynthesizer:
+    '''Makes unique flights of a TMA on demand, one synthesizer per scenario.
+    share = (index, count) limits it to every count-th callsign from index,
+    e.g. scenario index of a batch of count.'''
+
+    def __init__(self, tma_data, airlines, aircraft_types, rng = random, share = None):
+        self.arrival_pools = tma_data.arrival_pools
+        self.departure_pools = tma_data.departure_pools
+        self.library_callsigns = LibraryCallsigns(tma_data)
+        self.airlines, self.airline_weights = list(airlines), list(airlines.values())
+        self.aircraft_types, self.aircraft_weights = list(aircraft_types), list(aircraft_types.values())
+        self.rng = rng
+        # airline: bitmap of used callsigns
+        self.used = dict.fromkeys(self.airlines, 0 if share is None else _outside_share(*share))
+        self.destinations = {destination for (_, destination), pool in self.arrival_pools.items() if pool}
+
+    @classmethod
+    def for_tma(cls, tma_data, rng = random, share = None):
+        '''The synthesizer of the TMA, None unless its config has synthetic_flights.
+        The default mix is read from the flights of the library, or from the first flight
+        of every pool of a flight store.'''
+
+        settings = tma_data.sim_data.get('synthetic_flights')
+        if settings is None:
+            return None
+        airlines = settings.get('airlines')
+        aircraft_types = settings.get('aircraft_types')
+        if not airlines or not aircraft_types:
+            library = [*tma_data.arrivals, *tma_data.departures] \
+                      or [pool[0] for pool in [*tma_data.arrival_pools.values(), *tma_data.departure_pools.values()]
+                          if pool]
+            airlines = airlines or Counter(flight.callsign[:3] for flight in library
+                                           if flight.callsign[:3].isalpha() and flight.callsign[:3].isupper())
+            aircraft_types = aircraft_types or Counter(map(_aircraft_type, library))
+        if not airlines or not aircraft_types:
+            return None
+        return cls(tma_data, airlines, aircraft_types, rng, share)
+
+    def reserve(self, callsign):
+        '''Marks a callsign as used, e.g. one already in an edited scenario.'''
+
+        parsed = parse_callsign(callsign)
+        if parsed and parsed[0] in self.used:
+            self.used[parsed[0]] |= 1 << parsed[1]
+
+    def callsign(self):
+        '''A new callsign of a random airline, unique within this synthesizer and the library.'''
+
+        full = (1 << CALLSIGN_SUFFIXES) - 1
+        while True:
+            free_airlines = [(airline, weight) for airline, weight in zip(self.airlines, self.airline_weights)
+                             if self.used[airline] != full]
+            if not free_airlines:
+                raise ValueError('No synthetic callsigns left.')
+            airline = self.rng.choices([airline for airline, _ in free_airlines],
+                                       [weight for _, weight in free_airlines])[0]
+            # the first free callsign from a random one on, wrapping around
+            start = self.rng.randrange(CALLSIGN_SUFFIXES)
+            free = ~self.used[airline] & full
+            candidates = free >> start << start or free
+            number = (candidates & -candidates).bit_length() - 1
+            self.used[airline] |= 1 << number
+            callsign = format_callsign(airline, number)
+            if callsign not in self.library_callsigns:
+                return callsign
+
+    def _from_template(self, pool):
+        template = pool[self.rng.randrange(len(pool))]
+        aircraft_type = self.rng.choices(self.aircraft_types, self.aircraft_weights)[0]
+        return rename_flight(template, self.callsign(), aircraft_type)
+
+    def can_arrive(self, entry_fix, destination):
+        '''Whether arrivals from the entry fix to the destination airport can be made.'''
+
+        return bool(self.arrival_pools.get((entry_fix, destination)))
+
+    def arrives_to(self, destination):
+        '''Whether arrivals to the destination airport can be made from any entry fix.'''
+
+        return destination in self.destinations
+
+    def arrival(self, entry_fix, destination):
+        '''A new arrival from the entry fix to the destination airport.'''
+
+        pool = self.arrival_pools.get((entry_fix, destination))
+        if not pool:
+            raise ValueError(f'No arrivals from {entry_fix} to {destination} to synthesize more from.')
+        return self._from_template(pool)
+
+    def departures(self, n, origin, templates = None):
+        '''Yields n new departures from the origin airport, one at a time, made from the
+        templates if given (e.g. the library flights already drawn), else from its pool.'''
+
+        pool = templates or self.departure_pools.get(origin)
+        if n and not pool:
+            raise ValueError(f'No departures from {origin} to synthesize more from.')
+        for _ in range(n):
+            yield self._from_template(pool)
@@ -24,7 +24,7 @@ DELAY:1:2
 {6}
 INITIALPSEUDOPILOT:{7}'''
 
-SCENARIO_TEMPLATE = '''PSEUDOPILOT:{0}
+SCENARIO_HEADER_TEMPLATE = '''PSEUDOPILOT:{0}
 
 AIRPORT_ALT:{1}
 
@@ -34,5 +34,7 @@ AIRPORT_ALT:{1}
 
 {4}
 
-{5}
-'''
\ No newline at end of file
+'''
+# the flight blocks are streamed between the header and the footer
+
+SCENARIO_FOOTER = '\n'
\ No newline at end of file
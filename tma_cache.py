@@ -0,0 +1,183 @@
+'''Compiled cache of TMA data. The parsed config and flights JSON files, together
+with the lookup tables derived from them, are pickled next to the JSON files and
+reused until one of the source files changes.'''
+
+import hashlib
+import json
+import os
+import pickle
+from dataclasses import dataclass, field
+
+from departure_slots import SLOT_CONFIG_KEYS, build_all_departure_slots
+from flights import make_flight
+from spatial import SNAP_CONFIG_KEYS, EntryFixResolver
+
+CACHE_FORMAT = 4
+# bump whenever TMAData or the derived tables change shape
+
+CACHE_EXTENSION = '.cache'
+
+
+@dataclass
+class TMAData:
+    '''Parsed TMA config (sim_data) and flights as Flight records, with derived lookups:
+    arrival_pools: {(entry fix, destination airport): [arrivals]}
+    departure_pools: {origin airport: [departures]}
+    departure_slots: {departure runway: [(latitude, longitude)]}, see the departure_slots module
+    version: hash of both source files, changes whenever the data changes.'''
+
+    sim_data: dict
+    arrivals: list
+    departures: list
+    version: str
+    arrival_pools: dict = field(default_factory=dict)
+    departure_pools: dict = field(default_factory=dict)
+    departure_slots: dict = field(default_factory=dict)
+
+
+def compile_arrivals(sim_data, arrival_data):
+    '''(arrivals, arrival_pools) from the arrivals of the flights JSON. The entry fix of an arrival
+    is the last waypoint of its flight plan, after routes that do not end at an entry fix
+    are snapped to one (see spatial).'''
+
+    resolver = EntryFixResolver(sim_data)
+    arrivals = [make_flight(resolver.snap(flight)) for flight in arrival_data]
+    arrival_pools = {}
+    for flight in arrivals:
+        arrival_pools.setdefault((flight.entry_fix, flight.destination_airport), []).append(flight)
+    return arrivals, arrival_pools
+
+def compile_departures(departure_data):
+    '''(departures, departure_pools) from the departures of the flights JSON.'''
+
+    departures = [make_flight(flight) for flight in departure_data]
+    departure_pools = {}
+    for flight in departures:
+        departure_pools.setdefault(flight.origin_airport, []).append(flight)
+    return departures, departure_pools
+
+def compile_tma_data(sim_data, flight_data, version=''):
+    '''Turns the parsed flights JSON into Flight records and derives the lookup tables
+    used during generation.'''
+
+    arrivals, arrival_pools = compile_arrivals(sim_data, flight_data['arrivals'])
+    departures, departure_pools = compile_departures(flight_data['departures'])
+    return TMAData(sim_data, arrivals, departures, version,
+                   arrival_pools, departure_pools, build_all_departure_slots(sim_data))
+
+def recompile_tma_data(tma_data, sim_data, flight_data, version, flights_changed=True):
+    '''Like compile_tma_data, but keeps the tables of the previous tma_data that neither
+    the changed config keys nor changed flights (flights_changed) affect. Returns the new
+    TMAData and the names of the rebuilt tables.'''
+
+    changed_keys = {key for key in sim_data.keys() | tma_data.sim_data.keys()
+                    if sim_data.get(key) != tma_data.sim_data.get(key)}
+    refreshed = TMAData(sim_data, tma_data.arrivals, tma_data.departures, version,
+                        tma_data.arrival_pools, tma_data.departure_pools, tma_data.departure_slots)
+    rebuilt = []
+    if flights_changed or changed_keys & set(SNAP_CONFIG_KEYS):
+        refreshed.arrivals, refreshed.arrival_pools = compile_arrivals(sim_data, flight_data['arrivals'])
+        rebuilt.append('arrival pools')
+    if flights_changed:
+        refreshed.departures, refreshed.departure_pools = compile_departures(flight_data['departures'])
+        rebuilt.append('departure pools')
+    if changed_keys & set(SLOT_CONFIG_KEYS):
+        refreshed.departure_slots = build_all_departure_slots(sim_data)
+        rebuilt.append('departure slots')
+    return refreshed, rebuilt
+
+def get_cache_path(config_path):
+    '''data/EPWA_config.json -> data/EPWA.cache'''
+
+    root = config_path[:-len('_config.json')] if config_path.endswith('_config.json') else config_path
+    return root + CACHE_EXTENSION
+
+def hash_file(path):
+    '''SHA-256 of the file contents.'''
+
+    with open(path, 'rb') as source_file:
+        return hashlib.sha256(source_file.read()).hexdigest()
+
+def _stat_sources(paths):
+    '''(mtime in ns, size) of each source file.'''
+
+    return [(os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths]
+
+def _read_cache(cache_path):
+    '''Returns (header, open cache file) or (None, None) when the cache is missing or unreadable.
+    The header is a separate pickle, so stale caches are rejected without unpickling the data.'''
+
+    try:
+        cache_file = open(cache_path, 'rb')
+    except OSError:
+        return None, None
+    try:
+        header = pickle.load(cache_file)
+    except Exception: # a corrupted or foreign cache file is simply rebuilt
+        cache_file.close()
+        return None, None
+    return header, cache_file
+
+def _load_cached_data(cache_file):
+    '''Unpickles the TMA data following the header, None if the cache is corrupted.
+    It needs its own unpickler: the memo of the header's one would shift the indices.'''
+
+    try:
+        return pickle.load(cache_file)
+    except Exception: # rebuilt from the JSON files by the caller
+        return None
+
+def _write_cache(cache_path, header, tma_data):
+    '''Writes the cache atomically. A read-only data folder just means no cache.'''
+
+    partial_path = cache_path + '.part'
+    try:
+        with open(partial_path, 'wb') as cache_file:
+            pickle.dump(header, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(tma_data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial_path, cache_path)
+    except OSError:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def load_tma_data(config_path, flights_path, use_cache=True):
+    '''Loads TMA data, from the compiled cache if it is still valid.
+
+    The cache is valid when the mtime and size of both source files are unchanged.
+    If they changed, but the contents hash the same (e.g. after a checkout),
+    the cache is reused and its header refreshed. Otherwise the JSON files
+    are parsed again and the cache is rebuilt.'''
+
+    source_paths = [config_path, flights_path]
+    source_stats = _stat_sources(source_paths)
+    cache_path = get_cache_path(config_path)
+
+    source_hashes = None
+    header, cache_file = _read_cache(cache_path) if use_cache else (None, None)
+    if header is not None and header.get('format') == CACHE_FORMAT:
+        with cache_file:
+            if header['stats'] != source_stats:
+                source_hashes = [hash_file(path) for path in source_paths]
+            if header['stats'] == source_stats or header['hashes'] == source_hashes:
+                tma_data = _load_cached_data(cache_file)
+                if tma_data is not None:
+                    if header['stats'] != source_stats:
+                        _write_cache(cache_path, {**header, 'stats': source_stats}, tma_data)
+                    return tma_data
+    elif cache_file is not None:
+        cache_file.close()
+
+    if source_hashes is None:
+        source_hashes = [hash_file(path) for path in source_paths]
+    with open(config_path, 'r', encoding='utf-8') as config_file:
+        sim_data = json.load(config_file)
+    with open(flights_path, 'r', encoding='utf-8') as flights_file:
+        flight_data = json.load(flights_file)
+
+    version = hashlib.sha256(''.join(source_hashes).encode()).hexdigest()
+    tma_data = compile_tma_data(sim_data, flight_data, version)
+    if use_cache:
+        _write_cache(cache_path,
+                     {'format': CACHE_FORMAT, 'stats': source_stats, 'hashes': source_hashes},
+                     tma_data)
+    return tma_data
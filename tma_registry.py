@@ -0,0 +1,249 @@
+'''Registry of the TMAs in the data folder. A TMA is a <TMA>_config.json with its
+flights, either <TMA>_flights.json or a <TMA>_flights.db flight store (see flight_store),
+the store being used when there are both. The folder is only listed when the names are asked for,
+and a TMA is only loaded when it is used. Each TMA is checked once when it is
+loaded, so broken data fails before anything is generated, and then stays loaded
+for the life of the process.'''
+
+import glob
+import itertools
+import os
+import sqlite3
+from collections import Counter
+
+from defaults import FIR_PREFIX
+from flight_store import STORE_SUFFIX, load_store_tma_data
+from tma_cache import load_tma_data
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+CONFIG_SUFFIX = '_config.json'
+FLIGHTS_SUFFIX = '_flights.json'
+
+# top-level config keys and their JSON types
+CONFIG_SCHEMA = {
+    'pseudopilot_data': str,
+    'airport_alt': str,
+    'initial_pseudopilot': str,
+    'runway_data': dict,
+    'holding_data': list,
+    'controller_data': list,
+    'arrival_spawns': dict,
+    'arrivals_star_waypoints': dict,
+    'arrivals_fix_headings': dict,
+    'arrivals_wave_intervals': dict,
+    'arrivals_wave_minimum': dict,
+    'arrivals_wave_maximum': dict,
+    'departures_first_spawn': dict,
+    'departures_spawn_offset': dict,
+    'departures_sid_waypoints': dict,
+    'requested_altitude_departures': dict,
+    'requested_altitude_arrivals': dict,
+}
+OPTIONAL_CONFIG_SCHEMA = {
+    'arrivals_hourly_rate': dict,
+    'arrivals_max_capacity': dict,
+    'arrivals_fix_separation': int,
+    'squawk_reserved': list,
+    'squawk_blocks': dict,
+    'departures_slots': dict,
+    'departures_queue': dict,
+    'departures_slot_spacing': (int, float),
+    'aerodrome_boundaries': dict,
+    'synthetic_flights': dict,
+    'fix_coordinates': dict,
+    'spawn_separation': dict,
+}
+RUNWAY_KEYS = ('lat1', 'lon1', 'lat2', 'lon2', 'heading')
+HOLDING_KEYS = ('fix', 'inbound_track', 'turn')
+CONTROLLER_KEYS = ('name', 'frequency')
+
+
+class TMAValidationError(ValueError):
+    '''The config or flights of a TMA are invalid. problems lists everything found.'''
+
+    def __init__(self, tma, problems):
+        super().__init__(f'Invalid {tma} TMA data:\n' + '\n'.join(f'- {problem}' for problem in problems))
+        self.tma = tma
+        self.problems = problems
+
+
+def _check_float(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def validate_config(sim_data):
+    '''Returns the problems of a parsed config, an empty list if there are none.'''
+
+    problems = []
+    for key, expected_type in CONFIG_SCHEMA.items():
+        if key not in sim_data:
+            problems.append(f'config: missing {key}')
+        elif not isinstance(sim_data[key], expected_type):
+            problems.append(f'config: {key} must be a {expected_type.__name__}')
+    for key, expected_type in OPTIONAL_CONFIG_SCHEMA.items():
+        if key in sim_data and not isinstance(sim_data[key], expected_type):
+            problems.append(f'config: {key} has the wrong type')
+    if problems:
+        return problems # the checks below rely on the types
+
+    for designation, runway in sim_data['runway_data'].items():
+        if not isinstance(runway, dict) or not all(_check_float(runway.get(key)) for key in RUNWAY_KEYS):
+            problems.append(f'runway_data: {designation} needs numeric {", ".join(RUNWAY_KEYS)}')
+    for holding in sim_data['holding_data']:
+        if not isinstance(holding, dict) or any(key not in holding for key in HOLDING_KEYS):
+            problems.append(f'holding_data: {holding} needs {", ".join(HOLDING_KEYS)}')
+    for controller in sim_data['controller_data']:
+        if not isinstance(controller, dict) or any(key not in controller for key in CONTROLLER_KEYS):
+            problems.append(f'controller_data: {controller} needs {", ".join(CONTROLLER_KEYS)}')
+    for fix, spawn in sim_data['arrival_spawns'].items():
+        if not isinstance(spawn, list) or len(spawn) != 2 or not all(map(_check_float, spawn)):
+            problems.append(f'arrival_spawns: {fix} must be [latitude, longitude]')
+    for fix, coordinates in sim_data.get('fix_coordinates', {}).items():
+        if not isinstance(coordinates, list) or len(coordinates) != 2 or not all(map(_check_float, coordinates)):
+            problems.append(f'fix_coordinates: {fix} must be [latitude, longitude]')
+    for key, value in sim_data.get('spawn_separation', {}).items():
+        if key not in ('lateral', 'vertical') or not isinstance(value, (int, float)) or value < 0:
+            problems.append(f'spawn_separation: {key} must be lateral (nm) or vertical (ft), a number')
+
+    for runway, stars in sim_data['arrivals_star_waypoints'].items():
+        if runway not in sim_data['runway_data']:
+            problems.append(f'arrivals_star_waypoints: runway {runway} is not in runway_data')
+        if not isinstance(stars, dict):
+            problems.append(f'arrivals_star_waypoints: {runway} must map entry fixes to waypoints')
+        for key in ('arrivals_wave_intervals', 'arrivals_wave_minimum', 'arrivals_wave_maximum'):
+            if not isinstance(sim_data[key].get(runway), int):
+                problems.append(f'{key}: missing a whole number for arrival runway {runway}')
+        if sim_data['arrivals_wave_minimum'].get(runway, 0) > sim_data['arrivals_wave_maximum'].get(runway, 0):
+            problems.append(f'arrivals_wave_minimum: {runway} is above arrivals_wave_maximum')
+        for key in ('arrivals_hourly_rate', 'arrivals_max_capacity'):
+            limit = sim_data.get(key, {}).get(runway, 0)
+            if not isinstance(limit, int) or limit < 0:
+                problems.append(f'{key}: {runway} must be a whole number of arrivals')
+
+    for key in ('airlines', 'aircraft_types'):
+        weights = sim_data.get('synthetic_flights', {}).get(key, {})
+        if not isinstance(weights, dict) or not all(isinstance(weight, (int, float)) and weight > 0
+                                                    for weight in weights.values()):
+            problems.append(f'synthetic_flights: {key} must map names to positive weights')
+    for airline in sim_data.get('synthetic_flights', {}).get('airlines', {}):
+        if len(airline) != 3 or not airline.isalpha() or not airline.isupper():
+            problems.append(f'synthetic_flights: airline {airline} must be a three letter ICAO code')
+
+    slot_sources = ('departures_slots', 'departures_queue', 'departures_first_spawn')
+    for runway, sids in sim_data['departures_sid_waypoints'].items():
+        if runway not in sim_data['runway_data']:
+            problems.append(f'departures_sid_waypoints: runway {runway} is not in runway_data')
+        if not isinstance(sids, dict):
+            problems.append(f'departures_sid_waypoints: {runway} must map exit fixes to waypoints')
+        if not any(runway in sim_data.get(key, {}) for key in slot_sources):
+            problems.append(f'departure runway {runway} needs one of {", ".join(slot_sources)}')
+        elif runway not in sim_data.get('departures_slots', {}) and runway not in sim_data.get('departures_queue', {}) \
+             and runway not in sim_data['departures_spawn_offset']:
+            problems.append(f'departures_spawn_offset: missing departure runway {runway}')
+    return problems
+
+def validate_flights(tma_data):
+    '''Returns the problems of the flights: every flight must have a STAR (arrivals)
+    or SID (departures) on every runway of its airport that has any, and its own callsign.'''
+
+    sim_data = tma_data.sim_data
+    callsigns = Counter(flight.callsign for flight in itertools.chain(tma_data.arrivals, tma_data.departures))
+    problems = [f'{callsign}: callsign used by {count} flights' for callsign, count in callsigns.items() if count > 1]
+    checks = ((tma_data.arrivals, 'arrivals_star_waypoints', 'destination_airport', 'entry_fix', 'STAR'),
+              (tma_data.departures, 'departures_sid_waypoints', 'origin_airport', 'exit_fix', 'SID'))
+    for flights, procedures_key, airport_field, fix_field, procedure in checks:
+        runways_by_airport = {}
+        for runway, procedures in sim_data[procedures_key].items():
+            runways_by_airport.setdefault(FIR_PREFIX + runway[:2], []).append((runway, procedures))
+        for flight in flights:
+            fix = getattr(flight, fix_field)
+            for runway, procedures in runways_by_airport.get(getattr(flight, airport_field), ()):
+                if fix not in procedures:
+                    problems.append(f'{flight.callsign}: no {procedure} from {fix} for runway {runway} '
+                                    f'in {procedures_key}')
+    return problems
+
+def validate_runways(tma, tma_data, arrival_runways, departure_runways):
+    '''Checks the runways of a scenario request against the TMA before generating anything.
+    departure_runways are (runway, number of departures) pairs. With synthetic flights, a runway
+    needs just one departure to make more from. Raises ValueError listing all problems.'''
+
+    sim_data = tma_data.sim_data
+    problems = []
+    for runway in arrival_runways:
+        if runway not in sim_data['arrivals_star_waypoints']:
+            problems.append(f'unknown arrival runway {runway}, '
+                            f'known: {" ".join(sorted(sim_data["arrivals_star_waypoints"]))}')
+    for runway, number in departure_runways:
+        if runway not in sim_data['departures_sid_waypoints']:
+            problems.append(f'unknown departure runway {runway}, '
+                            f'known: {" ".join(sorted(sim_data["departures_sid_waypoints"]))}')
+            continue
+        available = len(tma_data.departure_pools.get(FIR_PREFIX + runway[:2], []))
+        if number > available and not (available and 'synthetic_flights' in sim_data):
+            problems.append(f'{number} departures requested from {runway}, but there are only {available} flights')
+        slots = len(tma_data.departure_slots.get(runway, ()))
+        if number > slots:
+            problems.append(f'{number} departures requested from {runway}, but there are only {slots} departure slots')
+    if problems:
+        raise ValueError(f'Cannot generate the {tma} scenario:\n' + '\n'.join(f'- {problem}' for problem in problems))
+
+
+class TMARegistry:
+    '''Finds, loads and validates TMAs in data_dir, each at most once.'''
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self._names = None
+        self._loaded = {}
+
+    def names(self):
+        '''Names of the TMAs with a config and flights, e.g. ['EPWA'].'''
+
+        if self._names is None:
+            config_paths = glob.glob(os.path.join(self.data_dir, '*' + CONFIG_SUFFIX))
+            self._names = sorted(name for name in (os.path.basename(path)[:-len(CONFIG_SUFFIX)]
+                                                   for path in config_paths)
+                                 if os.path.exists(self.paths(name)[1]) or os.path.exists(self.store_path(name)))
+        return self._names
+
+    def paths(self, tma):
+        '''(config path, flights path) of the TMA.'''
+
+        return (os.path.join(self.data_dir, tma + CONFIG_SUFFIX),
+                os.path.join(self.data_dir, tma + FLIGHTS_SUFFIX))
+
+    def store_path(self, tma):
+        '''Path of the flight store of the TMA, whether it exists or not.'''
+
+        return os.path.join(self.data_dir, tma + STORE_SUFFIX)
+
+    def get(self, tma):
+        '''The validated TMAData of the TMA. Raises FileNotFoundError for an unknown TMA
+        and TMAValidationError for invalid data.'''
+
+        if tma not in self._loaded:
+            try:
+                config_path, flights_path = self.paths(tma)
+                if os.path.exists(self.store_path(tma)):
+                    tma_data = load_store_tma_data(config_path, self.store_path(tma))
+                else:
+                    tma_data = load_tma_data(config_path, flights_path)
+            except (KeyError, TypeError, ValueError, sqlite3.DatabaseError) as error:
+                raise TMAValidationError(tma, [f'cannot compile the data: {error!r}']) from error
+            problems = validate_config(tma_data.sim_data) or validate_flights(tma_data)
+            if problems:
+                raise TMAValidationError(tma, problems)
+            self._loaded[tma] = tma_data
+        return self._loaded[tma]
+
+    def forget(self, tma):
+        '''Drops the loaded TMA, so the next get loads it again (e.g. after its files changed).'''
+
+        self._loaded.pop(tma, None)
+        self._names = None
+
+registry = TMARegistry()
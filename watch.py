@@ -0,0 +1,132 @@
+'''Watch mode: keeps a TMA loaded while its files are edited and regenerates a preview
+scenario with the same runways, timings and seed after every change. The data folder
+is polled for changes to the files of the watched TMA only. A changed config is compared
+key by key with the previous one, so only the tables depending on the changed keys are
+rebuilt (see tma_cache.recompile_tma_data), and the flights JSON is only parsed again
+when it changed itself. TMAs with a flight store are simply loaded again.'''
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import time
+
+from defaults import DEFAULT_WAVE_START, DEFAULT_LAST_WAVE, DEFAULT_WATCH_INTERVAL
+from flight_store import load_store_tma_data
+from generator import iter_scenario_from_data, write_scenario
+from instrumentation import SILENT
+from tma_cache import hash_file, load_tma_data, recompile_tma_data
+from tma_registry import registry, validate_config, validate_flights, validate_runways, TMAValidationError
+
+
+def _stat(path):
+    '''(mtime in ns, size) of the file, None if it does not exist.'''
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TMAWatcher:
+    '''Keeps the TMAData of a TMA of the registry up to date with its files.'''
+
+    def __init__(self, tma, tma_registry = registry):
+        self.tma = tma
+        self.registry = tma_registry
+        self.config_path, self.flights_path = tma_registry.paths(tma)
+        self.store_path = tma_registry.store_path(tma)
+        self.tma_data = tma_registry.get(tma)
+        self.stats = self._stats()
+        self.changed = set() # files changed since the last successful reload
+        self.flight_data = None # the parsed flights JSON, read on the first change
+
+    def _stats(self):
+        return {path: _stat(path) for path in (self.config_path, self.flights_path, self.store_path)}
+
+    def _read_json(self, path):
+        with open(path, 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
+
+    def _reload(self):
+        '''(TMAData, names of the rebuilt tables) from the changed files.'''
+
+        if self.stats[self.store_path] is not None or self.store_path in self.changed:
+            # a store is simply loaded again, as is the JSON library once a store is removed
+            self.flight_data = None
+            if self.stats[self.store_path] is not None:
+                return load_store_tma_data(self.config_path, self.store_path), ['everything']
+            return load_tma_data(self.config_path, self.flights_path), ['everything']
+
+        sim_data = self._read_json(self.config_path) if self.config_path in self.changed else self.tma_data.sim_data
+        problems = validate_config(sim_data)
+        if problems:
+            raise TMAValidationError(self.tma, problems)
+        flights_changed = self.flights_path in self.changed
+        if flights_changed or self.flight_data is None:
+            self.flight_data = self._read_json(self.flights_path)
+        version = hashlib.sha256((hash_file(self.config_path) + hash_file(self.flights_path)).encode()).hexdigest()
+        return recompile_tma_data(self.tma_data, sim_data, self.flight_data, version, flights_changed)
+
+    def poll(self):
+        '''Reloads the TMA if any of its files changed since the last poll.
+        Returns the names of the rebuilt tables, None if nothing changed.
+        Raises TMAValidationError for invalid data, the previous data stays loaded
+        and the changes are reloaded again with the next change.'''
+
+        stats = self._stats()
+        if stats == self.stats:
+            return None
+        self.changed.update(path for path in stats if stats[path] != self.stats[path])
+        self.stats = stats
+        self.registry.forget(self.tma)
+
+        try:
+            tma_data, rebuilt = self._reload()
+        except TMAValidationError:
+            raise
+        except (KeyError, TypeError, ValueError, sqlite3.DatabaseError) as error:
+            raise TMAValidationError(self.tma, [f'cannot compile the data: {error!r}']) from error
+        problems = validate_config(tma_data.sim_data) or validate_flights(tma_data)
+        if problems:
+            raise TMAValidationError(self.tma, problems)
+        self.tma_data = tma_data
+        self.changed.clear()
+        return rebuilt
+
+
+def watch_scenario(tma, arrival_runways, departure_runways, output_path, start = DEFAULT_WAVE_START,
+                   last_wave = DEFAULT_LAST_WAVE, seed = None, interval = DEFAULT_WATCH_INTERVAL,
+                   instrumentation = SILENT):
+    '''Generates the scenario to output_path, then again whenever the TMA's files change,
+    until interrupted. Without a seed, one is drawn once, so every preview differs only by the edits.'''
+
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    watcher = TMAWatcher(tma)
+
+    def preview(what):
+        started = time.perf_counter()
+        validate_runways(tma, watcher.tma_data, arrival_runways, departure_runways)
+        write_scenario(output_path, iter_scenario_from_data(watcher.tma_data, arrival_runways, departure_runways,
+                                                            start, last_wave, instrumentation, seed),
+                       instrumentation)
+        print(f'{what}, saved {output_path} in {(time.perf_counter() - started) * 1000:.0f} ms.')
+
+    preview(f'Watching {tma} with seed {seed}')
+    try:
+        while True:
+            time.sleep(interval)
+            started = time.perf_counter()
+            try:
+                rebuilt = watcher.poll()
+                if rebuilt is None:
+                    continue
+                reload_ms = (time.perf_counter() - started) * 1000
+                preview(f'{tma} reloaded in {reload_ms:.0f} ms ({", ".join(rebuilt) or "nothing"} rebuilt)')
+            except (OSError, ValueError) as error: # TMAValidationError included, fixed by the next edit
+                print(f'Error: {error}')
+    except KeyboardInterrupt:
+        print(f'Stopped watching {tma}.')